@@ -0,0 +1,5698 @@
+import _thread
+import operator
+import sys
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from itertools import chain, islice
+
+# json, re, subprocess and friends are imported by the functions that use them,
+# so quick commands like "help" and "stats" don't pay for loading them
+
+# TASK_CLI_FILE lets scripts (and the background compactor) point at another file
+TASKS_FILE = os.environ.get("TASK_CLI_FILE", "tasks.json")
+
+# once the journal grows past this many bytes we fold it back into tasks.json
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+# how long a command waits for another running command to finish before giving up
+LOCK_TIMEOUT = 10.0
+LOCK_RETRY_DELAY = 0.05
+
+# commands that change the tasks, they run while holding the store lock
+MUTATING_COMMANDS = {
+    "add",
+    "update",
+    "delete",
+    "mark-todo",
+    "mark-in-progress",
+    "mark-done",
+    "clear-done",
+    "compact",
+    "batch",
+    "import",
+    "migrate",
+    "archive",
+    # report may have to build its counters, a change meanwhile would be missed
+    "report",
+    # search may have to (re)build its index, which must not race with a change
+    "search",
+}
+
+# commands a running "serve" can answer from memory. clear-done asks a question and batch
+# reads stdin, those keep running here and simply wait for the server's lock
+SERVER_COMMANDS = {
+    "add",
+    "update",
+    "delete",
+    "mark-todo",
+    "mark-in-progress",
+    "mark-done",
+    "list",
+    "stats",
+    "search",
+}
+
+# the server collects changes for this long (or this many) before writing them in one go
+WRITE_BEHIND_DELAY = 0.1
+WRITE_BEHIND_MAX_CHANGES = 1000
+
+STATUS_COMMANDS = {
+    "mark-todo": "todo",
+    "mark-in-progress": "in-progress",
+    "mark-done": "done",
+}
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class TaskNotFound(LookupError):
+    pass
+
+
+def storage_mode():
+    # "json" rewrites tasks.json on every change, "journal" only appends one line per change,
+    # "sqlite" keeps the tasks in an indexed database next to tasks.json, "mmap" keeps them
+    # in fixed-width records that are changed in place
+    return os.environ.get("TASK_CLI_STORAGE", "json").lower()
+
+
+# how tasks.json itself is written: "json" (indented, easy to read), "compact" (the same list
+# without the spaces), "jsonl" (one task per line, adding tasks only appends lines) or "binary"
+# (marshal, the fastest to load). An existing file is recognized by its first bytes and keeps
+# its format, TASK_CLI_FORMAT picks the format of a new file and "migrate --to" converts one
+SNAPSHOT_FORMATS = ("json", "compact", "jsonl", "binary")
+BINARY_MAGIC = b"TASKBIN\x01"
+JSONL_HEADER = '{"format": "task-cli/jsonl", "version": 1}\n'
+
+
+def default_format():
+    fmt = os.environ.get("TASK_CLI_FORMAT", "json").lower()
+    return fmt if fmt in SNAPSHOT_FORMATS else "json"
+
+
+def snapshot_format():
+    # None when there is no file yet (or just "[]"), then any format is as good as the other
+    try:
+        with open(TASKS_FILE, "rb") as f:
+            head = f.read(16)
+    except OSError:
+        return None
+
+    if head.startswith(BINARY_MAGIC):
+        return "binary"
+    head = head.lstrip()
+    if head.startswith(b"{"):
+        return "jsonl"
+    if head.startswith(b"[") and head[1:2] not in (b"]", b""):
+        # json.dump(indent=4) puts a newline right after the "["
+        return "json" if head[1:2].isspace() else "compact"
+    return None
+
+
+def journal_path():
+    return TASKS_FILE + ".journal"
+
+
+def sqlite_path():
+    return os.path.splitext(TASKS_FILE)[0] + ".db"
+
+
+def search_path():
+    return TASKS_FILE + ".search"
+
+
+def socket_path():
+    return os.path.abspath(TASKS_FILE) + ".sock"
+
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# statuses are stored as small numbers in memory, the position in this tuple is the code
+STATUS_NAMES = ("todo", "in-progress", "done")
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+
+
+def current_time():
+    return time.strftime(TIME_FORMAT)
+
+
+# --profile and TASK_CLI_TRACE: where did the time of a command go? The phases are measured
+# where the work happens (reading, parsing, encoding, writing, fsync), whatever is left is the
+# command itself ("operation"). TRACE stays None when nobody asked, then every hook below
+# costs one "is None" check
+PROFILE_PHASES = ("load", "decode", "operation", "encode", "write", "fsync")
+TRACE = None
+NOT_TRACED = nullcontext()
+
+
+class Trace:
+    def __init__(self, command):
+        self.command = command
+        self.phases = dict.fromkeys(PROFILE_PHASES, 0.0)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.forwarded = False
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start
+
+    def report(self):
+        total = time.perf_counter() - self.start
+        phases = dict(self.phases)
+        phases["operation"] = max(0.0, total - sum(phases.values()))
+        return {
+            "at": current_time(),
+            "command": self.command,
+            "storage": "server" if self.forwarded else storage_mode(),
+            "total_ms": round(total * 1000, 3),
+            "phases_ms": {name: round(seconds * 1000, 3) for name, seconds in phases.items()},
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+        }
+
+
+def traced(phase):
+    return TRACE.phase(phase) if TRACE is not None else NOT_TRACED
+
+
+def timed(phase, function):
+    # for functions called once per task or chunk: while tracing they get a wrapper that adds
+    # up their time, otherwise the function comes back as it is and the loop pays nothing
+    if TRACE is None:
+        return function
+    phases = TRACE.phases
+    clock = time.perf_counter
+
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phases[phase] += clock() - start
+
+    return wrapper
+
+
+def trace_read(f):
+    # call it when done with f, it counts how far f was read
+    if TRACE is not None:
+        TRACE.bytes_read += getattr(f, "buffer", f).tell()
+
+
+def reading(f):
+    # for generators that may stop before the end: "with open(...) as f, reading(f):"
+    return NOT_TRACED if TRACE is None else counting_reads(f)
+
+
+@contextmanager
+def counting_reads(f):
+    try:
+        yield
+    finally:
+        trace_read(f)
+
+
+def trace_written(size):
+    if TRACE is not None:
+        TRACE.bytes_written += size
+
+
+# lots of tasks share the same timestamps (batches, imports), no need to parse them again
+_date_cache = {}
+
+
+def parse_timestamp(text):
+    # "2024-05-01 13:45:00" -> seconds. The local time is treated as if it was UTC,
+    # that way it converts back to exactly the same text (no DST surprises). Loading a big list
+    # parses two timestamps per task, but they fall on a few thousand days at most, so the
+    # calendar math runs once per day and the rest is the time of day
+    if isinstance(text, str) and len(text) == 19 and text[4] == "-" and text[13] == ":":
+        try:
+            day = _date_cache.get(text[:10])
+            if day is None:
+                import calendar
+
+                if len(_date_cache) > 4096:
+                    _date_cache.clear()
+                day = _date_cache[text[:10]] = calendar.timegm(
+                    (int(text[0:4]), int(text[5:7]), int(text[8:10]), 0, 0, 0)
+                )
+            return day + int(text[11:13]) * 3600 + int(text[14:16]) * 60 + int(text[17:19])
+        except ValueError:
+            pass
+    # anything we don't understand is kept as it is
+    return text
+
+
+_day_cache = {}
+
+
+def day_text(day):
+    # day number (seconds // 86400) -> "2024-05-01". Saving a big list formats two timestamps
+    # per task, but they fall on a few thousand days at most, so strftime runs once per day
+    text = _day_cache.get(day)
+    if text is None:
+        if len(_day_cache) > 4096:
+            _day_cache.clear()
+        text = _day_cache[day] = time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+    return text
+
+
+# "00" to "59", looking them up is a lot faster than formatting them for every timestamp
+TWO_DIGITS = tuple(f"{number:02d}" for number in range(60))
+
+
+def format_timestamp(value):
+    if isinstance(value, int):
+        day, seconds = divmod(value, 86400)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{day_text(day)} {TWO_DIGITS[hours]}:{TWO_DIGITS[minutes]}:{TWO_DIGITS[seconds]}"
+    return value
+
+
+class Task:
+    # one task in memory. A plain dict costs a few hundred bytes per task, this keeps the status as
+    # a small int code and the timestamps as int seconds, so the description is the only big part.
+    # task["status"] style access still works and speaks the tasks.json format
+
+    __slots__ = ("id", "description", "status", "created", "updated", "extra")
+
+    FIELDS = ("id", "description", "status", "createdAt", "updatedAt")
+
+    def __init__(self, id, description, status, created=None, updated=None, extra=None):
+        self.id = id
+        self.description = description
+        self.status = status
+        self.created = created
+        self.updated = updated
+        # any other keys someone put in tasks.json, so we write them back untouched
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data):
+        extra = None
+        if not data.keys() <= FIELD_SET:
+            extra = {key: value for key, value in data.items() if key not in FIELD_SET}
+        status = data.get("status")
+        created = parse_timestamp(data.get("createdAt"))
+        # most tasks were never changed, then both timestamps can share one int
+        if data.get("updatedAt") == data.get("createdAt"):
+            updated = created
+        else:
+            updated = parse_timestamp(data.get("updatedAt"))
+        return cls(
+            data["id"],
+            data.get("description"),
+            STATUS_CODES.get(status, status),
+            created,
+            updated,
+            extra,
+        )
+
+    def to_dict(self):
+        # straight to the fields instead of get() per key, every save calls this once per task
+        created = format_timestamp(self.created)
+        data = {
+            "id": self.id,
+            "description": self.description,
+            "status": self.status_name,
+            "createdAt": created,
+            # a task that was never changed has the same time twice
+            "updatedAt": created if self.updated == self.created else format_timestamp(self.updated),
+        }
+        if None in data.values():
+            data = {key: value for key, value in data.items() if value is not None}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key == "id":
+            value = self.id
+        elif key == "description":
+            value = self.description
+        elif key == "status":
+            value = self.status_name
+        elif key == "createdAt":
+            value = format_timestamp(self.created)
+        elif key == "updatedAt":
+            value = format_timestamp(self.updated)
+        else:
+            value = (self.extra or {}).get(key)
+        return default if value is None else value
+
+    def __setitem__(self, key, value):
+        if key == "description":
+            self.description = value
+        elif key == "status":
+            self.status = STATUS_CODES.get(value, value)
+        elif key == "createdAt":
+            self.created = parse_timestamp(value)
+        elif key == "updatedAt":
+            self.updated = parse_timestamp(value)
+        elif key == "id":
+            self.id = value
+        else:
+            self.extra = dict(self.extra or {}, **{key: value})
+
+    @property
+    def status_name(self):
+        if isinstance(self.status, int):
+            return STATUS_NAMES[self.status]
+        return self.status
+
+    def recency(self):
+        # timestamps we couldn't parse count as the oldest ones
+        return self.updated if isinstance(self.updated, int) else -1
+
+    def __repr__(self):
+        return f"Task({self.to_dict()!r})"
+
+
+FIELD_SET = frozenset(Task.FIELDS)
+
+
+def task_to_json(value):
+    # json.dump calls this for the Task objects it doesn't know how to write
+    if isinstance(value, Task):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def meta_path():
+    return TASKS_FILE + ".meta"
+
+
+class TaskIndex:
+    # secondary indexes we keep up to date on every change instead of recomputing them:
+    # the IDs of each status (their sizes are the stats counters) and the IDs ordered from
+    # least to most recently changed, so "recent" is just reading the end of it
+
+    def __init__(self, ids_by_status=None, recent=()):
+        self.ids_by_status = ids_by_status or {name: set() for name in STATUS_NAMES}
+        # dicts remember insertion order, moving an ID to the end is O(1)
+        self.recent = dict.fromkeys(recent)
+        # [id, status] (None for a deleted task) for every change since the index was read from
+        # its file, so saving it only appends those. None when it wasn't read from the file
+        self.changes = None
+        # the size of the index file and of its first line (the whole index) when it was read
+        self.saved_size = None
+        self.base_size = None
+
+    @classmethod
+    def build(cls, tasks):
+        # the only time we sort: when there is no saved index to start from
+        index = cls()
+        for task in sorted(tasks, key=Task.recency):
+            index.update(task)
+        return index
+
+    def update(self, task):
+        self.move(task.id, task.status_name)
+
+    def move(self, task_id, status):
+        self.forget(task_id)
+        self.ids_by_status.setdefault(status, set()).add(task_id)
+        self.recent[task_id] = None
+        if self.changes is not None:
+            self.changes.append([task_id, status])
+
+    def status_of(self, task_id):
+        for name, ids in self.ids_by_status.items():
+            if task_id in ids:
+                return name
+        return None
+
+    def discard(self, task_id):
+        self.forget(task_id)
+        if self.changes is not None:
+            self.changes.append([task_id, None])
+
+    def forget(self, task_id):
+        for ids in self.ids_by_status.values():
+            if task_id in ids:
+                ids.remove(task_id)
+                break
+        self.recent.pop(task_id, None)
+
+    def replay(self, changes):
+        for task_id, status in changes:
+            if status is None:
+                self.discard(task_id)
+            else:
+                self.move(task_id, status)
+
+    def counts(self):
+        counts = {name: len(ids) for name, ids in self.ids_by_status.items()}
+        # statuses nobody uses anymore don't need to show up, the three normal ones always do
+        return {
+            name: count for name, count in counts.items() if count or name in STATUS_CODES
+        }
+
+    def newest_first(self):
+        return reversed(self.recent)
+
+    def to_json(self):
+        return {
+            "status": {name: sorted(ids) for name, ids in self.ids_by_status.items()},
+            "recent": list(self.recent),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        ids_by_status = {name: set(ids) for name, ids in data["status"].items()}
+        for name in STATUS_NAMES:
+            ids_by_status.setdefault(name, set())
+        return cls(ids_by_status, data["recent"])
+
+
+class TaskCollection:
+    # the tasks in ID order plus a dict from ID to task, so finding or deleting one task
+    # doesn't walk the whole list. next_id only ever goes up, so deleted IDs are never reused
+
+    def __init__(self, tasks=(), next_id=1):
+        self._by_id = {}
+        self.next_id = next_id
+        # a TaskIndex once one is attached, every put/remove keeps it up to date
+        self.index = None
+        for task in tasks:
+            self.put(task)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def get(self, task_id):
+        return self._by_id.get(task_id)
+
+    def ids(self):
+        return self._by_id.keys()
+
+    def allocate_id(self):
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    def put(self, task):
+        # a task that is already here keeps its place in the order
+        task_id = task["id"]
+        self._by_id[task_id] = task
+        if task_id >= self.next_id:
+            self.next_id = task_id + 1
+        if self.index is not None:
+            self.index.update(task)
+
+    def remove(self, task_id):
+        if self.index is not None:
+            self.index.discard(task_id)
+        return self._by_id.pop(task_id, None)
+
+    def to_list(self):
+        return list(self._by_id.values())
+
+
+def replay_journal(tasks, path):
+    import json
+
+    # apply every record in the journal on top of the tasks we already have
+    if not os.path.exists(path):
+        return
+
+    # bytes, so half a UTF-8 character in a half written line only fails that line
+    with traced("decode"), open(path, "rb") as f, reading(f):
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a half written last line (crash while appending), just skip it
+                continue
+
+            if record["op"] == "put":
+                tasks.put(Task.from_dict(record["task"]))
+            elif record["op"] == "delete":
+                tasks.remove(record["id"])
+
+
+def load_meta():
+    import json
+
+    # the meta file sits next to tasks.json and keeps things that are not tasks (like next_id),
+    # so tasks.json itself stays a plain list
+    try:
+        with open(meta_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def save_meta(meta):
+    import json
+
+    write_file_atomically(meta_path(), lambda f: json.dump(meta, f))
+
+
+def index_path():
+    return TASKS_FILE + ".index"
+
+
+def file_stamp(path):
+    # size + modification time, to notice when a file changed behind our back
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def data_stamp():
+    return {
+        "tasks": file_stamp(TASKS_FILE),
+        "journal": file_stamp(journal_path()),
+        "compacting": file_stamp(journal_path() + ".compacting"),
+    }
+
+
+def index_stamp(size):
+    # which tasks.json and journal files the saved index belongs to, and how long the index file
+    # was then
+    return dict(data_stamp(), size=size)
+
+
+def load_index():
+    import json
+
+    # the index file is the whole index as one line, then one line of changes for every save
+    # after it. It belongs to one exact version of tasks.json (the meta file has the stamp), if
+    # the file changed since (edited by hand, or we crashed before saving the index) it is built
+    # again. Returns the index (None when there is none to use) and whether it already has
+    # every change in the journal too
+    try:
+        stamp = load_meta().get("index")
+        with open(index_path(), "rb") as f:
+            data = f.read()
+        current = index_stamp(len(data))
+        if stamp["tasks"] == current["tasks"] and stamp["size"] == current["size"]:
+            base, *saves = data.decode("utf-8").splitlines()
+            index = TaskIndex.from_json(json.loads(base))
+            for line in saves:
+                index.replay(json.loads(line))
+            index.changes = []
+            index.saved_size = len(data)
+            index.base_size = len(base) + 1
+            return index, stamp == current
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None, False
+
+
+def save_index(tasks):
+    import json
+
+    index = tasks.index
+    # most saves change a task or two, so their changes are appended as one short line instead of
+    # writing the whole index again. That happens only when there is no saved index to add to, or
+    # when the changes add up to more than the index itself (loading would get slower and slower)
+    line = None
+    if index.changes is not None:
+        line = (json.dumps(index.changes) + "\n").encode("utf-8") if index.changes else b""
+        try:
+            size = os.path.getsize(index_path())
+        except OSError:
+            size = None
+        if size != index.saved_size or size + len(line) > 2 * index.base_size:
+            line = None
+
+    if line is None:
+        base = (json.dumps(index.to_json()) + "\n").encode("utf-8")
+        write_file_atomically(index_path(), lambda f: f.write(base), binary=True)
+        index.saved_size = index.base_size = len(base)
+    elif line:
+        # no fsync: after a crash the size in the meta file doesn't match and it is built again
+        with traced("write"), open(index_path(), "ab") as f:
+            f.write(line)
+        trace_written(len(line))
+        index.saved_size += len(line)
+    index.changes = []
+
+    # next_id and the index stamp in one meta write
+    save_meta(dict(load_meta(), next_id=tasks.next_id, index=index_stamp(index.saved_size)))
+
+
+def saved_index_is_current():
+    stamp = file_stamp(index_path())
+    saved = load_meta().get("index") or {}
+    return (
+        stamp is not None
+        and os.path.exists(TASKS_FILE)
+        and saved.get("tasks") == file_stamp(TASKS_FILE)
+        and saved.get("size") == stamp[0]
+    )
+
+
+def summary_path():
+    return TASKS_FILE + ".summary"
+
+
+def summary_stamp():
+    # data_stamp() written as plain words, "-" for a file that isn't there
+    return " ".join(
+        "-" if stamp is None else f"{stamp[0]}:{stamp[1]}" for stamp in data_stamp().values()
+    )
+
+
+def save_summary(tasks):
+    # next_id lives in the meta file, the counters in a one line text file
+    # ("<stamp> <todo> <in-progress> <done>") that "stats" reads without even importing json
+    meta = load_meta()
+    if meta.get("next_id") != tasks.next_id:
+        save_meta(dict(meta, next_id=tasks.next_id))
+    write_summary(summary_stamp(), tasks.index.counts())
+
+
+def write_summary(stamp, counts):
+    line = f"{stamp} {counts['todo']} {counts['in-progress']} {counts['done']}\n"
+    write_file_atomically(summary_path(), lambda f: f.write(line))
+
+
+def load_summary_counts():
+    # the counters from the summary file, or None when they don't match the files anymore
+    try:
+        with open(summary_path(), "r", encoding="utf-8") as f:
+            *stamp, todo, in_progress, done = f.read().split()
+        counts = {"todo": int(todo), "in-progress": int(in_progress), "done": int(done)}
+    except (OSError, ValueError):
+        return None
+    if " ".join(stamp) != summary_stamp():
+        return None
+    return counts
+
+
+@contextmanager
+def collector_paused():
+    import gc
+
+    # loading creates a Task per task, and every few hundred new objects the garbage collector
+    # walks all of them again. None of them can be garbage yet, so it only waits until the end
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def load_snapshot():
+    import json
+
+    # Checking if the JSON file exists
+    if not os.path.exists(TASKS_FILE):
+        return []
+
+    try:
+        fmt = snapshot_format()
+        with collector_paused():
+            if fmt == "binary":
+                return read_binary_snapshot()
+            if fmt == "jsonl":
+                # read and parsed line by line, all of it counts as decoding
+                return list(iter_jsonl_snapshot())
+
+            # using "with" so the file closes immidiately after
+            with traced("load"), open(TASKS_FILE, "r", encoding="utf-8") as f:
+                text = f.read()
+                trace_read(f)
+            with traced("decode"):
+                # every task becomes a Task while parsing, so we never hold all the dicts at once
+                return json.loads(text, object_hook=task_from_json)
+
+    # JSONDecodeError is a ValueError too, marshal raises ValueError or EOFError
+    except (ValueError, EOFError):
+        corrupted = os.path.getsize(TASKS_FILE) > 0
+
+    # for when the file is empty or corrupted. Keep a copy of a corrupted file,
+    # otherwise the next save would overwrite whatever is still in there
+    if corrupted:
+        backup = f"{TASKS_FILE}.corrupt-{time.strftime('%Y%m%d%H%M%S')}"
+        os.replace(TASKS_FILE, backup)
+        print(f"Warning: {TASKS_FILE} could not be read, it was moved to {backup}")
+    return []
+
+
+def read_binary_snapshot(path=None):
+    import marshal
+    import struct
+
+    # BINARY_MAGIC, the number of tasks, then one marshal'ed list of
+    # (id, description, status code, created, updated, extra) tuples
+    path = path or TASKS_FILE
+    with traced("load"), open(path, "rb") as f:
+        data = f.read()
+        trace_read(f)
+    with traced("decode"):
+        (count,) = struct.unpack_from("<I", data, len(BINARY_MAGIC))
+        records = marshal.loads(memoryview(data)[len(BINARY_MAGIC) + 4 :])
+        if len(records) != count:
+            raise ValueError(f"{path} is cut short")
+        return [Task(*record) for record in records]
+
+
+def write_binary_snapshot(f, tasks):
+    import marshal
+    import struct
+
+    records = []
+    for task in tasks:
+        if not isinstance(task, Task):
+            task = Task.from_dict(task)
+        records.append(
+            (task.id, task.description, task.status, task.created, task.updated, task.extra)
+        )
+    f.write(BINARY_MAGIC + struct.pack("<I", len(records)))
+    f.write(marshal.dumps(records))
+
+
+def iter_jsonl_snapshot():
+    import json
+
+    decode = timed("decode", json.loads)
+    # read as bytes and decoded per line: half a line can end in half a UTF-8 character, which
+    # would fail the whole text file read instead of just that line
+    with open(TASKS_FILE, "rb") as f, reading(f):
+        for line in f:
+            try:
+                data = decode(line)
+            except ValueError:
+                # a crash in the middle of appending leaves half a line at the very end,
+                # the tasks before it are fine. Anywhere else it's real damage
+                if not line.endswith(b"\n"):
+                    return
+                if not line.strip():
+                    continue
+                raise
+            # the header line has no "id"
+            if "id" in data:
+                yield Task.from_dict(data)
+
+
+def write_jsonl_snapshot(f, tasks):
+    import json
+
+    f.write(JSONL_HEADER)
+    encode = json.JSONEncoder(ensure_ascii=False, default=task_to_json).encode
+    lines = []
+    for task in tasks:
+        lines.append(encode(task) + "\n")
+        if len(lines) >= 1024:
+            f.write("".join(lines))
+            lines.clear()
+    f.write("".join(lines))
+
+
+def iter_snapshot(chunk_size=64 * 1024):
+    import json
+
+    # reads tasks.json a chunk at a time and yields one Task after the other, so we can start
+    # printing right away and only hold one chunk in memory instead of the whole file
+    if not os.path.exists(TASKS_FILE):
+        return
+
+    # the other formats are quick to read as they are
+    fmt = snapshot_format()
+    if fmt == "binary":
+        yield from read_binary_snapshot()
+        return
+    if fmt == "jsonl":
+        yield from iter_jsonl_snapshot()
+        return
+
+    decode = timed("decode", json.JSONDecoder(object_hook=task_from_json).raw_decode)
+    with open(TASKS_FILE, "r", encoding="utf-8") as f, reading(f):
+        read = timed("load", f.read)
+        buffer = ""
+        pos = 0
+        eof = False
+        started = False
+
+        while True:
+            # skip the whitespace and the commas between tasks
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+
+            if pos == len(buffer):
+                if eof:
+                    break
+                buffer = read(chunk_size)
+                pos = 0
+                eof = not buffer
+                continue
+
+            if not started:
+                if buffer[pos] != "[":
+                    raise json.JSONDecodeError("Expecting '['", buffer, pos)
+                started = True
+                pos += 1
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                task, end = decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the task is cut in half by the end of the chunk, read more and try again
+                if eof:
+                    raise
+                more = read(chunk_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+
+            yield task
+            pos = end
+
+
+def load_journal_changes():
+    import json
+
+    # the journal as "ID -> latest version of the task" (None when it was deleted)
+    changes = {}
+    for path in (journal_path() + ".compacting", journal_path()):
+        if not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["op"] == "put":
+                    changes[record["task"]["id"]] = Task.from_dict(record["task"])
+                elif record["op"] == "delete":
+                    changes[record["id"]] = None
+    return changes
+
+
+def load_collection():
+    tasks = TaskCollection(load_snapshot(), next_id=load_meta().get("next_id", 1))
+    tasks.index, has_journal = load_index()
+
+    # changes that were not compacted yet live in the journal files, the ".compacting" one is older
+    for path in (journal_path() + ".compacting", journal_path()):
+        replay_journal(tasks, path)
+
+    if tasks.index is None or len(tasks.index.recent) != len(tasks):
+        tasks.index = TaskIndex.build(tasks)
+    elif has_journal:
+        # the journal store saves the index after every change. Replaying a change the index
+        # already has moves a task to where it already is, so there is nothing new to save
+        tasks.index.changes = []
+    return tasks
+
+
+def task_from_json(data):
+    return Task.from_dict(data) if "id" in data else data
+
+
+def load_tasks():
+    # plain dicts in the tasks.json format, for everyone outside this file
+    return [task.to_dict() for task in load_collection()]
+
+
+def temp_name(path):
+    # per process and thread, so two threads saving at the same time never share a temp file
+    return f"{path}.{os.getpid()}.{_thread.get_ident()}.tmp"
+
+
+def write_file_atomically(path, write, binary=False):
+    # write into a temp file next to the real one, flush it to the disk and then rename it over
+    # the real file. A crash at any point leaves either the old file or the new one, never half of it
+    temp_file = temp_name(path)
+    try:
+        with open(temp_file, "wb") if binary else open(temp_file, "w", encoding="utf-8") as f:
+            # write() encodes into the file's buffer, the profile counts that as encoding
+            with traced("encode"):
+                write(f)
+            with traced("write"):
+                f.flush()
+            with traced("fsync"):
+                os.fsync(f.fileno())
+            trace_written(f.tell())
+        with traced("write"):
+            os.replace(temp_file, path)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+    # make the rename itself durable too (not possible on Windows)
+    if hasattr(os, "O_DIRECTORY"):
+        with traced("fsync"):
+            dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+
+def save_next_id(collection):
+    # next_id is normally saved together with the index, after tasks.json. Loading tasks.json
+    # moves it past the highest ID anyway, so a crash in between can't reuse an ID. Only when the
+    # newest task is gone again does the new next_id have to go first, before tasks.json
+    if collection.next_id <= max(collection.ids(), default=0) + 1:
+        return
+    meta = load_meta()
+    if meta.get("next_id", 1) < collection.next_id:
+        save_meta(dict(meta, next_id=collection.next_id))
+
+
+def save_tasks(tasks, fmt=None):
+    # False when the tasks could not be written, the error is printed already
+    try:
+        # the file keeps the format it has, unless we were told otherwise (migrate)
+        fmt = fmt or snapshot_format() or default_format()
+        collection = None
+        if isinstance(tasks, TaskCollection):
+            collection = tasks
+            save_next_id(collection)
+            tasks = collection.to_list()
+
+        if fmt == "binary":
+            write_file_atomically(
+                TASKS_FILE, lambda f: write_binary_snapshot(f, tasks), binary=True
+            )
+        elif fmt == "jsonl":
+            write_file_atomically(TASKS_FILE, lambda f: write_jsonl_snapshot(f, tasks))
+        elif fmt == "compact":
+            write_file_atomically(TASKS_FILE, lambda f: write_compact_json(f, tasks))
+        else:
+            write_file_atomically(TASKS_FILE, lambda f: write_indented_json(f, tasks))
+
+        # the snapshot now has everything, so the old journal records are not needed anymore
+        for path in (journal_path() + ".compacting", journal_path()):
+            if os.path.exists(path):
+                os.remove(path)
+
+        if collection is not None and collection.index is not None:
+            save_index(collection)
+            save_summary(collection)
+    except PermissionError:
+        print(
+            "\nError: Could not write to tasks.json. Is the file open in another program or read-only?"
+        )
+        return False
+    except Exception as e:
+        print(f"\nAn unexpected error occurred while saving: {e}")
+        return False
+    return True
+
+
+# one task as json.dump(tasks, f, indent=4) writes it inside the list, and as the compact format
+INDENTED_TASK = (
+    '    {\n        "id": %d,\n        "description": %s,\n        "status": "%s",\n'
+    '        "createdAt": "%s",\n        "updatedAt": "%s"\n    }'
+)
+COMPACT_TASK = '{"id":%d,"description":%s,"status":"%s","createdAt":"%s","updatedAt":"%s"}'
+
+
+def task_json_texts(tasks, template, encode):
+    from json.encoder import encode_basestring
+
+    # a Task with just the usual fields goes straight into the template, that is a lot faster
+    # than making a dict for the encoder first. encode_basestring is what json itself uses for
+    # strings with ensure_ascii=False. Anything else (plain dicts, extra fields, timestamps
+    # we couldn't parse, ...) goes through encode()
+    for task in tasks:
+        if (
+            type(task) is Task
+            and task.extra is None
+            and type(task.id) is int
+            and type(task.status) is int
+            and type(task.created) is int
+            and type(task.updated) is int
+            and type(task.description) is str
+        ):
+            created = format_timestamp(task.created)
+            yield template % (
+                task.id,
+                encode_basestring(task.description),
+                STATUS_NAMES[task.status],
+                created,
+                created if task.updated == task.created else format_timestamp(task.updated),
+            )
+        else:
+            yield encode(task)
+
+
+def write_json_list(f, texts, between):
+    # a thousand tasks at a time, so the text of the whole list is never in memory at once
+    texts = iter(texts)
+    separator = ""
+    chunk = list(islice(texts, 1024))
+    while chunk:
+        f.write(separator + between.join(chunk))
+        separator = between
+        chunk = list(islice(texts, 1024))
+
+
+def write_compact_json(f, tasks):
+    import json
+
+    encode = json.JSONEncoder(
+        separators=(",", ":"), ensure_ascii=False, default=task_to_json
+    ).encode
+    f.write("[")
+    write_json_list(f, task_json_texts(tasks, COMPACT_TASK, encode), ",")
+    f.write("]")
+
+
+def write_indented_json(f, tasks):
+    import json
+
+    # the text json.dump(tasks, f, indent=4) writes, without its pure Python encoder. A task
+    # that doesn't fit the template is indented on its own and moved one level in: a JSON
+    # string can't hold a raw newline, so every newline in the text is a line of the layout
+    def encode(task):
+        text = json.dumps(task, indent=4, ensure_ascii=False, default=task_to_json)
+        return "    " + text.replace("\n", "\n    ")
+
+    if not tasks:
+        f.write("[]")
+        return
+    f.write("[\n")
+    write_json_list(f, task_json_texts(tasks, INDENTED_TASK, encode), ",\n")
+    f.write("\n]")
+
+
+def append_tasks(collection, new_tasks):
+    import json
+
+    # a JSON Lines file only needs the new lines at its end, the tasks before them stay untouched.
+    # Not after a crash that left half a line at the end: a line appended to it would be damaged
+    # too, so the file is written again from what could be read. False like save_tasks
+    if not ends_with_newline(TASKS_FILE):
+        return save_tasks(collection)
+    try:
+        save_next_id(collection)
+        with traced("encode"):
+            encode = json.JSONEncoder(ensure_ascii=False, default=task_to_json).encode
+            data = "".join(encode(task) + "\n" for task in new_tasks).encode("utf-8")
+        with open(TASKS_FILE, "ab") as f:
+            with traced("write"):
+                f.write(data)
+                f.flush()
+            with traced("fsync"):
+                os.fsync(f.fileno())
+        trace_written(len(data))
+
+        if collection.index is not None:
+            save_index(collection)
+            save_summary(collection)
+    except PermissionError:
+        print(
+            "\nError: Could not write to tasks.json. Is the file open in another program or read-only?"
+        )
+        return False
+    return True
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return True
+        f.seek(size - 1)
+        return f.read(1) == b"\n"
+
+
+class StoreLock:
+    # an advisory lock on "tasks.json.lock" so only one command at a time does its
+    # read-modify-write, the others wait for their turn (but not forever)
+
+    def __init__(self):
+        self.file = None
+
+    def try_acquire(self):
+        try:
+            import fcntl
+        except ImportError:
+            # no fcntl on Windows, there we just run without the lock
+            return True
+
+        lock_file = open(TASKS_FILE + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        return True
+
+    def release(self):
+        if self.file is not None:
+            # closing the file also lets go of the lock
+            self.file.close()
+            self.file = None
+
+
+@contextmanager
+def store_lock(timeout=None):
+    if timeout is None:
+        timeout = LOCK_TIMEOUT
+
+    lock = StoreLock()
+    deadline = time.monotonic() + timeout
+    while not lock.try_acquire():
+        if time.monotonic() >= deadline:
+            raise LockTimeout(f"{TASKS_FILE} is locked by another command")
+        time.sleep(LOCK_RETRY_DELAY)
+
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def maybe_compact_in_background():
+    import subprocess
+
+    try:
+        size = os.path.getsize(journal_path())
+    except OSError:
+        return
+
+    # if a ".compacting" file exists another compaction is still running
+    if size < JOURNAL_COMPACT_BYTES or os.path.exists(journal_path() + ".compacting"):
+        return
+
+    # run the compaction in a separate process so this command can return right away
+    env = dict(os.environ, TASK_CLI_FILE=os.path.abspath(TASKS_FILE))
+    # TASKS_FILE already is the project's file
+    env.pop("TASK_CLI_PROJECT", None)
+    # through the entry point, which starts from the cached bytecode
+    entry_point = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_cli.py")
+    subprocess.Popen(
+        [sys.executable, entry_point, "compact"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def compact_journal():
+    pending = journal_path() + ".compacting"
+    # the tasks stay the same, the query columns only need to know the new stamp
+    before = summary_stamp()
+
+    # move the journal out of the way first, new changes keep going to a fresh journal meanwhile
+    if not os.path.exists(pending):
+        if not os.path.exists(journal_path()):
+            return False
+        os.replace(journal_path(), pending)
+
+    # we hold the lock, so nothing else is added to the journal while we do this. An earlier
+    # compaction may have crashed after the move, then newer changes already went to a fresh
+    # journal: both are replayed, the ".compacting" one first, since save_tasks removes both
+    tasks = load_collection()
+
+    # save_tasks writes a new snapshot (readers never see half of it) and removes the journal
+    save_tasks(tasks)
+    record_column_changes(before, summary_stamp(), [])
+    return True
+
+
+def history_path():
+    return TASKS_FILE + ".history"
+
+
+def checkpoints_path():
+    return TASKS_FILE + ".history.checkpoints"
+
+
+# a checkpoint (every task, as it was) is written after this many bytes of history, or after as
+# many bytes as the last checkpoint had when that is more. Rebuilding any moment then replays at
+# most about one checkpoint's worth of log, and the checkpoints never take more room than the log
+HISTORY_CHECKPOINT_BYTES = 256 * 1024
+# imports of at least this many tasks are logged as one line plus a checkpoint (record_import)
+HISTORY_IMPORT_ROWS = 10_000
+
+
+def record_history(records, current_tasks):
+    import json
+
+    # every change also goes to an append-only log that is never compacted, one line per change
+    # like the journal plus the time. current_tasks() gives every task as it is right now, for
+    # the checkpoints. No fsync here: losing the last line of history is not losing a task
+    if not records:
+        return
+    # the report counters go to the disk together with the history
+    save_rollup_changes()
+    now = parse_timestamp(current_time())
+    # json.dumps() with options builds a new encoder on every call, this one is reused
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    lines = []
+    for record in records:
+        line = {"at": now, "op": record["op"]}
+        if record["op"] == "put":
+            task = record["task"]
+            line["task"] = task.to_dict() if isinstance(task, Task) else task
+        else:
+            line["id"] = record["id"]
+        lines.append(encode(line) + "\n")
+
+    end = None
+    try:
+        with open(history_path(), "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+            end = f.tell()
+
+        checkpoints = load_checkpoints()
+        # the first checkpoint is where history starts, what happened before it is unknown
+        if not checkpoints or end - checkpoints[-1]["offset"] >= max(
+            HISTORY_CHECKPOINT_BYTES, checkpoints[-1]["size"]
+        ):
+            save_checkpoint(now, end, current_tasks())
+    except OSError:
+        print("Warning: Could not write the task history.", file=sys.stderr)
+    bump_version(end)
+
+
+def record_import(first, last, imported, current_tasks):
+    import json
+
+    # the tasks with IDs first..last were just imported. A small import is a line per task like any
+    # other change (imported() gives them). A big one is a single "import" line and a checkpoint
+    # right after it: every moment after the import is rebuilt from that checkpoint anyway, and a
+    # million history lines would cost as much as the import itself
+    if last - first + 1 < HISTORY_IMPORT_ROWS:
+        record_history([{"op": "put", "task": task} for task in imported()], current_tasks)
+        return
+    save_rollup_changes()
+    now = parse_timestamp(current_time())
+    end = None
+    try:
+        with open(history_path(), "a", encoding="utf-8") as f:
+            line = {"at": now, "op": "import", "first": first, "last": last}
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+            end = f.tell()
+        save_checkpoint(now, end, current_tasks())
+    except OSError:
+        print("Warning: Could not write the task history.", file=sys.stderr)
+    bump_version(end)
+
+
+# the store version: a counter in tasks.json.version that goes up by one with every change that is
+# written (every batch of changes that reaches the history), next to where the history ended then.
+# "has anything changed?" is reading one short line instead of parsing the tasks, and the history
+# between two versions is exactly what changed in between ("watch" sends that on)
+def version_path():
+    return TASKS_FILE + ".version"
+
+
+def load_version():
+    # (version, history offset), (0, 0) before the first change
+    try:
+        with open(version_path(), "r", encoding="utf-8") as f:
+            version, offset = f.read().split()
+        return int(version), int(offset)
+    except (OSError, ValueError):
+        return 0, 0
+
+
+def bump_version(history_end=None):
+    # runs under the store lock like every change. Renamed into place, so readers never see half
+    # of it, but not fsync'ed: it's a hint for watchers and caches, the history behind it isn't either
+    version, offset = load_version()
+    if history_end is not None:
+        offset = history_end
+    temp_file = temp_name(version_path())
+    try:
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write(f"{version + 1} {offset}\n")
+        os.replace(temp_file, version_path())
+    except OSError:
+        print("Warning: Could not update the store version.", file=sys.stderr)
+    return version + 1
+
+
+def read_history_between(start, end):
+    import json
+
+    # the history records written from offset start up to end, oldest first
+    with open(history_path(), "rb") as f:
+        f.seek(start)
+        data = f.read(max(0, end - start))
+    records = []
+    for line in data.decode("utf-8", errors="replace").splitlines():
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+# how often "watch" looks at the version when inotify is not there (or TASK_CLI_WATCH=poll)
+WATCH_POLL_INTERVAL = 0.25
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+
+
+class VersionWatcher:
+    # waits for the version file to change. On Linux inotify (through ctypes, nothing to install)
+    # wakes us the moment it is renamed into place; elsewhere we look at it every WATCH_POLL_INTERVAL
+
+    def __init__(self):
+        self.fd = None
+        if os.environ.get("TASK_CLI_WATCH") == "poll":
+            return
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        # the file itself is replaced on every change, so the directory is what we watch
+        directory = os.path.dirname(os.path.abspath(version_path()))
+        if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    def wait(self, timeout=None):
+        # returns after something may have changed, or after timeout seconds
+        if self.fd is None:
+            time.sleep(WATCH_POLL_INTERVAL if timeout is None else min(timeout, WATCH_POLL_INTERVAL))
+            return
+        import select
+
+        if select.select([self.fd], [], [], timeout)[0]:
+            # the events only wake us up, what matters is the version
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def load_checkpoints():
+    import json
+
+    # one line per checkpoint: when, where in the log to go on from, and the file with the tasks
+    try:
+        with open(checkpoints_path(), "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+
+def save_checkpoint(at, offset, tasks):
+    import json
+
+    path = f"{history_path()}.{offset}.checkpoint"
+    write_file_atomically(path, lambda f: write_binary_snapshot(f, tasks), binary=True)
+    checkpoint = {
+        "at": at,
+        "offset": offset,
+        "file": os.path.basename(path),
+        "size": os.path.getsize(path),
+    }
+    with open(checkpoints_path(), "a", encoding="utf-8") as f:
+        f.write(json.dumps(checkpoint) + "\n")
+
+
+def tasks_as_of(at):
+    import bisect
+    import json
+
+    # the newest checkpoint that is not after "at", plus the bit of log that follows it.
+    # None when history doesn't go back that far
+    checkpoints = load_checkpoints()
+    position = bisect.bisect_right([checkpoint["at"] for checkpoint in checkpoints], at)
+    if position == 0:
+        return None
+    checkpoint = checkpoints[position - 1]
+
+    directory = os.path.dirname(os.path.abspath(history_path()))
+    tasks = {
+        task.id: task
+        for task in read_binary_snapshot(os.path.join(directory, checkpoint["file"]))
+    }
+    with open(history_path(), "r", encoding="utf-8") as f:
+        f.seek(checkpoint["offset"])
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # the log is in time order, everything from here on happened later
+            if record["at"] > at:
+                break
+            if record["op"] == "put":
+                tasks[record["task"]["id"]] = Task.from_dict(record["task"])
+            elif record["op"] == "delete":
+                tasks.pop(record["id"], None)
+            # an "import" is followed by a checkpoint, a moment after it never gets here
+
+    collection = TaskCollection(sorted(tasks.values(), key=lambda task: task.id))
+    collection.index = TaskIndex.build(collection)
+    return collection
+
+
+def task_history(task_id):
+    import json
+
+    # every version of one task, oldest first: (time, record)
+    versions = []
+    if not os.path.exists(history_path()):
+        return versions
+    needle = f'"id":{task_id}'
+    with open(history_path(), "r", encoding="utf-8") as f:
+        for line in f:
+            # most lines are about other tasks, skip those without parsing them
+            if needle not in line and '"op":"import"' not in line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record["op"] == "import":
+                if record["first"] <= task_id <= record["last"]:
+                    versions.append(imported_version(record, task_id))
+            elif record.get("id", record.get("task", {}).get("id")) == task_id:
+                versions.append(record)
+    return versions
+
+
+def imported_version(record, task_id):
+    # a big import has no line per task, the task as it was imported is in the checkpoint after it
+    directory = os.path.dirname(os.path.abspath(history_path()))
+    for checkpoint in load_checkpoints():
+        if checkpoint["at"] >= record["at"]:
+            for task in read_binary_snapshot(os.path.join(directory, checkpoint["file"])):
+                if task.id == task_id:
+                    return {"at": record["at"], "op": "put", "task": task.to_dict()}
+            break
+    return {"at": record["at"], "op": "put", "task": {"id": task_id, "status": "imported"}}
+
+
+# "archive" moves done tasks out of the hot file into tasks.json.archive, so list and stats stop
+# paying for them. The archive starts with a small plain text header (compression, how many
+# tasks, where the data ends), then every archive run appends one compressed block of JSON
+# lines. stats reads the count from the header, only "list --include-archived" decompresses
+ARCHIVE_HEADER_SIZE = 128
+ARCHIVE_MAGIC = "TASKARCHIVE"
+ARCHIVE_COMPRESSIONS = ("gzip", "lzma")
+
+
+def archive_path():
+    return TASKS_FILE + ".archive"
+
+
+def read_archive_header(f):
+    # (compression, task count, end of the data) or None when this is not an archive
+    f.seek(0)
+    fields = f.read(ARCHIVE_HEADER_SIZE).decode("ascii", "replace").split()
+    if len(fields) != 5 or fields[0] != ARCHIVE_MAGIC or fields[2] not in ARCHIVE_COMPRESSIONS:
+        return None
+    try:
+        return fields[2], int(fields[3]), int(fields[4])
+    except ValueError:
+        return None
+
+
+def write_archive_header(f, compression, count, end):
+    header = f"{ARCHIVE_MAGIC} 1 {compression} {count} {end}"
+    f.seek(0)
+    f.write(header.ljust(ARCHIVE_HEADER_SIZE - 1).encode("ascii") + b"\n")
+
+
+def load_archive_header():
+    try:
+        with open(archive_path(), "rb") as f:
+            return read_archive_header(f)
+    except OSError:
+        return None
+
+
+def archived_count():
+    header = load_archive_header()
+    return header[1] if header is not None else 0
+
+
+class ArchiveData:
+    # lets gzip / lzma read the archive only up to the end the header vouches for. Anything after
+    # it is a block from an archive run that crashed, its tasks are still in the hot file
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def read(self, size=-1):
+        left = max(0, self.end - self.f.tell())
+        return self.f.read(left if size is None or size < 0 else min(size, left))
+
+
+def open_archive_block(f, compression, mode):
+    if compression == "lzma":
+        import lzma
+
+        return lzma.LZMAFile(f, mode)
+    import gzip
+
+    # mtime=0 keeps the same tasks giving the same bytes
+    return gzip.GzipFile(fileobj=f, mode=mode, mtime=0)
+
+
+def append_to_archive(tasks, compression=None):
+    import json
+
+    # writes the tasks as one new compressed block and returns how many there were. The header
+    # is only updated once the block is on the disk, so a crash never counts a half block
+    path = archive_path()
+    with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+        header = read_archive_header(f)
+        if header is None:
+            if os.fstat(f.fileno()).st_size > 0:
+                raise ValueError(f"{path} is not a task archive")
+            header = (compression or "gzip", 0, ARCHIVE_HEADER_SIZE)
+            write_archive_header(f, *header)
+        compression, count, end = header
+
+        f.seek(end)
+        f.truncate()
+        added = 0
+        with open_archive_block(f, compression, "wb") as block:
+            lines = []
+            for task in tasks:
+                lines.append(json.dumps(task, ensure_ascii=False, default=task_to_json) + "\n")
+                if len(lines) >= 1024:
+                    block.write("".join(lines).encode("utf-8"))
+                    added += len(lines)
+                    lines.clear()
+            block.write("".join(lines).encode("utf-8"))
+            added += len(lines)
+
+        if added == 0:
+            f.truncate(end)
+            return 0
+        f.flush()
+        os.fsync(f.fileno())
+        write_archive_header(f, compression, count + added, f.seek(0, os.SEEK_END))
+        f.flush()
+        os.fsync(f.fileno())
+    return added
+
+
+def iter_archive():
+    import json
+
+    header = load_archive_header()
+    if header is None:
+        return
+    compression, count, end = header
+    errors = (EOFError, OSError)
+    if compression == "lzma":
+        import lzma
+
+        errors += (lzma.LZMAError,)
+
+    with open(archive_path(), "rb") as f:
+        f.seek(ARCHIVE_HEADER_SIZE)
+        try:
+            with open_archive_block(ArchiveData(f, end), compression, "rb") as data:
+                for line in data:
+                    yield Task.from_dict(json.loads(line))
+        except errors:
+            print(f"Warning: {archive_path()} is damaged, the list stopped early.", file=sys.stderr)
+
+
+def archive_tasks(store, older_than_days=None, compression=None):
+    # moves the done tasks (only those done for longer than older_than_days, if given) to the
+    # archive in one pass, then removes them from the store in one batch
+    cutoff = None
+    if older_than_days is not None:
+        cutoff = parse_timestamp(current_time()) - older_than_days * 86400
+    if isinstance(store, JsonStore):
+        # tasks.json gets rewritten afterwards anyway, so load it once instead of streaming it first
+        store.tasks
+
+    moved = []
+
+    def leaving():
+        for task in store.iter_tasks(status="done"):
+            if not isinstance(task, Task):
+                task = Task.from_dict(task)
+            if cutoff is not None and task.recency() >= cutoff:
+                continue
+            moved.append(task.id)
+            yield task
+
+    if append_to_archive(leaving(), compression) == 0:
+        return 0
+    with store.batch():
+        for task_id in moved:
+            store.delete(task_id)
+    return len(moved)
+
+
+def auto_archive(store):
+    # TASK_CLI_ARCHIVE_AFTER=30 archives tasks done for more than 30 days. Changing commands
+    # check it at most once a day, the day of the last check is kept in tasks.json.meta
+    try:
+        days = int(os.environ.get("TASK_CLI_ARCHIVE_AFTER", ""))
+    except ValueError:
+        return
+    today = current_time()[:10]
+    meta = load_meta()
+    if meta.get("archive_checked") == today:
+        return
+    try:
+        archive_tasks(store, days)
+    except (OSError, ValueError) as e:
+        print(f"Warning: automatic archiving failed: {e}", file=sys.stderr)
+        return
+    # read the meta again, removing the tasks may have saved it meanwhile
+    save_meta(dict(load_meta(), archive_checked=today))
+
+
+# "report" reads tasks.json.rollups: per day the tasks created, the tasks done, the cycle time
+# (created -> done) of those and how many fell into each CYCLE_BUCKETS bucket, plus the number of
+# open tasks per day they were created (their age). Every change adds its bit to these counters,
+# so a report costs the same for a week of tasks or years of them
+ROLLUP_CREATED, ROLLUP_DONE, ROLLUP_CYCLE, ROLLUP_BUCKETS = 0, 1, 2, 3
+CYCLE_BUCKETS = (
+    (3600, "< 1 hour"),
+    (86400, "< 1 day"),
+    (7 * 86400, "< 1 week"),
+    (30 * 86400, "< 30 days"),
+    (90 * 86400, "< 90 days"),
+    (None, "90 days or more"),
+)
+ROLLUP_WIDTH = ROLLUP_BUCKETS + len(CYCLE_BUCKETS)
+# changes made by this process that are not in tasks.json.rollups yet
+_rollup_changes = None
+
+
+def rollups_path():
+    return TASKS_FILE + ".rollups"
+
+
+def rollup_day(seconds):
+    return day_text(seconds // 86400)
+
+
+def cycle_bucket(seconds):
+    for number, (limit, _) in enumerate(CYCLE_BUCKETS):
+        if limit is None or seconds < limit:
+            return number
+
+
+def task_state(task):
+    # (status, created, updated) is all the rollups need to know about a task
+    if isinstance(task, Task):
+        return task.status_name, task.created, task.updated
+    return task["status"], parse_timestamp(task.get("createdAt")), parse_timestamp(task.get("updatedAt"))
+
+
+def add_to_rollups(rollups, was, now):
+    # was / now: task_state() before and after a change, None when the task didn't exist.
+    # Timestamps we couldn't parse are not counted
+    days = rollups["days"]
+    opened = rollups["open"]
+    if was is None and now is not None and isinstance(now[1], int):
+        day = rollup_day(now[1])
+        days.setdefault(day, [0] * ROLLUP_WIDTH)[ROLLUP_CREATED] += 1
+    if was is not None and was[0] != "done" and isinstance(was[1], int):
+        day = rollup_day(was[1])
+        opened[day] = opened.get(day, 0) - 1
+    if now is not None and now[0] != "done" and isinstance(now[1], int):
+        day = rollup_day(now[1])
+        opened[day] = opened.get(day, 0) + 1
+    # done again after being reopened counts again, it was finished twice
+    if now is not None and now[0] == "done" and (was is None or was[0] != "done"):
+        if isinstance(now[2], int):
+            row = days.setdefault(rollup_day(now[2]), [0] * ROLLUP_WIDTH)
+            row[ROLLUP_DONE] += 1
+            if isinstance(now[1], int):
+                cycle = max(0, now[2] - now[1])
+                row[ROLLUP_CYCLE] += cycle
+                row[ROLLUP_BUCKETS + cycle_bucket(cycle)] += 1
+
+
+def rollup_change(was, now):
+    global _rollup_changes
+
+    # only new tasks, status changes and removed open tasks move the counters, a new
+    # description doesn't (and the creation time never changes)
+    if was is not None and now is not None and was[0] == now[0]:
+        return
+    if _rollup_changes is None:
+        _rollup_changes = {"days": {}, "open": {}}
+    add_to_rollups(_rollup_changes, was, now)
+
+
+def forget_rollup_changes():
+    global _rollup_changes
+
+    # the changes were thrown away before they were saved, so they don't count
+    _rollup_changes = None
+
+
+def build_rollups(tasks):
+    # from the tasks as they are now: what happened to tasks that are gone already is unknown
+    rollups = {"days": {}, "open": {}}
+    for task in tasks:
+        add_to_rollups(rollups, None, task_state(task))
+    return rollups
+
+
+def load_rollups():
+    import json
+
+    try:
+        with open(rollups_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_rollups(rollups):
+    import json
+
+    rollups["open"] = {day: count for day, count in rollups["open"].items() if count}
+    write_file_atomically(rollups_path(), lambda f: json.dump(rollups, f, separators=(",", ":")))
+
+
+def save_rollup_changes():
+    global _rollup_changes
+
+    # called when changes reach the disk. Without a rollups file nobody has asked for a report
+    # yet, the first one builds it from the tasks
+    changes, _rollup_changes = _rollup_changes, None
+    if changes is None or not os.path.exists(rollups_path()):
+        return
+    rollups = load_rollups()
+    if rollups is None:
+        return
+    for day, row in changes["days"].items():
+        old = rollups["days"].setdefault(day, [0] * ROLLUP_WIDTH)
+        for column, value in enumerate(row):
+            old[column] += value
+    for day, count in changes["open"].items():
+        rollups["open"][day] = rollups["open"].get(day, 0) + count
+    try:
+        save_rollups(rollups)
+    except OSError:
+        print("Warning: Could not update the report counters.", file=sys.stderr)
+
+
+# "query" works on a columnar copy of the tasks: one array per field instead of one object per
+# task, so a filter or a count is a few operations over whole arrays (NumPy when it's installed,
+# the array module and C-level map/compress otherwise) instead of a Python loop per task. The
+# columns are kept in tasks.json.columns. A change of the JSON stores leaves the changed tasks in
+# tasks.json.columns.changes, the next query puts them into the columns. Anything else (another
+# store, tasks.json edited by hand, an import) builds them again
+COLUMNS_MAGIC = "task-cli/columns-2"
+# past this size the change log is dropped with the columns: nobody has queried for a long time
+COLUMN_CHANGES_BYTES = 4 * 1024 * 1024
+QUERY_GROUPS = ("status", "created-day", "updated-day", "created-month", "updated-month")
+QUERY_OPERATORS = {
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def columns_path():
+    return TASKS_FILE + ".columns"
+
+
+def column_changes_path():
+    return TASKS_FILE + ".columns.changes"
+
+
+def columns_stamp(store):
+    # changes whenever the tasks change, whatever store they are in
+    if isinstance(store, RecordStore):
+        return f"records {store.read_header()[2]}"
+    if isinstance(store, SqliteStore):
+        return f"sqlite {file_stamp(store.path)} {file_stamp(store.path + '-journal')}"
+    return summary_stamp()
+
+
+class TaskColumns:
+    # the tasks as parallel arrays: row N of every array is the same task. Times are seconds
+    # (NO_TIME when unknown), descriptions are only read from the file when a query needs them.
+    # The day numbers are kept too, so a group-by only counts them instead of dividing every time,
+    # and the lengths once more as one byte (255 for anything longer) for query_array.
+    # The rows are ordered by the time the task was last changed
+    FIELDS = (
+        ("ids", "q"),
+        ("created", "q"),
+        ("updated", "q"),
+        ("lengths", "q"),
+        ("created_days", "q"),
+        ("updated_days", "q"),
+        ("statuses", "b"),
+        ("short_lengths", "B"),
+    )
+
+    def __init__(self):
+        from array import array
+
+        for name, typecode in self.FIELDS:
+            setattr(self, name, array(typecode))
+        self._descriptions = []
+        self._load_descriptions = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def descriptions(self):
+        if self._load_descriptions is not None:
+            self._descriptions = self._load_descriptions()
+            self._load_descriptions = None
+        return self._descriptions
+
+    @classmethod
+    def build(cls, tasks):
+        from array import array
+
+        tasks = [task if isinstance(task, Task) else Task.from_dict(task) for task in tasks]
+        created = [task.created if isinstance(task.created, int) else NO_TIME for task in tasks]
+        updated = [task.updated if isinstance(task.updated, int) else NO_TIME for task in tasks]
+        # in the order of the last change: a condition on "updated" (or "idle") is then one range
+        # of rows found by bisect, and an updated-day group is one slice of the mask
+        order = sorted(range(len(tasks)), key=updated.__getitem__)
+        tasks = list(map(tasks.__getitem__, order))
+        created = list(map(created.__getitem__, order))
+        updated = list(map(updated.__getitem__, order))
+        descriptions = [task.description or "" for task in tasks]
+        lengths = list(map(len, descriptions))
+
+        columns = cls()
+        columns.ids = array("q", [task.id for task in tasks])
+        columns.statuses = array(
+            "b", [task.status if isinstance(task.status, int) else -1 for task in tasks]
+        )
+        columns.created = array("q", created)
+        columns.updated = array("q", updated)
+        columns.created_days = array("q", [seconds // 86400 for seconds in created])
+        columns.updated_days = array("q", [seconds // 86400 for seconds in updated])
+        columns.lengths = array("q", lengths)
+        columns.short_lengths = array("B", [min(length, 255) for length in lengths])
+        columns._descriptions = descriptions
+        return columns
+
+    @staticmethod
+    def row(task):
+        # one task as the values of its row, in the order of FIELDS, and its description
+        created = task.created if isinstance(task.created, int) else NO_TIME
+        updated = task.updated if isinstance(task.updated, int) else NO_TIME
+        status = task.status if isinstance(task.status, int) else -1
+        description = task.description or ""
+        length = len(description)
+        days = (created // 86400, updated // 86400)
+        return (task.id, created, updated, length, *days, status, min(length, 255)), description
+
+    def apply(self, changed):
+        # changed: {id: the task as it is now, None if it was deleted}. The rows of those tasks come
+        # out and the new ones go in where their time of change puts them, so every column is
+        # copied once in slices instead of sorting all the rows again
+        from array import array
+        from bisect import bisect_right
+        from itertools import compress
+
+        gone = compress(range(len(self)), map(changed.__contains__, self.ids))
+        rows = sorted(
+            (self.row(task) for task in changed.values() if task is not None),
+            key=lambda row: row[0][2],
+        )
+        # (old row, 1) drops that row, (old row, 0, i) puts new row i in front of it. The
+        # positions are found in the old rows: dropping rows around them keeps the order
+        steps = sorted(
+            [(row, 1, None) for row in gone]
+            + [(bisect_right(self.updated, values[2]), 0, i) for i, (values, _) in enumerate(rows)]
+        )
+
+        def spliced(old, new, value_of):
+            start = 0
+            for position, drop, i in steps:
+                new += old[start:position]
+                if drop:
+                    start = position + 1
+                else:
+                    new.append(value_of(rows[i]))
+                    start = position
+            new += old[start:]
+            return new
+
+        for field, (name, typecode) in enumerate(self.FIELDS):
+            setattr(
+                self, name, spliced(getattr(self, name), array(typecode), lambda row: row[0][field])
+            )
+        self._descriptions = spliced(self.descriptions, [], lambda row: row[1])
+
+    def save(self, path, stamp):
+        import json
+
+        descriptions = "\0".join(self.descriptions)
+        if descriptions.count("\0") != max(len(self) - 1, 0):
+            # they are stored "\0"-separated, ones with a "\0" would come back split up
+            return
+        header = {"format": COLUMNS_MAGIC, "stamp": stamp, "count": len(self), "byteorder": sys.byteorder}
+
+        def write(f):
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            for name, _ in self.FIELDS:
+                getattr(self, name).tofile(f)
+            f.write(descriptions.encode("utf-8"))
+
+        write_file_atomically(path, write, binary=True)
+
+    @classmethod
+    def load(cls, path, stamp=None):
+        import json
+
+        # None when there is no file or it belongs to other tasks. Without a stamp any tasks do,
+        # the one they belong to is columns.stamp
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        with f:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                return None
+            if (
+                header.get("format") != COLUMNS_MAGIC
+                or (stamp is not None and header.get("stamp") != stamp)
+                or header.get("byteorder") != sys.byteorder
+            ):
+                return None
+            columns = cls()
+            columns.stamp = header.get("stamp")
+            count = header["count"]
+            try:
+                for name, _ in cls.FIELDS:
+                    getattr(columns, name).fromfile(f, count)
+            except EOFError:
+                return None
+            start = f.tell()
+
+        def load_descriptions():
+            with open(path, "rb") as f:
+                f.seek(start)
+                text = f.read().decode("utf-8")
+            return text.split("\0") if count else []
+
+        columns._load_descriptions = load_descriptions
+        return columns
+
+
+def load_columns(store):
+    # the stamp is taken before reading, so columns of tasks that changed meanwhile never
+    # get saved under the new stamp
+    stamp = columns_stamp(store)
+    columns = TaskColumns.load(columns_path())
+    if columns is not None and columns.stamp == stamp:
+        return columns
+
+    changed = None if columns is None else load_column_changes(columns.stamp, stamp)
+    if changed is None:
+        columns = TaskColumns.build(store.iter_tasks())
+    else:
+        columns.apply(changed)
+    # the log goes first: a change written right after this gets a new log that starts from
+    # the columns saved here
+    try:
+        os.remove(column_changes_path())
+    except OSError:
+        pass
+    try:
+        columns.save(columns_path(), stamp)
+    except OSError:
+        pass
+    return columns
+
+
+def record_column_changes(before, after, records):
+    import json
+
+    # after a change of a JSON store, from the tasks with stamp before to the ones with after.
+    # Only needed once a query has saved columns. Every line says which tasks it starts from, a
+    # change that isn't here (tasks.json edited by hand, an import) breaks the chain. The same
+    # stamp after means nothing reached the disk
+    if before == after or not os.path.exists(columns_path()):
+        return
+    changes = []
+    for record in records:
+        if record["op"] == "put":
+            task = record["task"]
+            changes.append([task.id, task.description, task.status, task.created, task.updated])
+        else:
+            changes.append([record["id"]])
+    line = json.dumps(
+        {"before": before, "after": after, "changes": changes},
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    try:
+        with open(column_changes_path(), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            size = f.tell()
+        if size > COLUMN_CHANGES_BYTES:
+            os.remove(columns_path())
+            os.remove(column_changes_path())
+    except OSError:
+        pass
+
+
+def load_column_changes(stamp, current):
+    import json
+
+    # {id: task or None} for what changed from the tasks with this stamp to the current ones,
+    # None when the log doesn't lead there. Lines that don't continue the chain are from before
+    # the columns were saved
+    try:
+        with open(column_changes_path(), "rb") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    changed = {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        if entry.get("before") != stamp:
+            continue
+        for change in entry["changes"]:
+            changed[change[0]] = Task(*change) if len(change) > 1 else None
+        stamp = entry["after"]
+        if stamp == current:
+            return changed
+    return None
+
+
+def parse_query_condition(text, now):
+    # "status=done", "idle>7" (days since the last change), "age>=30" (days since created),
+    # "length>200", "id<100", "updated<2024-05-01", "description~milk" -> (column, op, value)
+    import re
+
+    match = re.match(r"\s*([A-Za-z]+)\s*(<=|>=|!=|=|<|>|~)(.*)$", text)
+    if match is None:
+        raise ValueError(f"'{text}' is not a condition like status=done or idle>7")
+    field, op, value = match.groups()
+    field = field.lower()
+    if field == "status":
+        if op not in ("=", "!=") or value not in STATUS_CODES:
+            raise ValueError("status only takes = or != and one of todo, in-progress, done")
+        return "statuses", op, STATUS_CODES[value]
+    if field == "description":
+        if op != "~":
+            raise ValueError("description only takes ~ (contains), like description~milk")
+        return "descriptions", op, value
+    if op == "~":
+        raise ValueError(f"~ only works on the description, not on {field}")
+    if field in ("age", "idle"):
+        # more days ago is an earlier time, so the comparison turns around
+        try:
+            moment = now - round(float(value) * 86400)
+        except ValueError:
+            raise ValueError(f"{field} needs a number of days, not '{value}'")
+        flipped = {"<": ">", ">": "<", "<=": ">=", ">=": "<="}.get(op, op)
+        return ("created" if field == "age" else "updated"), flipped, moment
+    if field in ("created", "updated"):
+        return field, op, parse_since(value)
+    if field in ("id", "length"):
+        try:
+            return ("ids" if field == "id" else "lengths"), op, int(value)
+        except ValueError:
+            raise ValueError(f"{field} needs a number, not '{value}'")
+    raise ValueError(f"unknown field '{field}' (status, description, age, idle, created, updated, id, length)")
+
+
+def with_known_times(conditions):
+    # a time we couldn't read is NO_TIME, earlier than any real one: "updated<2024-05-01" or
+    # "idle>7" would count those tasks. A condition on a time only holds for tasks that have one
+    names = {name for name, _, _ in conditions}
+    return list(conditions) + [
+        (name, "!=", NO_TIME) for name in ("created", "updated") if name in names
+    ]
+
+
+def query_numpy(columns, conditions, group):
+    import numpy
+    from itertools import repeat
+
+    conditions = with_known_times(conditions)
+    arrays = {
+        name: numpy.frombuffer(getattr(columns, name), dtype=numpy.int64)
+        for name, typecode in TaskColumns.FIELDS
+        if typecode == "q"
+    }
+    arrays["statuses"] = numpy.frombuffer(columns.statuses, dtype=numpy.int8)
+
+    mask = numpy.ones(len(columns), dtype=bool)
+    for name, op, value in conditions:
+        if name == "descriptions":
+            mask &= numpy.fromiter(
+                map(operator.contains, columns.descriptions, repeat(value)),
+                dtype=bool,
+                count=len(columns),
+            )
+        else:
+            mask &= QUERY_OPERATORS[op](arrays[name], value)
+
+    if group is None:
+        return int(numpy.count_nonzero(mask))
+    if group == "status":
+        selected = arrays["statuses"][mask]
+        selected = selected[selected >= 0]
+        return dict(enumerate(numpy.bincount(selected, minlength=len(STATUS_NAMES)).tolist()))
+    # bincount over the days since the first one: one pass, where unique() would sort them
+    days = arrays[group.split("-")[0] + "_days"][mask]
+    days = days[days != NO_DAY]
+    if not len(days):
+        return {}
+    first = days.min()
+    counts = numpy.bincount(days - first)
+    found = numpy.flatnonzero(counts)
+    return dict(zip((found + first).tolist(), counts[found].tolist()))
+
+
+# for query_array: a status code byte -> code + 1 (0 for no valid status), a mask byte 1 -> 0xff
+STATUS_BYTES = bytes(code + 1 if code < len(STATUS_NAMES) else 0 for code in range(256))
+MASK_BYTES = bytes.maketrans(b"\x01", b"\xff")
+
+
+def query_array(columns, conditions, group):
+    from collections import Counter
+    from itertools import compress, repeat
+
+    # a mask is a bytes object with one 0/1 byte per task. map() with an operator function and
+    # bytes.translate() run in C, two masks are combined as two big integers
+    count = len(columns)
+    mask = None
+    for name, op, value in with_known_times(conditions):
+        if name == "statuses":
+            condition = columns.statuses.tobytes().translate(byte_table(op, value, signed=True))
+        elif name == "updated":
+            condition = sorted_range_mask(columns.updated, op, value)
+        elif name == "lengths" and value < 255:
+            # past 254 the one byte lengths answer the same as the real ones
+            condition = columns.short_lengths.tobytes().translate(byte_table(op, value))
+        elif name == "descriptions":
+            condition = bytes(map(operator.contains, columns.descriptions, repeat(value)))
+        else:
+            condition = bytes(map(QUERY_OPERATORS[op], getattr(columns, name), repeat(value)))
+        if mask is None:
+            mask = condition
+        else:
+            mask = (
+                int.from_bytes(mask, "little") & int.from_bytes(condition, "little")
+            ).to_bytes(count, "little")
+
+    if group is None:
+        return count if mask is None else mask.count(1)
+    if group == "status":
+        # status code + 1 for the tasks in the mask and 0 for the others, then bytes.count()
+        # per status: no Python object per task
+        statuses = columns.statuses.tobytes().translate(STATUS_BYTES)
+        if mask is not None:
+            statuses = (
+                int.from_bytes(statuses, "little")
+                & int.from_bytes(mask.translate(MASK_BYTES), "little")
+            ).to_bytes(count, "little")
+        return {code: statuses.count(code + 1) for code in range(len(STATUS_NAMES))}
+    if group.startswith("updated"):
+        return count_sorted_groups(columns.updated_days, mask)
+    days = columns.created_days
+    if mask is not None:
+        days = compress(days, mask)
+    counts = Counter(days)
+    counts.pop(NO_DAY, None)
+    return dict(counts)
+
+
+def byte_table(op, value, signed=False):
+    # a bytes.translate() table: every byte value -> 1 when "byte op value" holds, else 0
+    compare = QUERY_OPERATORS[op]
+    return bytes(
+        compare(code - 256 if signed and code >= 128 else code, value) for code in range(256)
+    )
+
+
+def sorted_range_mask(values, op, value):
+    from bisect import bisect_left, bisect_right
+
+    # values are in order, so the rows that match are one range of them (all but one for !=)
+    count = len(values)
+    low, high = bisect_left(values, value), bisect_right(values, value)
+    if op == "!=":
+        return b"\x01" * low + b"\x00" * (high - low) + b"\x01" * (count - high)
+    start, stop = {
+        "<": (0, low),
+        "<=": (0, high),
+        ">": (high, count),
+        ">=": (low, count),
+        "=": (low, high),
+    }[op]
+    return b"\x00" * start + b"\x01" * (stop - start) + b"\x00" * (count - stop)
+
+
+def count_sorted_groups(days, mask):
+    from bisect import bisect_right
+
+    # days are in order, so every day is one run of rows: the mask is counted slice by slice
+    counts = {}
+    start = 0
+    while start < len(days):
+        day = days[start]
+        stop = bisect_right(days, day, start)
+        found = stop - start if mask is None else mask.count(1, start, stop)
+        if found and day != NO_DAY:
+            counts[day] = found
+        start = stop
+    return counts
+
+
+def query_engine(name=None):
+    # NumPy when it is installed, the array module otherwise. Asking for NumPy without
+    # having it raises ImportError
+    if name in (None, "numpy"):
+        try:
+            import numpy  # noqa: F401
+
+            return query_numpy
+        except ImportError:
+            if name == "numpy":
+                raise
+    return query_array
+
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_terms (
+    term TEXT NOT NULL,
+    task_id INTEGER NOT NULL,
+    PRIMARY KEY (term, task_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_search_terms_task ON search_terms (task_id);
+CREATE TABLE IF NOT EXISTS search_meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# the JSON stores can't look a task up without reading tasks.json, so their search index
+# keeps its own copy of what a search result needs to show
+SEARCH_DOCS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_docs (
+    id INTEGER PRIMARY KEY,
+    description TEXT,
+    status TEXT
+);
+"""
+
+
+def tokenize(text):
+    import re
+
+    # words in lower case, \w also matches Persian and other scripts
+    return set(re.findall(r"\w+", (text or "").lower()))
+
+
+def parse_search_query(words):
+    import re
+
+    # "milk bread OR egg*" -> [[("milk", False), ("bread", False)], [("egg", True)]]
+    # words in a group must all match (AND), any group may match (OR), "word*" is a prefix
+    groups = [[]]
+    for word in words:
+        if word in ("OR", "|"):
+            groups.append([])
+            continue
+        prefix = word.endswith("*")
+        tokens = re.findall(r"\w+", word.lower())
+        for i, token in enumerate(tokens):
+            groups[-1].append((token, prefix and i == len(tokens) - 1))
+    return [group for group in groups if group]
+
+
+class SearchIndex:
+    # an inverted index from each word to the IDs of the tasks that contain it, kept in SQLite
+    # so a search only reads the words it asks for instead of every task
+
+    def __init__(self, conn, docs_table="search_docs"):
+        self.conn = conn
+        # "search_docs" for the JSON stores, the SQLite store just uses its own "tasks" table
+        self.docs_table = docs_table
+
+    def exists(self):
+        return (
+            self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'search_terms'"
+            ).fetchone()
+            is not None
+        )
+
+    def create(self):
+        # one statement at a time: executescript() would commit the transaction we are in
+        schema = SEARCH_SCHEMA
+        if self.docs_table == "search_docs":
+            schema += SEARCH_DOCS_SCHEMA
+        for statement in schema.split(";"):
+            if statement.strip():
+                self.conn.execute(statement)
+
+    def put(self, task):
+        self.remove(task["id"])
+        self.conn.executemany(
+            "INSERT INTO search_terms (term, task_id) VALUES (?, ?)",
+            [(term, task["id"]) for term in tokenize(task["description"])],
+        )
+        if self.docs_table == "search_docs":
+            self.conn.execute(
+                "INSERT INTO search_docs (id, description, status) VALUES (?, ?, ?)",
+                (task["id"], task["description"], task["status"]),
+            )
+
+    def remove(self, task_id):
+        self.conn.execute("DELETE FROM search_terms WHERE task_id = ?", (task_id,))
+        if self.docs_table == "search_docs":
+            self.conn.execute("DELETE FROM search_docs WHERE id = ?", (task_id,))
+
+    def rebuild(self, tasks):
+        self.create()
+        self.conn.execute("DELETE FROM search_terms")
+        # filling the table is much faster without the second index, it is added back at the end
+        self.conn.execute("DROP INDEX IF EXISTS idx_search_terms_task")
+        if self.docs_table == "search_docs":
+            self.conn.execute("DELETE FROM search_docs")
+
+        docs = []
+        terms = []
+        for task in tasks:
+            task_id, description = task["id"], task["description"]
+            terms.extend((term, task_id) for term in tokenize(description))
+            if self.docs_table == "search_docs":
+                docs.append((task_id, description, task["status"]))
+            # insert in big chunks, that keeps the memory bounded for huge task lists
+            if len(terms) >= 500_000:
+                self.insert_rebuilt(terms, docs)
+        self.insert_rebuilt(terms, docs)
+        self.create()
+
+    def insert_rebuilt(self, terms, docs):
+        # sorted terms go into the (term, task_id) tree in order, which is the cheapest way in
+        terms.sort()
+        self.conn.executemany("INSERT INTO search_terms (term, task_id) VALUES (?, ?)", terms)
+        if docs:
+            self.conn.executemany(
+                "INSERT INTO search_docs (id, description, status) VALUES (?, ?, ?)", docs
+            )
+        terms.clear()
+        docs.clear()
+
+    def get_stamp(self):
+        import json
+
+        row = self.conn.execute("SELECT value FROM search_meta WHERE key = 'stamp'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_stamp(self, stamp):
+        import json
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO search_meta (key, value) VALUES ('stamp', ?)",
+            (json.dumps(stamp),),
+        )
+
+    def term_ids(self, term, prefix):
+        if prefix:
+            # every word starting with "term" sorts between "term" and "term" + the last character
+            rows = self.conn.execute(
+                "SELECT task_id FROM search_terms WHERE term >= ? AND term < ?",
+                (term, term + "\U0010ffff"),
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT task_id FROM search_terms WHERE term = ?", (term,)
+            )
+        return {row[0] for row in rows}
+
+    def matching_ids(self, groups):
+        found = set()
+        for group in groups:
+            ids = None
+            for term, prefix in group:
+                term_ids = self.term_ids(term, prefix)
+                ids = term_ids if ids is None else ids & term_ids
+                if not ids:
+                    break
+            found |= ids or set()
+        return found
+
+    def search(self, groups, status=None, limit=None):
+        ids = sorted(self.matching_ids(groups))
+        status_sql = " AND status = ?" if status is not None else ""
+        found = 0
+        # SQLite only takes so many ? at once, so ask in chunks
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            params = chunk + ([status] if status is not None else [])
+            rows = self.conn.execute(
+                f"SELECT id, status, description FROM {self.docs_table}"
+                f" WHERE id IN ({', '.join('?' * len(chunk))}){status_sql} ORDER BY id",
+                params,
+            )
+            for row in rows:
+                yield {"id": row[0], "status": row[1], "description": row[2]}
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+
+class JsonStore:
+    # the original storage: the whole list lives in tasks.json and gets rewritten on every change.
+    # every store has the same methods, so main() doesn't care where the tasks actually live
+
+    def __init__(self, tasks=None):
+        self.path = TASKS_FILE
+        # a TaskCollection can be handed in, like the tasks of an earlier time ("list --as-of")
+        self._tasks = tasks
+        # while a batch is running the changes wait here and get written once at the end
+        self._pending = None
+        self._search = None
+        # tasks with this ID or higher are not in tasks.json yet
+        self._saved_next_id = None
+
+    @property
+    def tasks(self):
+        # only read the file the first time a command actually needs the tasks
+        if self._tasks is None:
+            self._tasks = load_collection()
+            self._saved_next_id = self._tasks.next_id
+        return self._tasks
+
+    def exists(self):
+        return os.path.exists(TASKS_FILE) or os.path.exists(journal_path())
+
+    def create(self):
+        save_tasks([])
+
+    def get(self, task_id):
+        return self.tasks.get(task_id)
+
+    def add(self, description):
+        now = parse_timestamp(current_time())
+        new_task = Task(self.tasks.allocate_id(), description, STATUS_CODES["todo"], now, now)
+
+        self.tasks.put(new_task)
+        rollup_change(None, task_state(new_task))
+        self.write_change({"op": "put", "task": new_task})
+        return new_task
+
+    def save(self, task):
+        # the task returned by get() is the one in our list, so it is already changed in memory,
+        # putting it again just updates the status and recency indexes. Only the index still
+        # knows the status it had
+        if self.tasks.index is not None:
+            was = self.tasks.index.status_of(task.id)
+            rollup_change(was and (was, task.created, None), task_state(task))
+        self.tasks.put(task)
+        self.write_change({"op": "put", "task": task})
+
+    def delete(self, task_id):
+        removed = self.tasks.remove(task_id)
+        if removed is None:
+            return False
+        rollup_change(task_state(removed), None)
+        self.write_change({"op": "delete", "id": task_id})
+        return True
+
+    def iter_tasks(self, status=None, recent=False, since=None, limit=None, offset=0):
+        # since is in seconds (like Task.updated), limit/offset pick one page of the result
+        code = STATUS_CODES.get(status, status)
+
+        def wanted(task):
+            if status is not None and task.status != code:
+                return False
+            return since is None or task.recency() >= since
+
+        if recent:
+            tasks = self.iter_recent(wanted, since, limit, offset)
+        else:
+            if self._tasks is None:
+                # nothing loaded yet, so read the file as we go instead of loading all of it
+                tasks = self.stream_tasks()
+            else:
+                tasks = self.tasks
+            # the filter runs while the tasks stream by
+            tasks = (task for task in tasks if wanted(task))
+
+        # islice stops reading as soon as the page is full
+        stop = None if limit is None else offset + limit
+        return islice(tasks, offset, stop)
+
+    def iter_recent(self, wanted, since, limit, offset):
+        import heapq
+
+        if self._tasks is None and limit is not None and not saved_index_is_current():
+            # no index to walk, so keep only the newest offset+limit tasks in a small heap
+            # while streaming, instead of sorting everything. Tasks changed in the same second
+            # come higher ID first, like in the recency index
+            return iter(
+                heapq.nlargest(
+                    offset + limit,
+                    (task for task in self.stream_tasks() if wanted(task)),
+                    key=lambda task: (task.recency(), task.id),
+                )
+            )
+        return self.walk_recency_index(wanted, since)
+
+    def walk_recency_index(self, wanted, since):
+        # the recency index is already in order, no sorting needed
+        for task_id in self.tasks.index.newest_first():
+            task = self.tasks.get(task_id)
+            # everything after this one is older, so we can stop here
+            if since is not None and task.recency() < since:
+                break
+            if wanted(task):
+                yield task
+
+    def stream_tasks(self):
+        # the journal is small, so we keep it in memory and patch the snapshot with it on the way
+        changes = load_journal_changes()
+        try:
+            for task in iter_snapshot():
+                if task.id in changes:
+                    task = changes.pop(task.id)
+                if task is not None:
+                    yield task
+        except (ValueError, EOFError):
+            print(f"Warning: {TASKS_FILE} is damaged, the list stopped early.", file=sys.stderr)
+            return
+
+        # tasks added since the last compaction come after the ones in tasks.json
+        for task in changes.values():
+            if task is not None:
+                yield task
+
+    def is_empty(self):
+        if self._tasks is not None:
+            return len(self._tasks) == 0
+        # one task is enough to know, no need to read the whole file
+        return next(self.iter_tasks(), None) is None
+
+    def count(self):
+        return len(self.tasks)
+
+    def count_by_status(self):
+        if self._tasks is None:
+            # the counters saved in the summary file are enough, if they are still up to date
+            counts = load_summary_counts()
+            if counts is not None:
+                return counts
+
+            # count once and remember it for the next "stats". The stamp is taken before
+            # reading, so counts from a file that changed meanwhile never get saved for it
+            stamp = summary_stamp()
+            counts = self.tasks.index.counts()
+            if summary_stamp() == stamp:
+                try:
+                    write_summary(stamp, counts)
+                except OSError:
+                    pass
+            return counts
+        return self.tasks.index.counts()
+
+    def clear_done(self):
+        # the status index knows exactly which tasks are done
+        done_ids = list(self.tasks.index.ids_by_status["done"])
+        for task_id in done_ids:
+            self.tasks.remove(task_id)
+
+        if done_ids:
+            self.flush([{"op": "delete", "id": task_id} for task_id in done_ids])
+        return len(done_ids)
+
+    @contextmanager
+    def batch(self):
+        # a batch inside a batch just joins it, the outer one writes everything
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+        except BaseException:
+            # nothing reached the disk yet, so the changes are simply forgotten: the tasks get
+            # loaded again the next time they are needed
+            self._pending = None
+            self._tasks = None
+            forget_rollup_changes()
+            raise
+        finally:
+            pending, self._pending = self._pending, None
+            if pending:
+                self.flush(pending)
+
+    def write_change(self, record):
+        if self._pending is not None:
+            self._pending.append(record)
+        else:
+            self.flush([record])
+
+    def flush(self, records):
+        before = summary_stamp()
+        if not self.write_changes(records):
+            # nothing reached the disk, so there is nothing to record either
+            self.forget_changes()
+            return
+        record_column_changes(before, summary_stamp(), records)
+        self.update_search(records)
+        record_history(records, lambda: self.tasks)
+
+    def forget_changes(self):
+        # like a batch that failed: the tasks in memory have changes the file doesn't, they are
+        # loaded again the next time they are needed
+        self._tasks = None
+        forget_rollup_changes()
+
+    def write_changes(self, records):
+        # False when the changes could not be written
+        new_ids = {record["task"].id for record in records if record["op"] == "put"}
+        only_added = all(
+            record["op"] == "put" and record["task"].id >= self._saved_next_id
+            for record in records
+        )
+        if only_added:
+            return self.write_snapshot([self.tasks.get(task_id) for task_id in sorted(new_ids)])
+        return self.write_snapshot()
+
+    def write_snapshot(self, added=None):
+        # added: the new tasks, when nothing else changed since the last save
+        if (
+            added is not None
+            and snapshot_format() == "jsonl"
+            and not os.path.exists(journal_path())
+            and not os.path.exists(journal_path() + ".compacting")
+        ):
+            # nothing that is already in the file changed, so the new tasks are simply appended
+            saved = append_tasks(self.tasks, added)
+        else:
+            # the whole list gets saved, no matter how many changes there were
+            saved = save_tasks(self.tasks)
+        if saved:
+            self._saved_next_id = self.tasks.next_id
+        return saved
+
+    def import_tasks(self, blocks):
+        # blocks: lists of task fields without an ID (see import_row). Everything is saved once
+        # at the end, even in journal mode: a million journal lines would only be compacted again
+        tasks = self.tasks
+        added = []
+        # without a rollups file the report counters are thrown away anyway
+        counting = os.path.exists(rollups_path())
+        for block in blocks:
+            # one block of IDs for the whole block instead of allocate_id() per task
+            first = tasks.next_id
+            tasks.next_id += len(block)
+            for task_id, fields in enumerate(block, first):
+                task = Task(task_id, *fields)
+                tasks.put(task)
+                if counting:
+                    rollup_change(None, task_state(task))
+                added.append(task)
+        if added:
+            if not self.write_snapshot(added):
+                self.forget_changes()
+                return 0
+            self.update_search({"op": "put", "task": task} for task in added)
+            record_import(added[0].id, added[-1].id, lambda: added, lambda: self.tasks)
+        return len(added)
+
+    def search_index(self):
+        if self._search is None:
+            import sqlite3
+
+            self._search = SearchIndex(sqlite3.connect(search_path(), check_same_thread=False))
+        return self._search
+
+    def update_search(self, records):
+        # nobody has searched yet, so there is no index to keep up to date
+        if self._search is None and not os.path.exists(search_path()):
+            return
+
+        index = self.search_index()
+        with index.conn:
+            for record in records:
+                if record["op"] == "put":
+                    index.put(record["task"])
+                else:
+                    index.remove(record["id"])
+            index.set_stamp(data_stamp())
+
+    def search(self, groups, status=None, limit=None):
+        index = self.search_index()
+        # the first search (or one after tasks.json was changed by hand) builds the index
+        if not index.exists() or index.get_stamp() != data_stamp():
+            with index.conn:
+                index.rebuild(self.tasks)
+                index.set_stamp(data_stamp())
+        return index.search(groups, status, limit)
+
+    def close(self):
+        if self._search is not None:
+            self._search.conn.close()
+            self._search = None
+
+
+class JournalStore(JsonStore):
+    # same as JsonStore, but a change is appended to the journal instead of rewriting tasks.json
+
+    def write_changes(self, records):
+        import json
+
+        try:
+            with traced("encode"):
+                data = "".join(
+                    json.dumps(record, ensure_ascii=False, default=task_to_json) + "\n"
+                    for record in records
+                ).encode("utf-8")
+            with open(journal_path(), "ab") as f:
+                with traced("write"):
+                    f.write(data)
+                    f.flush()
+                # one small fsync per change, so a crash can't lose a change we already reported
+                with traced("fsync"):
+                    os.fsync(f.fileno())
+            trace_written(len(data))
+        except PermissionError:
+            print(
+                "\nError: Could not write to the journal. Is the file open in another program or read-only?"
+            )
+            return False
+
+        # the index only gets a short line of changes, so the next command doesn't build it again.
+        # The summary file is tiny, so keeping the counters current costs the same for any task count
+        save_index(self.tasks)
+        save_summary(self.tasks)
+        maybe_compact_in_background()
+        return True
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    createdAt TEXT,
+    updatedAt TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+CREATE INDEX IF NOT EXISTS idx_tasks_updated_at ON tasks (updatedAt);
+"""
+
+SQLITE_COLUMNS = "id, description, status, createdAt, updatedAt"
+
+
+class SqliteStore:
+    # tasks live in an SQLite database. "id" is the primary key and "status"/"updatedAt" have
+    # their own indexes, so looking up one task or one status is a query instead of loading everything
+
+    def __init__(self, path=None):
+        self.path = path or sqlite_path()
+        self._conn = None
+        self._batching = False
+        self._search = None
+        # changes made inside a batch, they go to the history once it is committed
+        self._history = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # sqlite3 is only imported by the people who actually use this backend
+            import sqlite3
+
+            # TaskStore lets one thread at a time use the store, from whichever thread that is
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(SQLITE_SCHEMA)
+        return self._conn
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def writing(self):
+        # every change commits on its own, except inside a batch where everything is one transaction
+        if self._batching:
+            yield
+        else:
+            with self.conn:
+                yield
+
+    @contextmanager
+    def batch(self):
+        if self._batching:
+            yield
+            return
+        self._batching = True
+        self._history = []
+        try:
+            with self.conn:
+                yield
+            record_history(self._history, self.iter_tasks)
+        except BaseException:
+            # the transaction was rolled back, so were the report counters
+            forget_rollup_changes()
+            raise
+        finally:
+            self._batching = False
+            self._history = None
+
+    def changed(self, records):
+        if self._batching:
+            self._history.extend(records)
+        else:
+            record_history(records, self.iter_tasks)
+
+    def create(self):
+        # moving over from tasks.json? then bring the old tasks along
+        tasks = load_tasks()
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO tasks ({SQLITE_COLUMNS}) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        task["id"],
+                        task["description"],
+                        task["status"],
+                        task.get("createdAt"),
+                        task.get("updatedAt"),
+                    )
+                    for task in tasks
+                ],
+            )
+
+    def get(self, task_id):
+        row = self.conn.execute(
+            f"SELECT {SQLITE_COLUMNS} FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def add(self, description):
+        now = current_time()
+        with self.writing():
+            cursor = self.conn.execute(
+                "INSERT INTO tasks (description, status, createdAt, updatedAt) VALUES (?, 'todo', ?, ?)",
+                (description, now, now),
+            )
+            new_task = {
+                "id": cursor.lastrowid,
+                "description": description,
+                "status": "todo",
+                "createdAt": now,
+                "updatedAt": now,
+            }
+            # the search index is updated in the same transaction as the task itself
+            if self.search_index().exists():
+                self.search_index().put(new_task)
+        rollup_change(None, task_state(new_task))
+        self.changed([{"op": "put", "task": new_task}])
+        return new_task
+
+    def import_tasks(self, blocks):
+        # every block is one transaction, nothing but the current block is held in memory
+        first = None
+        count = 0
+        counting = os.path.exists(rollups_path())
+        for block in blocks:
+            with self.writing():
+                # AUTOINCREMENT keeps the highest ID ever used here, the block starts after it
+                row = self.conn.execute(
+                    "SELECT seq FROM sqlite_sequence WHERE name = 'tasks'"
+                ).fetchone()
+                start = (row[0] if row else 0) + 1
+                first = first or start
+                new_tasks = [
+                    {
+                        "id": task_id,
+                        "description": description,
+                        "status": STATUS_NAMES[status],
+                        "createdAt": format_timestamp(created),
+                        "updatedAt": format_timestamp(updated),
+                    }
+                    for task_id, (description, status, created, updated, _) in enumerate(block, start)
+                ]
+                self.conn.executemany(
+                    f"INSERT INTO tasks ({SQLITE_COLUMNS}) VALUES "
+                    "(:id, :description, :status, :createdAt, :updatedAt)",
+                    new_tasks,
+                )
+                if self.search_index().exists():
+                    for task in new_tasks:
+                        self.search_index().put(task)
+            if counting:
+                for task in new_tasks:
+                    rollup_change(None, task_state(task))
+            count += len(new_tasks)
+        if count:
+            last = first + count - 1
+            record_import(
+                first, last, lambda: self.iter_tasks_between(first, last), self.iter_tasks
+            )
+        return count
+
+    def iter_tasks_between(self, first, last):
+        for row in self.conn.execute(
+            f"SELECT {SQLITE_COLUMNS} FROM tasks WHERE id BETWEEN ? AND ? ORDER BY id", (first, last)
+        ):
+            yield dict(row)
+
+    def old_state(self, task_id):
+        row = self.conn.execute(
+            "SELECT status, createdAt FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+        return row and (row[0], parse_timestamp(row[1]), None)
+
+    def save(self, task):
+        with self.writing():
+            was = self.old_state(task["id"])
+            self.conn.execute(
+                "UPDATE tasks SET description = ?, status = ?, updatedAt = ? WHERE id = ?",
+                (task["description"], task["status"], task["updatedAt"], task["id"]),
+            )
+            if self.search_index().exists():
+                self.search_index().put(task)
+        if was is not None:
+            rollup_change(was, task_state(task))
+        self.changed([{"op": "put", "task": dict(task)}])
+
+    def delete(self, task_id):
+        with self.writing():
+            was = self.old_state(task_id)
+            cursor = self.conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+            if self.search_index().exists():
+                self.search_index().remove(task_id)
+        if cursor.rowcount > 0:
+            rollup_change(was, None)
+            self.changed([{"op": "delete", "id": task_id}])
+        return cursor.rowcount > 0
+
+    def search_index(self):
+        if self._search is None:
+            self._search = SearchIndex(self.conn, docs_table="tasks")
+        return self._search
+
+    def search(self, groups, status=None, limit=None):
+        index = self.search_index()
+        if not index.exists():
+            with self.conn:
+                index.rebuild(self.iter_tasks())
+        return index.search(groups, status, limit)
+
+    def iter_tasks(self, status=None, recent=False, since=None, limit=None, offset=0):
+        query = f"SELECT {SQLITE_COLUMNS} FROM tasks"
+        conditions = []
+        params = []
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if since is not None:
+            # the timestamp text sorts the same way as the time itself
+            conditions.append("updatedAt >= ?")
+            params.append(format_timestamp(since))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY updatedAt DESC" if recent else " ORDER BY id"
+        # LIMIT -1 means no limit in SQLite
+        query += " LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+
+        # rows come out of the cursor one by one, we never hold all of them
+        for row in self.conn.execute(query, params):
+            yield dict(row)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is None
+
+    def count_by_status(self):
+        counts = {"todo": 0, "in-progress": 0, "done": 0}
+        for status, count in self.conn.execute(
+            "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+        ):
+            counts[status] = count
+        return counts
+
+    def clear_done(self):
+        with self.writing():
+            done_ids = [
+                row[0] for row in self.conn.execute("SELECT id FROM tasks WHERE status = 'done'")
+            ]
+            if self.search_index().exists():
+                self.conn.execute(
+                    "DELETE FROM search_terms WHERE task_id IN (SELECT id FROM tasks WHERE status = 'done')"
+                )
+            cursor = self.conn.execute("DELETE FROM tasks WHERE status = 'done'")
+        self.changed([{"op": "delete", "id": task_id} for task_id in done_ids])
+        return cursor.rowcount
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+# the "mmap" storage: slot 0 of tasks.records is the header, the record of task N sits at
+# N * RECORD_SIZE. Descriptions are appended to tasks.heap and a record points at its bytes there
+RECORD_SIZE = 32
+# used flag, status code, description length, created, updated, description offset
+RECORD_FORMAT = "<BBxxIqqQ"
+# magic, next_id, todo / in-progress / done counts, version (one more for every change)
+RECORD_HEADER_FORMAT = "<8sIIIIQ"
+RECORD_MAGIC = b"TASKREC1"
+# the file grows by this many records at a time
+RECORD_GROW = 4096
+# a timestamp we couldn't parse can't be stored in a number, it is left out
+NO_TIME = -(2**63)
+# its day number, in the query columns
+NO_DAY = NO_TIME // 86400
+
+
+def records_path():
+    return os.path.splitext(TASKS_FILE)[0] + ".records"
+
+
+def heap_path():
+    return os.path.splitext(TASKS_FILE)[0] + ".heap"
+
+
+class RecordStore:
+    # every task is a fixed-width record in a memory mapped file, so finding task N is a
+    # multiplication and marking it done writes its 32 bytes in place: nothing is parsed and
+    # nothing else is written. The header keeps the counters, so stats reads 32 bytes too
+
+    def __init__(self):
+        import struct
+
+        self.path = records_path()
+        self.record = struct.Struct(RECORD_FORMAT)
+        self.header = struct.Struct(RECORD_HEADER_FORMAT)
+        self._file = None
+        self._map = None
+        self._heap = None
+        self._heap_map = None
+        # while a batch is running the changes for the search index wait here
+        self._pending = None
+        self._search = None
+
+    @property
+    def map(self):
+        if self._map is None:
+            self.remap()
+        return self._map
+
+    def remap(self):
+        # the file may have grown (here or in another command), map all of it again
+        import mmap
+
+        if self._file is None:
+            self._file = open(self.path, "r+b")
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def create(self):
+        # moving over from tasks.json? then bring the old tasks along
+        tasks = load_collection()
+        with open(self.path, "wb") as f:
+            f.write(self.header.pack(RECORD_MAGIC, tasks.next_id, 0, 0, 0, 0))
+            f.truncate(RECORD_GROW * RECORD_SIZE)
+        open(heap_path(), "ab").close()
+
+        with self.batch():
+            counts = [0, 0, 0]
+            for task in tasks:
+                status = task.status if isinstance(task.status, int) else 0
+                self.write_record(task.id, task, status, self.append_description(task.description))
+                counts[status] += 1
+            self.write_header(tasks.next_id, counts, 1)
+
+    def read_header(self):
+        magic, next_id, todo, in_progress, done, version = self.header.unpack_from(self.map, 0)
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"{self.path} is not a task records file")
+        return next_id, [todo, in_progress, done], version
+
+    def write_header(self, next_id, counts, version):
+        self.header.pack_into(self.map, 0, RECORD_MAGIC, next_id, *counts, version)
+
+    def slot(self, task_id):
+        # where the record of this task starts, None when the file doesn't reach that far
+        if not isinstance(task_id, int) or task_id < 1:
+            return None
+        offset = task_id * RECORD_SIZE
+        if offset + RECORD_SIZE > len(self.map):
+            self.remap()
+            if offset + RECORD_SIZE > len(self.map):
+                return None
+        return offset
+
+    def write_record(self, task_id, task, status, description):
+        offset = self.slot(task_id)
+        if offset is None:
+            # new slots are zeros, which reads as "not used"
+            self._file.truncate((task_id + RECORD_GROW) * RECORD_SIZE)
+            self.remap()
+            offset = task_id * RECORD_SIZE
+        desc_offset, length = description
+        self.record.pack_into(
+            self.map,
+            offset,
+            1,
+            status,
+            length,
+            task.created if isinstance(task.created, int) else NO_TIME,
+            task.updated if isinstance(task.updated, int) else NO_TIME,
+            desc_offset,
+        )
+
+    def append_description(self, description):
+        data = (description or "").encode("utf-8")
+        if self._heap is None:
+            self._heap = open(heap_path(), "ab")
+        offset = self._heap.seek(0, os.SEEK_END)
+        self._heap.write(data)
+        self._heap.flush()
+        return offset, len(data)
+
+    def read_description(self, offset, length):
+        import mmap
+
+        if length == 0:
+            return ""
+        if self._heap_map is None or offset + length > len(self._heap_map):
+            if self._heap_map is not None:
+                self._heap_map.close()
+            with open(heap_path(), "rb") as f:
+                self._heap_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._heap_map[offset : offset + length].decode("utf-8", errors="replace")
+
+    def make_task(self, task_id, fields):
+        used, status, length, created, updated, desc_offset = fields
+        return Task(
+            task_id,
+            self.read_description(desc_offset, length),
+            status,
+            None if created == NO_TIME else created,
+            None if updated == NO_TIME else updated,
+        )
+
+    def get(self, task_id):
+        offset = self.slot(task_id)
+        if offset is None:
+            return None
+        fields = self.record.unpack_from(self.map, offset)
+        return self.make_task(task_id, fields) if fields[0] else None
+
+    def add(self, description):
+        next_id, counts, version = self.read_header()
+        now = parse_timestamp(current_time())
+        new_task = Task(next_id, description, STATUS_CODES["todo"], now, now)
+
+        self.write_record(next_id, new_task, new_task.status, self.append_description(description))
+        counts[new_task.status] += 1
+        self.write_header(next_id + 1, counts, version + 1)
+        rollup_change(None, task_state(new_task))
+        self.changed({"op": "put", "task": new_task})
+        return new_task
+
+    def save(self, task):
+        offset = self.slot(task["id"])
+        if offset is None:
+            return
+        used, old_status, length, created, updated, desc_offset = self.record.unpack_from(
+            self.map, offset
+        )
+        if not used:
+            return
+
+        if not isinstance(task, Task):
+            task = Task.from_dict(task)
+        status = task.status if isinstance(task.status, int) else old_status
+        description = (desc_offset, length)
+        # a status change keeps pointing at the same description bytes
+        if self.read_description(desc_offset, length) != task.description:
+            description = self.append_description(task.description)
+        self.write_record(task.id, task, status, description)
+
+        next_id, counts, version = self.read_header()
+        counts[old_status] -= 1
+        counts[status] += 1
+        self.write_header(next_id, counts, version + 1)
+        rollup_change(
+            (STATUS_NAMES[old_status], None if created == NO_TIME else created, None),
+            task_state(task),
+        )
+        self.changed({"op": "put", "task": task})
+
+    def delete(self, task_id):
+        offset = self.slot(task_id)
+        if offset is None or not self.map[offset]:
+            return False
+        _, status, _, created, _, _ = self.record.unpack_from(self.map, offset)
+        self.map[offset : offset + RECORD_SIZE] = bytes(RECORD_SIZE)
+
+        next_id, counts, version = self.read_header()
+        counts[status] -= 1
+        self.write_header(next_id, counts, version + 1)
+        rollup_change((STATUS_NAMES[status], None if created == NO_TIME else created, None), None)
+        self.changed({"op": "delete", "id": task_id})
+        return True
+
+    def import_tasks(self, blocks):
+        # per block: the descriptions go to the heap in one write, the records are written in
+        # place and the header moves next_id past the whole block at once
+        first = self.read_header()[0]
+        count = 0
+        counting = os.path.exists(rollups_path())
+        for block in blocks:
+            next_id, counts, version = self.read_header()
+            if self.slot(next_id + len(block)) is None:
+                self._file.truncate((next_id + len(block) + RECORD_GROW) * RECORD_SIZE)
+                self.remap()
+
+            encoded = [description.encode("utf-8") for description, *_ in block]
+            if self._heap is None:
+                self._heap = open(heap_path(), "ab")
+            offset = self._heap.seek(0, os.SEEK_END)
+            self._heap.write(b"".join(encoded))
+            self._heap.flush()
+
+            records = []
+            for task_id, fields, data in zip(range(next_id, next_id + len(block)), block, encoded):
+                # extra fields are not kept here
+                task = Task(task_id, *fields[:4])
+                self.write_record(task_id, task, task.status, (offset, len(data)))
+                offset += len(data)
+                counts[task.status] += 1
+                if counting:
+                    rollup_change(None, task_state(task))
+                records.append({"op": "put", "task": task})
+            self.write_header(next_id + len(block), counts, version + 1)
+            self.sync()
+            self.update_search(records)
+            count += len(block)
+        if count:
+            last = first + count - 1
+            record_import(
+                first, last, lambda: map(self.get, range(first, last + 1)), self.iter_tasks
+            )
+        return count
+
+    def changed(self, record):
+        if self._pending is not None:
+            self._pending.append(record)
+        else:
+            self.flush([record])
+
+    def flush(self, records):
+        self.sync()
+        self.update_search(records)
+        record_history(records, self.iter_tasks)
+
+    def sync(self):
+        # the descriptions must be on the disk before the records that point at them
+        with traced("fsync"):
+            if self._heap is not None:
+                os.fsync(self._heap.fileno())
+            self.map.flush()
+
+    @contextmanager
+    def batch(self):
+        # the records are changed in place right away, only the history waits for the end.
+        # So there is nothing to roll back, even when the batch fails
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+        finally:
+            pending, self._pending = self._pending, None
+            if pending:
+                self.flush(pending)
+
+    def iter_records(self):
+        # (id, fields) of every used record. Copies a block of records at a time instead of
+        # holding on to the map, so it can still grow while we go
+        self.remap()
+        block = RECORD_GROW * RECORD_SIZE
+        for start in range(RECORD_SIZE, len(self.map), block):
+            chunk = self.map[start : start + block]
+            task_id = start // RECORD_SIZE
+            for fields in self.record.iter_unpack(chunk):
+                if fields[0]:
+                    yield task_id, fields
+                task_id += 1
+
+    def iter_tasks(self, status=None, recent=False, since=None, limit=None, offset=0):
+        import heapq
+
+        code = STATUS_CODES.get(status, status)
+        # only the numbers are looked at, a description is read once its task is shown
+        records = (
+            (task_id, fields)
+            for task_id, fields in self.iter_records()
+            if (code is None or fields[1] == code) and (since is None or fields[4] >= since)
+        )
+        stop = None if limit is None else offset + limit
+        if recent:
+            newest = lambda item: (item[1][4], item[0])
+            if stop is None:
+                records = sorted(records, key=newest, reverse=True)
+            else:
+                records = heapq.nlargest(stop, records, key=newest)
+        for task_id, fields in islice(records, offset, stop):
+            yield self.make_task(task_id, fields)
+
+    def count(self):
+        return sum(self.read_header()[1])
+
+    def is_empty(self):
+        return self.count() == 0
+
+    def count_by_status(self):
+        return dict(zip(STATUS_NAMES, self.read_header()[1]))
+
+    def clear_done(self):
+        removed = [
+            task_id
+            for task_id, fields in self.iter_records()
+            if fields[1] == STATUS_CODES["done"]
+        ]
+        for task_id in removed:
+            self.map[task_id * RECORD_SIZE : (task_id + 1) * RECORD_SIZE] = bytes(RECORD_SIZE)
+        next_id, counts, version = self.read_header()
+        counts[STATUS_CODES["done"]] = 0
+        self.write_header(next_id, counts, version + 1)
+        self.flush([{"op": "delete", "id": task_id} for task_id in removed])
+        return len(removed)
+
+    def search_index(self):
+        if self._search is None:
+            import sqlite3
+
+            self._search = SearchIndex(sqlite3.connect(search_path(), check_same_thread=False))
+        return self._search
+
+    def search_stamp(self):
+        return {"records": self.read_header()[2]}
+
+    def update_search(self, records):
+        # nobody has searched yet, so there is no index to keep up to date
+        if self._search is None and not os.path.exists(search_path()):
+            return
+
+        index = self.search_index()
+        with index.conn:
+            for record in records:
+                if record["op"] == "put":
+                    index.put(record["task"])
+                else:
+                    index.remove(record["id"])
+            index.set_stamp(self.search_stamp())
+
+    def search(self, groups, status=None, limit=None):
+        index = self.search_index()
+        if not index.exists() or index.get_stamp() != self.search_stamp():
+            with index.conn:
+                index.rebuild(self.iter_tasks())
+                index.set_stamp(self.search_stamp())
+        return index.search(groups, status, limit)
+
+    def close(self):
+        for handle in (self._map, self._heap_map, self._file, self._heap):
+            if handle is not None:
+                handle.close()
+        self._map = self._heap_map = self._file = self._heap = None
+        if self._search is not None:
+            self._search.conn.close()
+            self._search = None
+
+
+STORES = {
+    "json": JsonStore,
+    "journal": JournalStore,
+    "sqlite": SqliteStore,
+    "mmap": RecordStore,
+}
+
+
+def storage_name():
+    mode = storage_mode()
+    if mode not in STORES:
+        print(f"Warning: unknown storage '{mode}', using json instead.")
+        mode = "json"
+    return mode
+
+
+def open_store():
+    return STORES[storage_name()]()
+
+
+def change_task(store, task_id, description=None, status=None):
+    # the one way a task gets changed: new description and/or status, a new updatedAt, saved.
+    # None when there is no such task
+    task = store.get(task_id)
+    if task is None:
+        return None
+    if description is not None:
+        task["description"] = description
+    if status is not None:
+        task["status"] = status
+    task["updatedAt"] = current_time()
+    store.save(task)
+    return task
+
+
+def parse_id_list(text):
+    # "10-500,612" -> 10, 11, ..., 500, 612
+    ids = []
+    for part in text.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(f"range {part} goes backwards")
+            ids.extend(range(start, end + 1))
+        else:
+            ids.append(int(part))
+    return ids
+
+
+def split_batch_line(line):
+    import shlex
+
+    # batch lines look like the normal command line, so quotes work like in the shell
+    try:
+        return shlex.split(line)
+    except ValueError:
+        # an apostrophe in a description ("don't forget") is not a broken quote
+        return line.split()
+
+
+def apply_batch_line(store, line):
+    # applies one line and returns what happened, raises ValueError when it can't be done
+    parts = split_batch_line(line)
+    command, args = parts[0].lower(), parts[1:]
+
+    if command == "add":
+        if not args:
+            raise ValueError("missing task description")
+        new_task = store.add(" ".join(args))
+        return f"added task {new_task['id']}"
+
+    if command == "update":
+        if len(args) < 2:
+            raise ValueError("usage: update [id] [new description]")
+        task = change_task(store, int(args[0]), description=" ".join(args[1:]))
+        if task is None:
+            raise ValueError(f"task {args[0]} not found")
+        return f"updated task {task['id']}"
+
+    if command == "delete" or command in STATUS_COMMANDS:
+        if len(args) != 1:
+            raise ValueError(f"usage: {command} [id or ids like 10-500,612]")
+
+        done, missing = [], []
+        for task_id in parse_id_list(args[0]):
+            if command == "delete":
+                found = store.delete(task_id)
+            else:
+                found = change_task(store, task_id, status=STATUS_COMMANDS[command]) is not None
+            (done if found else missing).append(task_id)
+
+        if not done:
+            raise ValueError(f"task {args[0]} not found")
+        message = f"{command} applied to {len(done)} task(s)"
+        if missing:
+            message += f", not found: {', '.join(map(str, missing))}"
+        return message
+
+    raise ValueError(f"'{command}' can't be used in a batch")
+
+
+def run_batch(store, source):
+    # every line is applied to the same loaded tasks and everything is saved once at the end
+    succeeded = failed = 0
+    f = sys.stdin if source == "-" else open(source, "r", encoding="utf-8")
+    try:
+        with store.batch():
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                # skip empty lines and comments
+                if not line or line.startswith("#"):
+                    continue
+
+                try:
+                    message = apply_batch_line(store, line)
+                except ValueError as e:
+                    failed += 1
+                    print(f"line {line_number}: error - {e}")
+                else:
+                    succeeded += 1
+                    print(f"line {line_number}: ok - {message}")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    print(f"Batch finished: {succeeded} succeeded, {failed} failed.")
+
+
+# import/export: the input is read in blocks of about IMPORT_BLOCK_BYTES that end on a row
+# boundary, the blocks are parsed in a process pool (one process per CPU) and come back as small
+# tuples. IDs are handed out a block at a time and the tasks reach the disk in one save, so a
+# million rows cost one parse per row and one write in total instead of a million "add" commands
+IMPORT_FORMATS = ("csv", "jsonl")
+IMPORT_BLOCK_BYTES = 1024 * 1024
+CSV_COLUMNS = ("id", "description", "status", "createdAt", "updatedAt")
+
+
+def guess_format(path, fmt):
+    # --format wins, otherwise the file's extension ("-" is stdin/stdout, JSON Lines then)
+    if fmt is not None:
+        return fmt
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson", "") or path == "-":
+        return "jsonl"
+    return None
+
+
+def read_import_blocks(f, fmt, block_size=None):
+    # yields (line number of the first row, text) blocks that only end where a row ends. A newline
+    # inside a quoted CSV field has an odd number of quotes before it ("" in a field adds two)
+    block_size = block_size or IMPORT_BLOCK_BYTES
+    line_number = 1
+    rest = ""
+    while True:
+        data = f.read(block_size)
+        text = rest + data
+        if not data:
+            if text.strip():
+                yield line_number, text
+            return
+        cut = text.rfind("\n")
+        if fmt == "csv":
+            while cut >= 0 and text.count('"', 0, cut) % 2:
+                cut = text.rfind("\n", 0, cut)
+        if cut < 0:
+            # no complete row yet, a row longer than a block
+            rest = text
+            continue
+        block, rest = text[: cut + 1], text[cut + 1 :]
+        yield line_number, block
+        line_number += block.count("\n")
+
+
+def import_row(data, now):
+    # one row (a dict) -> the fields of a Task without its ID, raises ValueError when it can't be used
+    description = data.get("description")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("missing description")
+    status = data.get("status") or "todo"
+    if status not in STATUS_CODES:
+        raise ValueError(f"unknown status '{status}'")
+    created = parse_timestamp(data.get("createdAt") or now)
+    updated = parse_timestamp(data.get("updatedAt") or created)
+    for value in (created, updated):
+        if not isinstance(value, int):
+            raise ValueError(f"'{value}' is not a time like 2024-05-01 13:45:00")
+    extra = None
+    if not data.keys() <= FIELD_SET:
+        extra = {key: value for key, value in data.items() if key not in FIELD_SET}
+    return description, STATUS_CODES[status], created, updated, extra
+
+
+def parse_import_block(fmt, header, first_line, text, now):
+    # runs in a pool process: (fields of every good row, [(line, error), ...])
+    rows = []
+    errors = []
+    if fmt == "csv":
+        import csv
+        import io
+
+        reader = csv.reader(io.StringIO(text, newline=""))
+        line = first_line
+        for values in reader:
+            # csv counts the lines it read, a quoted field can span several
+            row_line, line = line, first_line + reader.line_num
+            if not values:
+                continue
+            if len(values) != len(header):
+                errors.append((row_line, f"{len(values)} columns instead of {len(header)}"))
+                continue
+            try:
+                rows.append(import_row(dict(zip(header, values)), now))
+            except ValueError as e:
+                errors.append((row_line, str(e)))
+        return rows, errors
+
+    import json
+
+    lines = text.split("\n")
+    try:
+        # the whole block as one JSON array is one call into the C parser
+        items = json.loads("[" + ",".join(line for line in lines if line.strip()) + "]")
+        numbered = zip((n for n, line in enumerate(lines, first_line) if line.strip()), items)
+    except ValueError:
+        # something in here is broken, go line by line to find out where
+        numbered = []
+        for n, line in enumerate(lines, first_line):
+            if not line.strip():
+                continue
+            try:
+                numbered.append((n, json.loads(line)))
+            except ValueError as e:
+                errors.append((n, f"not valid JSON ({e.msg})"))
+    for n, data in numbered:
+        if not isinstance(data, dict):
+            errors.append((n, "not a JSON object"))
+            continue
+        # the header line of a tasks.json in the jsonl format
+        if "format" in data and "description" not in data:
+            continue
+        try:
+            rows.append(import_row(data, now))
+        except ValueError as e:
+            errors.append((n, str(e)))
+    return rows, errors
+
+
+def map_blocks(function, jobs, workers=None):
+    # like map_shards, but for a stream of jobs: at most two per worker are waiting at any time, so
+    # a huge input is never read all at once. The results come back in the order of the jobs
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for job in jobs:
+            yield function(*job)
+        return
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        waiting = deque()
+        for job in jobs:
+            waiting.append(pool.submit(function, *job))
+            if len(waiting) >= 2 * workers:
+                yield waiting.popleft().result()
+        while waiting:
+            yield waiting.popleft().result()
+
+
+def import_tasks(store, f, fmt, workers=None, errors=None):
+    # parses f in parallel and hands the rows to the store, one block at a time. Rows that can't
+    # be used are skipped and end up in errors as (line, message). Returns how many were imported
+    now = current_time()
+    header = None
+    first_line = 1
+    if fmt == "csv":
+        import csv
+
+        header_line = f.readline()
+        header = next(csv.reader([header_line]), [])
+        header = [name.strip() for name in header]
+        if "description" not in header:
+            raise ValueError("the CSV file needs a 'description' column")
+        first_line = 2
+
+    jobs = (
+        (fmt, header, first_line + offset - 1, text, now)
+        for offset, text in read_import_blocks(f, fmt)
+    )
+
+    def blocks():
+        for rows, block_errors in map_blocks(parse_import_block, jobs, workers):
+            if errors is not None:
+                errors.extend(block_errors)
+            if rows:
+                yield rows
+
+    return store.import_tasks(blocks())
+
+
+def export_row(task):
+    if isinstance(task, Task):
+        return [task.id, task.description, task.status_name, task.get("createdAt"), task.get("updatedAt")]
+    return [task.get(column) for column in CSV_COLUMNS]
+
+
+def export_tasks(tasks, f, fmt, chunk_rows=1024):
+    # writes the tasks as they stream by, a chunk of rows per write(). Returns how many
+    count = 0
+    if fmt == "csv":
+        import csv
+        import io
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        for task in tasks:
+            writer.writerow(export_row(task))
+            count += 1
+            if count % chunk_rows == 0:
+                f.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+        f.write(buffer.getvalue())
+        return count
+
+    import json
+
+    encode = json.JSONEncoder(ensure_ascii=False, default=task_to_json).encode
+    lines = []
+    for task in tasks:
+        lines.append(encode(task) + "\n")
+        count += 1
+        if len(lines) >= chunk_rows:
+            f.write("".join(lines))
+            lines.clear()
+    f.write("".join(lines))
+    return count
+
+
+class ReadWriteLock:
+    # lets any number of readers in at once, or a single writer. A waiting writer goes
+    # before new readers, so a steady stream of "GET /tasks" can't keep changes out forever
+
+    def __init__(self):
+        import asyncio
+
+        self.readers = 0
+        self.writing_now = False
+        self.waiting_writers = 0
+        self.changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reading(self):
+        async with self.changed:
+            await self.changed.wait_for(
+                lambda: not self.writing_now and not self.waiting_writers
+            )
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.readers -= 1
+                self.changed.notify_all()
+
+    @asynccontextmanager
+    async def writing(self):
+        async with self.changed:
+            self.waiting_writers += 1
+            try:
+                await self.changed.wait_for(lambda: not self.writing_now and not self.readers)
+            finally:
+                self.waiting_writers -= 1
+            self.writing_now = True
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.writing_now = False
+                self.changed.notify_all()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+HTTP_REASONS = {
+    200: "OK",
+    201: "Created",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+
+class TaskServer:
+    # "serve" keeps one store loaded in memory and runs the commands clients send over a Unix
+    # socket (and, with --http, over a small JSON API). Changes are written behind: they are
+    # collected for WRITE_BEHIND_DELAY and saved together, while the store lock is held so
+    # direct (non-server) commands still line up behind us
+
+    def __init__(self):
+        self.store = None
+        self.stamp = None
+        self.lock = None
+        self.batch = None
+        self.flush_handle = None
+        # HTTP list responses are streamed and give the loop back between chunks,
+        # a change must not land in the middle of one of them
+        self.access = None
+
+    def reload_if_changed(self):
+        # someone changed the files without going through us (clear-done, batch, ...)
+        if self.store is not None and data_stamp() == self.stamp:
+            return
+        if self.store is not None:
+            self.store.close()
+        self.stamp = data_stamp()
+        self.store = open_store()
+        if isinstance(self.store, JsonStore):
+            # load right away, so the first client doesn't pay for it
+            self.store.tasks
+
+    async def refresh(self):
+        # like reload_if_changed, but waits until no list is being streamed from the old store
+        if self.lock is None and data_stamp() != self.stamp:
+            async with self.access.writing():
+                self.reload_if_changed()
+
+    async def start_writing(self):
+        if self.lock is not None:
+            return
+
+        import asyncio
+
+        lock = StoreLock()
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not lock.try_acquire():
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"{TASKS_FILE} is locked by another command")
+            await asyncio.sleep(LOCK_RETRY_DELAY)
+
+        self.lock = lock
+        self.reload_if_changed()
+        self.batch = self.store.batch()
+        self.batch.__enter__()
+
+    def schedule_flush(self):
+        import asyncio
+
+        pending = getattr(self.store, "_pending", None) or []
+        if len(pending) >= WRITE_BEHIND_MAX_CHANGES:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                WRITE_BEHIND_DELAY, self.flush
+            )
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.batch is not None:
+            self.batch.__exit__(None, None, None)
+            self.batch = None
+        # what is on disk now is exactly what we have in memory
+        self.stamp = data_stamp()
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+
+    async def run(self, argv):
+        import io
+        from contextlib import redirect_stdout
+
+        command = argv[0].lower() if argv else None
+        if command not in SERVER_COMMANDS:
+            return f"Error: '{command}' can't be run by the task server.\n"
+
+        # run_command() reads sys.argv and prints, so we hand it the client's argv
+        # and catch what it prints. Only one command runs at a time in the event loop
+        def run():
+            output = io.StringIO()
+            saved_argv = sys.argv
+            sys.argv = ["task_cli.py"] + argv
+            try:
+                with redirect_stdout(output):
+                    run_command(self.store)
+            except Exception as e:
+                output.write(f"\nAn unexpected error occurred: {e}\n")
+            finally:
+                sys.argv = saved_argv
+            return output.getvalue()
+
+        try:
+            if command in MUTATING_COMMANDS:
+                return await self.write(lambda store: run())
+            await self.refresh()
+        except LockTimeout:
+            return "Error: Another task_cli command is still working on your tasks. Please try again in a moment.\n"
+        return run()
+
+    async def write(self, change):
+        # the one way in for changes, from the socket and from HTTP alike
+        async with self.access.writing():
+            await self.start_writing()
+            try:
+                return change(self.store)
+            finally:
+                self.schedule_flush()
+
+    async def handle_client(self, reader, writer):
+        import json
+
+        try:
+            request = json.loads(await reader.readline())
+            output = await self.run(request["argv"])
+            writer.write((json.dumps({"output": output}, ensure_ascii=False) + "\n").encode())
+            await writer.drain()
+        except (ValueError, KeyError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_http(self, reader, writer):
+        import asyncio
+
+        # a tiny HTTP/1.1 server: one request after the other on each connection (keep-alive),
+        # bodies are JSON with a Content-Length, list responses are sent in chunks
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+
+                try:
+                    await self.answer_http(method.upper(), target, body, writer, headers)
+                except HTTPError as e:
+                    self.send_json(writer, e.status, {"error": str(e)})
+                except LockTimeout:
+                    self.send_json(
+                        writer, 503, {"error": "another task_cli command is working on the tasks"}
+                    )
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def send_json(self, writer, status, data, etag=None):
+        import json
+
+        body = json.dumps(data, ensure_ascii=False, default=task_to_json).encode()
+        etag_header = f"ETag: {etag}\r\n" if etag else ""
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"{etag_header}"
+            f"Content-Length: {len(body)}\r\n\r\n".encode()
+            + body
+        )
+
+    def etag(self):
+        # the store version, plus the changes still waiting to be written: those are already in
+        # what we answer, but the version only goes up once they reach the disk
+        pending = getattr(self.store, "_pending", None) or getattr(self.store, "_history", None)
+        version = load_version()[0]
+        return f'"{version}-{len(pending)}"' if pending else f'"{version}"'
+
+    def not_modified(self, headers, writer):
+        # the client still has what we would send (If-None-Match with the current ETag):
+        # answer 304 without a body and without reading any task
+        etag = self.etag()
+        if (headers or {}).get("if-none-match") != etag:
+            return False
+        writer.write(
+            f"HTTP/1.1 304 Not Modified\r\nETag: {etag}\r\nContent-Length: 0\r\n\r\n".encode()
+        )
+        return True
+
+    async def answer_http(self, method, target, body, writer, headers=None):
+        from urllib.parse import parse_qs, urlsplit
+
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if parts == ["stats"] and method == "GET":
+            await self.refresh()
+            if self.not_modified(headers, writer):
+                return
+            counts = self.store.count_by_status()
+            self.send_json(writer, 200, dict(counts, total=sum(counts.values())), self.etag())
+        elif parts == ["version"] and method == "GET":
+            await self.refresh()
+            self.send_json(writer, 200, {"version": load_version()[0]}, self.etag())
+        elif parts == ["tasks"] and method == "GET":
+            await self.stream_task_list(query, writer, headers)
+        elif parts == ["tasks"] and method == "POST":
+            description = read_json_body(body).get("description")
+            if not isinstance(description, str) or not description.strip():
+                raise HTTPError(400, "'description' must be a non-empty string")
+            task = await self.write(lambda store: store.add(description))
+            self.send_json(writer, 201, task)
+        elif len(parts) in (2, 3) and parts[0] == "tasks":
+            try:
+                task_id = int(parts[1])
+            except ValueError:
+                raise HTTPError(404, f"no such task: {parts[1]}")
+            if len(parts) == 3:
+                # POST /tasks/7/mark-done, the same words as the CLI
+                if parts[2] not in STATUS_COMMANDS:
+                    raise HTTPError(404, f"unknown action '{parts[2]}'")
+                if method != "POST":
+                    raise HTTPError(405, f"use POST for {parts[2]}")
+                changes = {"status": STATUS_COMMANDS[parts[2]]}
+            elif method == "PATCH":
+                changes = read_json_body(body)
+            elif method not in ("GET", "DELETE"):
+                raise HTTPError(405, f"{method} is not supported here")
+
+            if method == "GET":
+                await self.refresh()
+                if self.not_modified(headers, writer):
+                    return
+                task = self.store.get(task_id)
+            elif method == "DELETE":
+                deleted = await self.write(lambda store: store.delete(task_id))
+                task = {"id": task_id, "deleted": True} if deleted else None
+            else:
+                task = await self.write(lambda store: update_task(store, task_id, changes))
+            if task is None:
+                raise HTTPError(404, f"task {task_id} not found")
+            self.send_json(writer, 200, task, self.etag())
+        else:
+            raise HTTPError(404, f"nothing at {url.path}")
+
+    async def stream_task_list(self, query, writer, headers=None):
+        import json
+
+        # GET /tasks?status=done&limit=20&offset=40&since=2024-05-01, read like the CLI's options
+        args = [query["status"]] if "status" in query else []
+        for name in ("limit", "offset", "since"):
+            if name in query:
+                args += [f"--{name}", query[name]]
+        try:
+            status_filter, options = parse_list_options(args)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if status_filter not in ("todo", "in-progress", "done", "recent", None):
+            raise HTTPError(400, f"'{status_filter}' is not a valid status")
+
+        await self.refresh()
+        if self.not_modified(headers, writer):
+            return
+        async with self.access.reading():
+            if status_filter == "recent":
+                tasks = self.store.iter_tasks(recent=True, **options)
+            else:
+                tasks = self.store.iter_tasks(status=status_filter, **options)
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/json\r\n"
+                + f"ETag: {self.etag()}\r\n".encode()
+                + b"Transfer-Encoding: chunked\r\n\r\n"
+            )
+            # one big JSON array, cut into chunks of a few hundred tasks
+            rows = ["["]
+            separator = ""
+            for task in tasks:
+                rows.append(separator + json.dumps(task, ensure_ascii=False, default=task_to_json))
+                separator = ","
+                if len(rows) >= 512:
+                    write_chunk(writer, "".join(rows))
+                    rows.clear()
+                    await writer.drain()
+            rows.append("]")
+            write_chunk(writer, "".join(rows))
+            writer.write(b"0\r\n\r\n")
+
+    async def serve(self, http_port=None):
+        import asyncio
+        import signal
+
+        self.access = ReadWriteLock()
+        self.reload_if_changed()
+        path = socket_path()
+        server = await asyncio.start_unix_server(self.handle_client, path=path)
+        http_server = None
+        if http_port is not None:
+            # only this machine can talk to us, there is no authentication
+            http_server = await asyncio.start_server(self.handle_http, "127.0.0.1", http_port)
+            port = http_server.sockets[0].getsockname()[1]
+            print(f"HTTP API is listening on http://127.0.0.1:{port}", flush=True)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        print(f"Task server is listening on {path} (Ctrl+C to stop)", flush=True)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if http_server is not None:
+                http_server.close()
+            # nothing may stay unwritten when we go
+            self.flush()
+            self.store.close()
+            if os.path.exists(path):
+                os.remove(path)
+            print("Task server stopped.")
+
+
+def read_json_body(body):
+    import json
+
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "the body is not valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPError(400, "the body must be a JSON object")
+    return data
+
+
+def update_task(store, task_id, changes):
+    # PATCH /tasks/<id> with {"description": ...} and/or {"status": ...}
+    unknown = set(changes) - {"description", "status"}
+    if unknown:
+        raise HTTPError(400, f"can't change {', '.join(sorted(unknown))}")
+    if "status" in changes and changes["status"] not in STATUS_NAMES:
+        raise HTTPError(400, f"'{changes['status']}' is not a valid status")
+    # like POST and the update command: a task can't lose its description
+    if "description" in changes and (
+        not isinstance(changes["description"], str) or not changes["description"].strip()
+    ):
+        raise HTTPError(400, "'description' must be a non-empty string")
+
+    if not changes:
+        return store.get(task_id)
+    return change_task(store, task_id, changes.get("description"), changes.get("status"))
+
+
+def write_chunk(writer, text):
+    data = text.encode()
+    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+
+def start_server(http_port=None):
+    import asyncio
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        print("Error: serve needs Unix domain sockets, which this system doesn't have.")
+        return
+
+    if os.path.exists(socket_path()):
+        if forward_to_server(["stats"]) is not None:
+            print("Error: A task server is already running for this task file.")
+            return
+        # left over from a server that crashed
+        os.remove(socket_path())
+
+    asyncio.run(TaskServer().serve(http_port))
+
+
+def forward_to_server(argv):
+    # hands the command to a running "serve" and returns what it printed,
+    # or None when there is no server (then we do the work ourselves)
+    path = socket_path()
+    if os.environ.get("TASK_CLI_SERVER") == "off" or not os.path.exists(path):
+        return None
+
+    import json
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(path)
+        except OSError:
+            return None
+
+        # from here on the server may already have run the command, so we never fall back
+        client.sendall((json.dumps({"argv": argv}) + "\n").encode())
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    finally:
+        client.close()
+
+    try:
+        return json.loads(response)["output"]
+    except (ValueError, KeyError):
+        return "Error: The task server stopped before answering.\n"
+
+
+def silence_broken_pipe():
+    # whoever was reading stopped early (like "list | head"), that's fine.
+    # Point stdout at devnull so Python doesn't complain again while exiting
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+
+def print_task_rows(tasks, chunk_rows=256):
+    # one write() per chunk of rows instead of one print() per task
+    write = sys.stdout.write
+    rows = []
+    count = 0
+    for task in tasks:
+        count += 1
+        if isinstance(task, Task):
+            # straight to the fields, skipping the dict-style lookups
+            task_id, status, description = task.id, task.status_name, task.description
+        else:
+            task_id, status, description = task["id"], task["status"], task["description"]
+        rows.append(f"     {task_id}      {status}                 {description}\n")
+        if len(rows) >= chunk_rows:
+            write("".join(rows))
+            rows.clear()
+    write("".join(rows))
+    return count
+
+
+def parse_since(text):
+    # accepts "2024-05-01 13:45:00" or just a day "2024-05-01"
+    if len(text) == 10:
+        text += " 00:00:00"
+    seconds = parse_timestamp(text)
+    if not isinstance(seconds, int):
+        raise ValueError(f"'{text}' is not a time like 2024-05-01 or '2024-05-01 13:45:00'")
+    return seconds
+
+
+def parse_list_options(args):
+    # "list done --limit 20 --offset 40 --since 2024-05-01" -> ("done", {...}),
+    # "as_of", "include_archived" and "all_projects" are only there when they were given
+    status_filter = None
+    options = {"limit": None, "offset": 0, "since": None}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ("--include-archived", "--all-projects"):
+            options[arg[2:].replace("-", "_")] = True
+        elif arg in ("--limit", "--offset", "--since", "--as-of"):
+            if not args:
+                raise ValueError(f"{arg} needs a value")
+            value = args.pop(0)
+            name = arg[2:].replace("-", "_")
+            if name in ("since", "as_of"):
+                options[name] = parse_since(value)
+            else:
+                try:
+                    options[name] = int(value)
+                except ValueError:
+                    raise ValueError(f"{arg} needs a number, not '{value}'")
+                if options[name] < 0:
+                    raise ValueError(f"{arg} can't be negative")
+        elif status_filter is None:
+            status_filter = arg.lower()
+        else:
+            raise ValueError(f"unexpected argument '{arg}'")
+    return status_filter, options
+
+
+def show_help():
+    print("\n--- Task Tracker CLI Help ---")
+    print("Usage: python task_cli.py [command] [arguments]")
+
+    print("\n VIEWING TASKS")
+    print("  list                    - Display all tasks by their ID (Oldest first)")
+    print("  list [status]           - Filter by: todo, in-progress, or done")
+    print(
+        "  list recent             - View all tasks sorted by the last time they were changed"
+    )
+    print("  list ... --limit N      - Only show N tasks (add --offset N for the next page)")
+    print("  list ... --since TIME   - Only tasks changed since TIME (like 2024-05-01)")
+    print("  list ... --as-of TIME   - The tasks as they were at TIME")
+    print("  list ... --include-archived - Also show the archived tasks")
+    print("  list ... --all-projects - The tasks of every project (stats --all-projects too)")
+    print("  history [id]            - Every change made to a task")
+    print("  version                 - A number that goes up with every change (cheap to check)")
+    print("  watch [--once]          - Wait for changes and print the changed tasks as JSON lines")
+    print("  query [conditions]      - Count tasks, like: query status=in-progress idle>7")
+    print("                            add --group-by status|created-day|updated-month|...")
+    print("  search [words]          - Find tasks containing all the words")
+    print("                            'milk OR bread', 'groc*', add --status done to filter")
+
+    print("\n  MANAGING TASKS")
+    print(
+        "  add [description]       - Create a new task (automatically sets to 'todo')"
+    )
+    print("  update [id] [text]      - Change the description of an existing task")
+    print("  delete [id]             - Permanently remove a task from your list")
+
+    print("\n UPDATING STATUS")
+    print("  mark-todo [id]          - Move a task back to the 'todo' list")
+    print("  mark-in-progress [id]   - Mark a task as currently being worked on")
+    print("  mark-done [id]          - Complete a task (Great job!)")
+
+    print("\n BATCH")
+    print("  batch [file]            - Apply many commands (one per line) from a file or stdin")
+    print("                            e.g. 'mark-done 10-500,612', saved only once at the end")
+    print("  import [file]           - Add the tasks of a CSV or JSON Lines file (- for stdin)")
+    print("  export [file]           - Write the tasks as CSV or JSON Lines (stdout by default)")
+
+    print("\n MAINTENANCE")
+    print("  clear-done [--yes]      - Remove all 'done' tasks to keep your file clean")
+    print("  archive                 - Move 'done' tasks to a compressed archive (--older-than DAYS)")
+    print("  compact                 - Fold the journal back into tasks.json")
+    print("  migrate --to [format]   - Rewrite tasks.json as json, compact, jsonl or binary")
+    print("  serve                   - Keep the tasks in memory and answer other commands fast")
+    print("  serve --http [PORT]     - ...and answer a JSON API on localhost (default port 8765)")
+    print("  stats                   - Show a summary of your productivity")
+    print("  report [--days N]       - Throughput, cycle time and age of open tasks (default 30 days)")
+    print("  [command] --project NAME - Work on the tasks of another project")
+    print("  [command] --profile     - Show where the command's time went (--profile=FILE for cProfile)")
+    print("  help                    - Show this menu")
+    print("-" * 40)
+
+
+# projects: "--project NAME" (or TASK_CLI_PROJECT) works on projects/NAME/tasks.json next to
+# tasks.json instead, with its own sidecar files and its own lock, so a change only locks and
+# rewrites that one shard. "list --all-projects" and "stats --all-projects" read every shard in
+# a process pool and put the answers together. tasks.json itself is the "default" project
+DEFAULT_PROJECT = "default"
+# the tasks.json we started with, while a project's file is in TASKS_FILE
+PROJECTS_ROOT = None
+
+
+def project_option():
+    # takes "--project NAME" out of the command line, the commands never see it
+    name = os.environ.get("TASK_CLI_PROJECT") or None
+    if "--project" in sys.argv:
+        at = sys.argv.index("--project")
+        if at + 1 >= len(sys.argv):
+            raise ValueError("--project needs a name")
+        name = sys.argv[at + 1]
+        del sys.argv[at : at + 2]
+    if name is not None:
+        check_project_name(name)
+    return name
+
+
+def check_project_name(name):
+    if name.startswith(".") or os.sep in name or "/" in name or not name.strip():
+        raise ValueError(f"'{name}' can't be a project name")
+
+
+def project_file(name, root):
+    if name == DEFAULT_PROJECT:
+        return root
+    return os.path.join(os.path.dirname(os.path.abspath(root)), "projects", name, os.path.basename(root))
+
+
+def project_shards(root):
+    # (name, tasks file) of every project, the default one first
+    shards = [(DEFAULT_PROJECT, root)]
+    directory = os.path.join(os.path.dirname(os.path.abspath(root)), "projects")
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        names = []
+    for name in names:
+        if os.path.isdir(os.path.join(directory, name)) and name != DEFAULT_PROJECT:
+            shards.append((name, project_file(name, root)))
+    return shards
+
+
+@contextmanager
+def using_tasks_file(path):
+    global TASKS_FILE
+    saved = TASKS_FILE
+    TASKS_FILE = path
+    try:
+        yield
+    finally:
+        TASKS_FILE = saved
+
+
+@contextmanager
+def using_project(name):
+    global PROJECTS_ROOT
+    if name is None:
+        yield
+        return
+    path = project_file(name, TASKS_FILE)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    saved_root, PROJECTS_ROOT = PROJECTS_ROOT, PROJECTS_ROOT or TASKS_FILE
+    try:
+        with using_tasks_file(path):
+            yield
+    finally:
+        PROJECTS_ROOT = saved_root
+
+
+def map_shards(function, jobs):
+    # one process per shard (up to one per CPU). With a single shard or a single CPU a pool
+    # only adds the cost of starting it
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if workers <= 1:
+        return [function(*job) for job in jobs]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, *zip(*jobs)))
+
+
+def shard_counts(path):
+    # runs in a pool process: (counts by status, archived count) of one shard
+    with using_tasks_file(path):
+        store = open_store()
+        try:
+            # a shard that doesn't exist yet stays that way, just reading must not create it
+            if store.exists():
+                counts = store.count_by_status()
+            else:
+                counts = dict.fromkeys(STATUS_NAMES, 0)
+            return counts, archived_count()
+        finally:
+            store.close()
+
+
+def shard_tasks(path, status, recent, since, count, include_archived):
+    # runs in a pool process: (recency, id, status, description) of the tasks of one shard,
+    # newest first for "recent", at most "count" of them
+    rows = []
+    with using_tasks_file(path):
+        store = open_store()
+        try:
+            if not store.exists():
+                # nothing to read yet, and reading must not create it
+                store.close()
+                store = None
+            if include_archived:
+                tasks = with_archived(store, "recent" if recent else status, count, 0, since)
+            elif store is not None:
+                tasks = store.iter_tasks(status=status, recent=recent, since=since, limit=count)
+            else:
+                tasks = ()
+            for task in tasks:
+                if not isinstance(task, Task):
+                    task = Task.from_dict(task)
+                rows.append((task.recency(), task.id, task.status_name, task.description))
+        finally:
+            if store is not None:
+                store.close()
+    return rows
+
+
+def all_projects_tasks(status_filter, limit, offset, since, include_archived=False):
+    import heapq
+
+    recent = status_filter == "recent"
+    status = None if recent else status_filter
+    # every shard may hold the whole page, so each one sends up to offset + limit tasks
+    count = None if limit is None else offset + limit
+    shards = project_shards(PROJECTS_ROOT or TASKS_FILE)
+    results = map_shards(
+        shard_tasks,
+        [(path, status, recent, since, count, include_archived) for _, path in shards],
+    )
+
+    streams = [
+        [(row, name) for row in rows] for (name, _), rows in zip(shards, results)
+    ]
+    if recent:
+        # every shard is newest first already, a k-way merge keeps it that way without sorting
+        rows = heapq.merge(*streams, key=lambda item: item[0][0], reverse=True)
+    else:
+        rows = chain.from_iterable(streams)
+    for (_, task_id, status_name, description), name in islice(
+        rows, offset, None if limit is None else offset + limit
+    ):
+        yield {"id": f"{name}:{task_id}", "status": status_name, "description": description}
+
+
+# TaskStore is the same task list for Python code: no print(), no input(), no process per
+# command. Tasks come back as dicts, mistakes as exceptions (ValueError, TaskNotFound,
+# LockTimeout). Every change locks, saves and unlocks on its own, unless it is inside
+# "with tasks.transaction():", then the whole block is one locked load and one save:
+#
+#   import task_cli
+#   tasks = task_cli.TaskStore("work/tasks.json", storage="sqlite")
+#   with tasks.transaction():
+#       for line in lines:
+#           tasks.add(line)
+#   print(tasks.stats())
+class TaskStore:
+    # TASKS_FILE is one global for the whole module, so only one TaskStore call at a time may
+    # point it somewhere: calls (and whole transactions) from other threads wait for their turn.
+    # _thread is already loaded, threading would cost every command a few milliseconds
+    _using = _thread.RLock()
+
+    def __init__(self, path=None, storage=None, project=None, timeout=None):
+        path = path or TASKS_FILE
+        if project is not None:
+            check_project_name(project)
+            path = project_file(project, path)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        storage = storage or storage_mode()
+        if storage not in STORES:
+            raise ValueError(f"unknown storage '{storage}', use one of {', '.join(STORES)}")
+        self.path = path
+        self.storage = storage
+        self.timeout = timeout
+        self._backend = None
+        # data_stamp() of when the backend was loaded, it is loaded again once the files changed
+        self._stamp = None
+        self._locked = False
+
+    @contextmanager
+    def using(self):
+        # the module works on TASKS_FILE, so every call points it at our file for a moment
+        with self._using, using_tasks_file(self.path):
+            yield
+
+    def refresh(self):
+        # another process changed the tasks since we loaded them (only JsonStore keeps them)
+        if self._backend is not None and data_stamp() != self._stamp:
+            self._backend.close()
+            self._backend = None
+
+    def backend(self, create=True):
+        # the store the commands work on. Call it inside using()
+        if not self._locked:
+            self.refresh()
+        if self._backend is None:
+            self._stamp = data_stamp()
+            self._backend = STORES[self.storage]()
+        if create and not self._backend.exists():
+            self._backend.create()
+        return self._backend
+
+    @contextmanager
+    def locked(self):
+        # holds the store lock: nobody else changes the tasks until we are done. What another
+        # process saved before is loaded first, and nothing is reloaded while we hold it
+        if self._locked:
+            yield
+            return
+        with self.using(), store_lock(self.timeout):
+            self.refresh()
+            self._locked = True
+            try:
+                yield
+                if self._backend is not None and self._backend.exists():
+                    auto_archive(self._backend)
+            except BaseException:
+                # whatever was loaded may hold changes that were never saved
+                self.close()
+                raise
+            finally:
+                self._locked = False
+            # what is on disk now is what we have in memory
+            self._stamp = data_stamp()
+
+    @contextmanager
+    def transaction(self):
+        # one lock, one load and one save for everything in the block. An exception throws the
+        # changes away (except with mmap storage, which writes every change in place)
+        with self.locked(), self.using(), self.backend().batch():
+            yield self
+
+    def add(self, description):
+        if not isinstance(description, str) or not description.strip():
+            raise ValueError("a task needs a description")
+        with self.transaction():
+            return task_dict(self._backend.add(description))
+
+    def get(self, task_id):
+        with self.using():
+            task = self.backend().get(task_id)
+        if task is None:
+            raise TaskNotFound(task_id)
+        return task_dict(task)
+
+    def update(self, task_id, description):
+        if not isinstance(description, str) or not description.strip():
+            raise ValueError("a task needs a description")
+        return self.change(task_id, description=description)
+
+    def mark(self, task_id, status):
+        if status not in STATUS_NAMES:
+            raise ValueError(f"'{status}' is not a valid status")
+        return self.change(task_id, status=status)
+
+    def change(self, task_id, description=None, status=None):
+        with self.transaction():
+            task = change_task(self._backend, task_id, description, status)
+            task = task and task_dict(task)
+        # raised outside the transaction, there is nothing to throw away
+        if task is None:
+            raise TaskNotFound(task_id)
+        return task
+
+    def delete(self, task_id):
+        with self.transaction():
+            deleted = self._backend.delete(task_id)
+        if not deleted:
+            raise TaskNotFound(task_id)
+
+    def clear_done(self):
+        with self.transaction():
+            return self._backend.clear_done()
+
+    def list(self, status=None, recent=False, since=None, limit=None, offset=0):
+        # since: seconds like the stores use, or a time like "list --since" takes ("2024-05-01")
+        if status is not None and status not in STATUS_NAMES:
+            raise ValueError(f"'{status}' is not a valid status")
+        if isinstance(since, str):
+            since = parse_since(since)
+        with self.using():
+            tasks = self.backend().iter_tasks(status, recent, since, limit, offset)
+            return [task_dict(task) for task in tasks]
+
+    def query(self, *conditions, group_by=None, engine=None):
+        # query("status=done", "idle>7") -> how many tasks match, with group_by a dict of
+        # label -> count like "query --group-by" shows
+        now = parse_timestamp(current_time())
+        parsed = [parse_query_condition(condition, now) for condition in conditions]
+        if group_by is not None and group_by not in QUERY_GROUPS:
+            raise ValueError(f"group_by takes one of {', '.join(QUERY_GROUPS)}")
+        evaluate = query_engine(engine)
+        with self.using():
+            result = evaluate(load_columns(self.backend()), parsed, group_by)
+        if group_by is None:
+            return result
+        return dict(query_rows(result, group_by))
+
+    def stats(self):
+        with self.using():
+            counts = self.backend().count_by_status()
+            return dict(counts, total=sum(counts.values()), archived=archived_count())
+
+    def version(self):
+        with self.using():
+            return load_version()[0]
+
+    def close(self):
+        if self._backend is not None:
+            with self.using():
+                self._backend.close()
+            self._backend = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def task_dict(task):
+    # the stores hand out Task objects or rows, callers get the tasks.json format
+    return task.to_dict() if isinstance(task, Task) else dict(task)
+
+
+def profile_options():
+    # "--profile" anywhere on the command line prints where the time went to stderr,
+    # "--profile=out.prof" also keeps a cProfile dump. TASK_CLI_TRACE=1 does the same for every
+    # command, TASK_CLI_TRACE=metrics.jsonl appends one line of metrics per command to that file
+    report_to = []
+    dump = None
+    for arg in sys.argv[1:]:
+        if arg == "--profile" or arg.startswith("--profile="):
+            report_to = ["stderr"]
+            dump = arg.partition("=")[2] or dump
+            sys.argv.remove(arg)
+
+    trace = os.environ.get("TASK_CLI_TRACE", "")
+    if trace in ("1", "stderr"):
+        report_to.append("stderr")
+    elif trace and trace != "0":
+        report_to.append(trace)
+    return report_to, dump
+
+
+def report_trace(report, report_to):
+    if "stderr" in report_to:
+        total = report["total_ms"]
+        lines = [f"profile: {report['command'] or '-'} ({report['storage']}) {total:.2f} ms"]
+        for phase, ms in report["phases_ms"].items():
+            share = ms / total * 100 if total else 0.0
+            lines.append(f"  {phase:<10} {ms:>10.2f} ms {share:>5.1f}%")
+        lines.append(f"  read {report['bytes_read']} bytes, wrote {report['bytes_written']} bytes")
+        print("\n".join(lines), file=sys.stderr)
+
+    paths = [target for target in report_to if target != "stderr"]
+    if paths:
+        import json
+
+        line = json.dumps(report) + "\n"
+        for path in paths:
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Warning: could not write the metrics to {path}: {e}", file=sys.stderr)
+
+
+def main():
+    global TRACE
+
+    report_to, dump = profile_options()
+    try:
+        project = project_option()
+    except ValueError as e:
+        print(f"Error: {e}")
+        print("Usage: python task_cli.py [command] [arguments] --project NAME")
+        return
+    if not report_to:
+        with using_project(project):
+            run_main()
+        return
+
+    TRACE = Trace(sys.argv[1].lower() if len(sys.argv) > 1 else None)
+    profiler = None
+    if dump:
+        # cProfile slows every function call down, the phase times include that
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with using_project(project):
+            run_main()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(dump)
+        trace, TRACE = TRACE, None
+        report_trace(trace.report(), report_to)
+
+
+def run_main():
+    command = sys.argv[1].lower() if len(sys.argv) > 1 else None
+
+    # a running "serve" already has everything in memory, let it do the work
+    if command in SERVER_COMMANDS:
+        output = forward_to_server(sys.argv[1:])
+        if output is not None:
+            if TRACE is not None:
+                TRACE.forwarded = True
+            try:
+                sys.stdout.write(output)
+                sys.stdout.flush()
+            except BrokenPipeError:
+                silence_broken_pipe()
+            return
+
+    tasks = TaskStore(storage=storage_name())
+    try:
+        # commands that change something hold the lock from loading the tasks until they are saved
+        if command in MUTATING_COMMANDS:
+            with tasks.locked():
+                run_command(tasks.backend(create=False))
+        else:
+            with tasks.using():
+                run_command(tasks.backend(create=False))
+    except LockTimeout:
+        print(
+            "Error: Another task_cli command is still working on your tasks. Please try again in a moment."
+        )
+    finally:
+        tasks.close()
+
+
+def command_add(store, args):
+    # Check if user provided a task name
+    if not args:
+        print("Error: Please provide a task description")
+        print('Usage: python task_cli.py add "Your task description here"')
+        return
+
+    description = " ".join(args)
+
+    print(f"adding task: {description}")
+
+    # the store picks the new ID and the timestamps for us
+    new_task = store.add(description)
+
+    print(f"Task added successfuly (ID: {new_task['id']})")
+
+
+def command_update(store, args):
+    # Update needs ID and a new description
+    if len(args) < 2:
+        print("Error: Missing ID or new description.")
+        print("Usage: task-cli update [id] [new description]")
+        return
+    try:
+        task_id = int(args[0])
+        # joining other argvs as the new description
+        new_description = " ".join(args[1:])
+
+        # update the description (and the time)
+        if change_task(store, task_id, description=new_description) is not None:
+            print(f"task {task_id} updated to: {new_description}")
+        else:
+            print(
+                f"Error: Task {task_id} not found. find the correct task ID by running 'list'"
+            )
+
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+
+def command_delete(store, args):
+    # delete needs ID
+    if not args:
+        print("Error: Missing Task ID.")
+        print("Usage: task-cli.py delete [id]")
+        return
+    try:
+        task_id = int(args[0])
+
+        # Check if we actually removed any task
+        if store.delete(task_id):
+            print(f"Task {task_id} deleted successfully.")
+        else:
+            print(f"Error: Task with ID {task_id} not found.")
+
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+
+def command_mark_in_progress(store, args):
+    # Update the task status
+    if not args:
+        print("Error: you need to provide and ID.")
+        print("Usage: task-cli.py mark-in-progress [id]")
+        return
+
+    try:
+        task_id = int(args[0])
+        # update the status (and the time)
+        if change_task(store, task_id, status="in-progress") is not None:
+            print(f"task {task_id} updated to 'in-progress'")
+        else:
+            print(
+                f"Error: Task {task_id} not found. try getting the right ID by 'list' command"
+            )
+
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+
+def command_mark_done(store, args):
+    # Update the task status to DOne
+    if not args:
+        print("Error: Please Provide and ID.")
+        print("Usage: task-cli mark-done [id]")
+        return
+
+    try:
+        task_id = int(args[0])
+        # update the status (and the time)
+        if change_task(store, task_id, status="done") is not None:
+            print(f"Task {task_id} is now done, great job!")
+        else:
+            print(
+                f"Task {task_id} was not found, try getting the right ID by running 'list' "
+            )
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+
+def command_mark_todo(store, args):
+    if not args:
+        print("Usage: task-cli mark-todo [id]")
+        return
+
+    try:
+        task_id = int(args[0])
+        if change_task(store, task_id, status="todo") is not None:
+            print(f"Task {task_id} status reset to 'todo'.")
+        else:
+            print(f"Error: Task {task_id} not found.")
+
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+
+def command_list(store, args):
+    # List shows all the tasks or shows the done tasks or shows the in-progress tasks or todo
+    try:
+        status_filter, options = parse_list_options(args)
+    except ValueError as e:
+        print(f"Error: {e}")
+        print(
+            "Usage: task-cli list [status|recent] [--limit N] [--offset N] [--since TIME] [--as-of TIME]"
+            " [--include-archived] [--all-projects]"
+        )
+        return
+    include_archived = options.pop("include_archived", False)
+    all_projects = options.pop("all_projects", False)
+
+    # the tasks as they were back then, rebuilt from the history
+    as_of = options.pop("as_of", None)
+    if as_of is not None and all_projects:
+        print("Error: --as-of works on one project at a time.")
+        return
+    if as_of is not None:
+        past = tasks_as_of(as_of)
+        if past is None:
+            print(f"Error: The task history doesn't go back to {format_timestamp(as_of)}.")
+            return
+        store = JsonStore(tasks=past)
+
+    if not all_projects and store.is_empty() and not (include_archived and archived_count()):
+        print("There's Nothing Here, Consider adding a task with 'add' command")
+        return
+
+    valid_statuses = ["todo", "in-progress", "done", "recent", None]
+    if status_filter not in valid_statuses:
+        print(
+            f"Error: '{status_filter}' is not a valid status.\nValid statuses are: todo, in-progress, done, recent"
+        )
+        return
+
+    # If it's 'recent' or None, we show EVERYTHING (just in different order)
+    # If it's todo/done/in-progress, the store filters it for us
+    if all_projects:
+        tasks = all_projects_tasks(status_filter, include_archived=include_archived, **options)
+    elif include_archived:
+        tasks = with_archived(store, status_filter, **options)
+    elif status_filter == "recent":
+        tasks = store.iter_tasks(recent=True, **options)
+    else:
+        tasks = store.iter_tasks(status=status_filter, **options)
+
+    try:
+        # printing a header for the table
+        print("\n     ID     Status               Description")
+        print("-" * 50)
+
+        shown = print_task_rows(tasks)
+        print("-" * 50)
+        # a full page probably means there is more, tell the user how to get it
+        if options["limit"] is not None and shown == options["limit"]:
+            print(f"More tasks may follow: use --offset {options['offset'] + shown}")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        silence_broken_pipe()
+
+
+def with_archived(store, status_filter, limit, offset, since):
+    import heapq
+
+    # the archived tasks come after the ones in the store, or merged in by time for "recent".
+    # The page is cut from both together. No store means only the archive
+    recent = status_filter == "recent"
+    status = None if recent else status_filter
+    archived = (
+        task
+        for task in iter_archive()
+        if (status is None or task.status_name == status)
+        and (since is None or task.recency() >= since)
+    )
+    tasks = () if store is None else store.iter_tasks(status=status, recent=recent, since=since)
+    if recent:
+        tasks = heapq.merge(
+            (task if isinstance(task, Task) else Task.from_dict(task) for task in tasks),
+            sorted(archived, key=Task.recency, reverse=True),
+            key=Task.recency,
+            reverse=True,
+        )
+    else:
+        tasks = chain(tasks, archived)
+    return islice(tasks, offset, None if limit is None else offset + limit)
+
+
+def command_history(store, args):
+    if len(args) != 1:
+        print("Usage: task-cli history [id]")
+        return
+    try:
+        task_id = int(args[0])
+    except ValueError:
+        print("Error: Task ID must be a number.")
+        return
+
+    versions = task_history(task_id)
+    if not versions:
+        print(f"No history for task {task_id}.")
+        return
+
+    print(f"\nHistory of task {task_id}:")
+    for record in versions:
+        when = format_timestamp(record["at"])
+        if record["op"] == "put":
+            task = record["task"]
+            print(f"  {when}  {task.get('status', ''):<12} {task.get('description', '')}")
+        else:
+            print(f"  {when}  deleted")
+
+
+def command_version(store, args):
+    # for prompts and scripts: compare with the number from last time before running list or stats
+    print(load_version()[0])
+
+
+def command_watch(store, args):
+    import json
+
+    once = False
+    timeout = None
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--once":
+                once = True
+            elif arg == "--timeout":
+                timeout = float(args.pop(0))
+            else:
+                raise ValueError
+    except (IndexError, ValueError):
+        print("Usage: task-cli watch [--once] [--timeout SECONDS]")
+        return
+
+    # one JSON line per changed task as soon as its change is written:
+    # {"version": 8, "at": "...", "op": "put", "task": {...}}, "delete" with an "id", a big
+    # "import" with "first" and "last", or "reload" when the history can't say what changed
+    watcher = VersionWatcher()
+    version, offset = load_version()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            current, end = load_version()
+            if current != version:
+                records = read_history_between(offset, end) if end > offset else []
+                if not records:
+                    records = [{"op": "reload"}]
+                lines = []
+                for record in records:
+                    if "at" in record:
+                        record["at"] = format_timestamp(record["at"])
+                    lines.append(json.dumps(dict(version=current, **record), ensure_ascii=False) + "\n")
+                sys.stdout.write("".join(lines))
+                sys.stdout.flush()
+                version, offset = current, end
+                if once:
+                    return
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return
+            watcher.wait(remaining)
+    except BrokenPipeError:
+        silence_broken_pipe()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+def command_search(store, args):
+    words = []
+    status_filter = None
+    limit = None
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--status":
+                status_filter = args.pop(0).lower()
+            elif arg == "--limit":
+                limit = int(args.pop(0))
+            else:
+                words.append(arg)
+    except (IndexError, ValueError):
+        print("Error: --status needs a status and --limit needs a number.")
+        return
+
+    groups = parse_search_query(words)
+    if not groups:
+        print("Error: Please tell me what to search for.")
+        print("Usage: task-cli search [words] [OR words] [word*] [--status done] [--limit N]")
+        return
+    if status_filter not in ["todo", "in-progress", "done", None]:
+        print(f"Error: '{status_filter}' is not a valid status.")
+        return
+
+    print("\n     ID     Status               Description")
+    print("-" * 50)
+    shown = print_task_rows(store.search(groups, status_filter, limit))
+    print("-" * 50)
+    print(f"{shown} task(s) found.")
+
+
+def command_batch(store, args):
+    source = args[0] if args else "-"
+    if source != "-" and not os.path.exists(source):
+        print(f"Error: batch file '{source}' not found.")
+        return
+    run_batch(store, source)
+
+
+def command_import(store, args):
+    source = None
+    fmt = None
+    workers = None
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--format":
+                fmt = args.pop(0).lower()
+                if fmt not in IMPORT_FORMATS:
+                    raise ValueError
+            elif arg == "--jobs":
+                workers = int(args.pop(0))
+                if workers < 1:
+                    raise ValueError
+            elif source is None:
+                source = arg
+            else:
+                raise ValueError
+        if source is None:
+            raise ValueError
+    except (IndexError, ValueError):
+        print("Usage: task-cli import FILE|- [--format csv|jsonl] [--jobs N]")
+        return
+
+    fmt = guess_format(source, fmt)
+    if fmt is None:
+        print(f"Error: can't tell the format of '{source}', add --format csv or --format jsonl.")
+        return
+    if source != "-" and not os.path.exists(source):
+        print(f"Error: import file '{source}' not found.")
+        return
+
+    import io
+
+    errors = []
+    # utf-8-sig drops the byte order mark spreadsheets like to put at the start
+    if source == "-":
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+    else:
+        f = open(source, "r", encoding="utf-8-sig", newline="")
+    try:
+        count = import_tasks(store, f, fmt, workers, errors)
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"Error: Could not import '{source}': {e}")
+        return
+    finally:
+        if source != "-":
+            f.close()
+
+    print(f"Imported {count} task(s).")
+    if errors:
+        print(f"Skipped {len(errors)} row(s):")
+        for line, message in errors[:10]:
+            print(f"  line {line}: {message}")
+        if len(errors) > 10:
+            print(f"  ... and {len(errors) - 10} more")
+
+
+def command_export(store, args):
+    target = "-"
+    fmt = None
+    status = None
+    include_archived = False
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--format":
+                fmt = args.pop(0).lower()
+                if fmt not in IMPORT_FORMATS:
+                    raise ValueError
+            elif arg == "--include-archived":
+                include_archived = True
+            elif arg.lower() in STATUS_CODES:
+                status = arg.lower()
+            elif target == "-":
+                target = arg
+            else:
+                raise ValueError
+    except (IndexError, ValueError):
+        print("Usage: task-cli export [FILE] [todo|in-progress|done] [--format csv|jsonl] [--include-archived]")
+        return
+
+    fmt = guess_format(target, fmt)
+    if fmt is None:
+        print(f"Error: can't tell the format of '{target}', add --format csv or --format jsonl.")
+        return
+
+    # streamed from the store, the tasks are never all loaded at once
+    if include_archived:
+        tasks = with_archived(store, status, None, 0, None)
+    else:
+        tasks = store.iter_tasks(status=status)
+    if target == "-":
+        try:
+            export_tasks(tasks, sys.stdout, fmt)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            silence_broken_pipe()
+        return
+
+    count = 0
+
+    def write(f):
+        nonlocal count
+        count = export_tasks(tasks, f, fmt)
+
+    try:
+        # a half written export never replaces an older one
+        write_file_atomically(target, write)
+    except OSError as e:
+        print(f"Error: Could not write '{target}': {e}")
+        return
+    print(f"Exported {count} task(s) to {target}.")
+
+
+def command_serve(store, args):
+    http_port = None
+    if args:
+        try:
+            if args[0] != "--http":
+                raise ValueError
+            http_port = int(args[1]) if len(args) > 1 else 8765
+        except ValueError:
+            print("Usage: task-cli serve [--http PORT]")
+            return
+    start_server(http_port)
+
+
+def command_compact(store, args):
+    if compact_journal():
+        print("Journal compacted into tasks.json.")
+    else:
+        print("Nothing to compact.")
+
+
+def command_migrate(store, args):
+    if len(args) != 2 or args[0] != "--to" or args[1].lower() not in SNAPSHOT_FORMATS:
+        print(f"Usage: task-cli migrate --to [{'|'.join(SNAPSHOT_FORMATS)}]")
+        return
+    if not isinstance(store, JsonStore):
+        print("Error: migrate converts tasks.json, the sqlite storage doesn't use it.")
+        return
+
+    target = args[1].lower()
+    source = snapshot_format() or "json"
+    # the journal (if any) is part of what we load, so it ends up in the new file too
+    tasks = store.tasks
+    save_tasks(tasks, target)
+    print(f"Migrated {len(tasks)} tasks from {source} to {target}.")
+
+
+def command_archive(store, args):
+    older_than = None
+    compression = None
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--older-than":
+                older_than = int(args.pop(0))
+                if older_than < 0:
+                    raise ValueError
+            elif arg == "--compress":
+                compression = args.pop(0).lower()
+                if compression not in ARCHIVE_COMPRESSIONS:
+                    raise ValueError
+            else:
+                raise ValueError
+    except (IndexError, ValueError):
+        print("Usage: task-cli archive [--older-than DAYS] [--compress gzip|lzma]")
+        return
+
+    try:
+        moved = archive_tasks(store, older_than, compression)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not archive the done tasks: {e}")
+        return
+    if moved:
+        print(f"Archived {moved} done tasks to {archive_path()} ({archived_count()} archived in total).")
+    else:
+        print("No done tasks to archive.")
+
+
+def command_help(store, args):
+    # We reuse the same logic we want for the unknown commands
+    show_help()
+
+
+def command_clear_done(store, args):
+    # 1. Check if we actually have anything to remove
+    removed_count = store.count_by_status()["done"]
+
+    if removed_count > 0:
+        # --- THE NEW CONFIRMATION QUESTION ---
+        print(
+            f"Warning: This will permanently delete {removed_count} 'done' tasks."
+        )
+        if "--yes" in args or "-y" in args:
+            # scripts can't answer the question, they say yes up front
+            confirm = "y"
+        else:
+            try:
+                confirm = input("Are you sure you want to proceed? (y/n): ").lower()
+            except EOFError:
+                # no one to ask (cron, a pipe that ended), so the answer is no
+                print("\nNo answer, use 'clear-done --yes' to skip the question.")
+                confirm = "n"
+
+        if confirm == "y":
+            store.clear_done()
+            print(f"Successfully cleaned up {removed_count} completed tasks.")
+        else:
+            print("Action canceled. No tasks were deleted.")
+
+    else:
+        print("No completed tasks to remove.")
+
+
+def command_report(store, args):
+    days = 30
+    rebuild = False
+    args = list(args)
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--days":
+                days = int(args.pop(0))
+                if days < 1:
+                    raise ValueError
+            elif arg == "--rebuild":
+                rebuild = True
+            else:
+                raise ValueError
+    except (IndexError, ValueError):
+        print("Usage: task-cli report [--days N] [--rebuild]")
+        return
+
+    rollups = None if rebuild else load_rollups()
+    if rollups is None:
+        # the only time a report reads every task, from now on every change keeps them current
+        rollups = build_rollups(store.iter_tasks())
+        try:
+            save_rollups(rollups)
+        except OSError:
+            print("Warning: Could not save the report counters, the next report counts again.")
+
+    import datetime
+
+    today = parse_timestamp(current_time())
+    window = [rollup_day(today - back * 86400) for back in range(days - 1, -1, -1)]
+    empty = [0] * ROLLUP_WIDTH
+    rows = [rollups["days"].get(day, empty) for day in window]
+
+    # throughput: done (and created) per ISO week of the window
+    created = sum(row[ROLLUP_CREATED] for row in rows)
+    done = sum(row[ROLLUP_DONE] for row in rows)
+    print(f"\n--- Report: the last {days} days ({window[0]} to {window[-1]}) ---")
+    print(f"Created: {created}   Done: {done}   ({done / days:.1f} done per day)")
+    print("\nThroughput per week:")
+    weeks = {}
+    for day, row in zip(window, rows):
+        year, week, _ = datetime.date.fromisoformat(day).isocalendar()
+        totals = weeks.setdefault(f"{year}-W{week:02d}", [0, 0])
+        totals[0] += row[ROLLUP_DONE]
+        totals[1] += row[ROLLUP_CREATED]
+    for week, (week_done, week_created) in weeks.items():
+        print(f"  {week}   done {week_done:>5}   created {week_created:>5}")
+
+    # cycle time of the tasks done in the window
+    histogram = [
+        sum(row[ROLLUP_BUCKETS + bucket] for row in rows) for bucket in range(len(CYCLE_BUCKETS))
+    ]
+    measured = sum(histogram)
+    print("\nCycle time (created -> done):")
+    if measured:
+        average = sum(row[ROLLUP_CYCLE] for row in rows) / measured
+        print(f"  average {format_duration(average)} over {measured} tasks")
+        print_histogram(histogram)
+    else:
+        print("  no tasks were done in this time")
+
+    # aging: how long the open tasks have been waiting, from the day they were created
+    aging = [0] * len(CYCLE_BUCKETS)
+    for day, count in rollups["open"].items():
+        age = today - parse_timestamp(day + " 00:00:00")
+        aging[cycle_bucket(max(0, age))] += count
+    print(f"\nAge of the {sum(aging)} open tasks:")
+    print_histogram(aging)
+
+
+def format_duration(seconds):
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} minutes"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} hours"
+    return f"{seconds / 86400:.1f} days"
+
+
+def print_histogram(counts, width=30):
+    largest = max(counts) or 1
+    for (_, label), count in zip(CYCLE_BUCKETS, counts):
+        print(f"  {label:<16} {count:>7}  {'#' * round(count / largest * width)}")
+
+
+def command_query(store, args):
+    conditions = []
+    group = None
+    engine = None
+    args = list(args)
+    now = parse_timestamp(current_time())
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == "--group-by":
+                group = args.pop(0).lower()
+                if group not in QUERY_GROUPS:
+                    raise ValueError(f"--group-by takes one of {', '.join(QUERY_GROUPS)}")
+            elif arg == "--engine":
+                engine = args.pop(0).lower()
+                if engine not in ("numpy", "array"):
+                    raise ValueError("--engine is numpy or array")
+            else:
+                conditions.append(parse_query_condition(arg, now))
+    except IndexError:
+        print("Error: --group-by and --engine need a value.")
+        print_query_usage()
+        return
+    except ValueError as e:
+        print(f"Error: {e}")
+        print_query_usage()
+        return
+
+    try:
+        evaluate = query_engine(engine)
+    except ImportError:
+        print("Error: NumPy is not installed, use --engine array (or leave --engine out).")
+        return
+    result = evaluate(load_columns(store), conditions, group)
+
+    if group is None:
+        print(f"{result} task(s) match.")
+        return
+
+    rows = query_rows(result, group)
+    print(f"\n{group:<14} {'tasks':>9}")
+    print("-" * 25)
+    for label, count in rows:
+        print(f"{label:<14} {count:>9}")
+    print("-" * 25)
+    print(f"{'total':<14} {sum(count for _, count in rows):>9}")
+
+
+def query_rows(result, group):
+    # the counts of an engine as (label, count), in the order they are shown
+    if group == "status":
+        return [(name, result.get(code, 0)) for code, name in enumerate(STATUS_NAMES)]
+    # keys are day numbers, a month is the first 7 characters of the date
+    rows = {}
+    for day in sorted(result):
+        label = rollup_day(day * 86400)
+        if group.endswith("-month"):
+            label = label[:7]
+        rows[label] = rows.get(label, 0) + result[day]
+    return list(rows.items())
+
+
+def print_query_usage():
+    print("Usage: task-cli query [condition ...] [--group-by FIELD] [--engine numpy|array]")
+    print("  conditions: status=done, idle>7, age>=30, length>200, id<100, updated<2024-05-01, description~milk")
+    print(f"  FIELD: {', '.join(QUERY_GROUPS)}")
+
+
+# adding stats like: "You have 4 Todo, 1 In-Progress, and 12 Done."
+def command_stats(store, args):
+    if "--all-projects" in args:
+        stats_all_projects()
+        return
+
+    # the store counts for us (SQLite answers this from the status index)
+    counts = store.count_by_status()
+    total = sum(counts.values())
+    # just the header of the archive, it never gets decompressed for this
+    archived = archived_count()
+
+    if total == 0 and not archived:
+        print("📊 Stats: You have no tasks yet. Add some to see progress!")
+        return
+
+    print("\n--- Task Statistics ---")
+    print(f"Todo:        {counts['todo']}")
+    print(f"In-Progress: {counts['in-progress']}")
+    print(f"Done:        {counts['done']}")
+    print("-" * 25)
+    print(f"Total Tasks: {total}")
+    if archived:
+        print(f"Archived:    {archived}")
+    print("-" * 25)
+
+
+def stats_all_projects():
+    shards = project_shards(PROJECTS_ROOT or TASKS_FILE)
+    results = map_shards(shard_counts, [(path,) for _, path in shards])
+
+    print("\n--- Task Statistics (all projects) ---")
+    totals = dict.fromkeys(STATUS_NAMES, 0)
+    archived = 0
+    for (name, _), (counts, shard_archived) in zip(shards, results):
+        print(
+            f"{name:<12} todo {counts['todo']}, in-progress {counts['in-progress']}, done {counts['done']}"
+        )
+        for status in STATUS_NAMES:
+            totals[status] += counts[status]
+        archived += shard_archived
+    print("-" * 25)
+    print(f"Todo:        {totals['todo']}")
+    print(f"In-Progress: {totals['in-progress']}")
+    print(f"Done:        {totals['done']}")
+    print("-" * 25)
+    print(f"Total Tasks: {sum(totals.values())}")
+    if archived:
+        print(f"Archived:    {archived}")
+    print("-" * 25)
+
+
+# every command is one small function, main() only has to look the name up
+COMMANDS = {
+    "add": command_add,
+    "update": command_update,
+    "delete": command_delete,
+    "mark-in-progress": command_mark_in_progress,
+    "mark-done": command_mark_done,
+    "mark-todo": command_mark_todo,
+    "list": command_list,
+    "search": command_search,
+    "history": command_history,
+    "version": command_version,
+    "watch": command_watch,
+    "batch": command_batch,
+    "import": command_import,
+    "export": command_export,
+    "serve": command_serve,
+    "compact": command_compact,
+    "migrate": command_migrate,
+    "archive": command_archive,
+    "help": command_help,
+    "clear-done": command_clear_done,
+    "stats": command_stats,
+    "report": command_report,
+    "query": command_query,
+}
+
+
+def run_command(store):
+    # --- FIRST TIME WELCOME ---
+    if not store.exists():
+        print("🌟 Welcome to Task Tracker CLI! 🌟")
+        print("It looks like this is your first time running the app.")
+        print(
+            "I've created a new storage file for you. Type 'python task_cli.py help' if you ever felt lost!"
+        )
+        print("-" * 40)
+        # We create an empty file immediately so this message only shows once
+        store.create()
+
+    # 1. Check if the user typed anything at all
+    if len(sys.argv) < 2:
+        print("You should tell me what to do.")
+        show_help()
+        return
+
+    # 2. Capture the main command (add, update, delete, etc.)
+    command = sys.argv[1].lower()
+
+    # 3. Hand the rest of the arguments to that command's function
+    handler = COMMANDS.get(command)
+    if handler is None:
+        print(f"\nError: '{command}' is not a recognized command.")
+        show_help()
+        return
+    handler(store, sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
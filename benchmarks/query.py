@@ -0,0 +1,163 @@
+# How much faster is "query" than looping over the tasks one by one? Times the same questions
+# answered with a plain loop over tasks that are already loaded and with the columnar query
+# engines over columns that are already loaded, so only the engines are compared. Then what a
+# command pays in the end: loading the tasks and looping against loading the columns and
+# querying, also right after a task changed.
+#
+#   python benchmarks/query.py                    # 1,000,000 tasks
+#   python benchmarks/query.py --tasks 100000 --runs 5
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+import task_cli  # noqa: E402
+
+NOW = task_cli.parse_timestamp("2024-06-01 00:00:00")
+
+# name, query arguments, the same question as a loop over the task dicts
+QUESTIONS = [
+    (
+        "in-progress, idle > 7 days",
+        ["status=in-progress", "idle>7"],
+        lambda tasks: sum(
+            1
+            for task in tasks
+            if task["status"] == "in-progress"
+            and task_cli.parse_timestamp(task["updatedAt"]) < NOW - 7 * 86400
+        ),
+    ),
+    (
+        "length > 200 by status",
+        ["length>200", "--group-by", "status"],
+        lambda tasks: count_by(
+            task["status"] for task in tasks if len(task["description"]) > 200
+        ),
+    ),
+    (
+        "done per month",
+        ["status=done", "--group-by", "updated-month"],
+        lambda tasks: count_by(task["updatedAt"][:7] for task in tasks if task["status"] == "done"),
+    ),
+]
+
+
+def count_by(keys):
+    counts = {}
+    for key in keys:
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def make_tasks(count):
+    rng = random.Random(1)
+    start = NOW - 365 * 86400
+    tasks = []
+    for i in range(1, count + 1):
+        created = start + rng.randrange(365 * 86400)
+        tasks.append(
+            {
+                "id": i,
+                "description": "x" * rng.choice((20, 40, 80, 250)),
+                "status": rng.choice(task_cli.STATUS_NAMES),
+                "createdAt": task_cli.format_timestamp(created),
+                "updatedAt": task_cli.format_timestamp(min(NOW, created + rng.randrange(60 * 86400))),
+            }
+        )
+    return tasks
+
+
+def best(function, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query with per-task loops")
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    engines = ["array"]
+    try:
+        import numpy  # noqa: F401
+
+        engines.append("numpy")
+    except ImportError:
+        print("NumPy is not installed, only the array engine is measured")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        task_cli.TASKS_FILE = os.path.join(tmp, "tasks.json")
+        os.environ["TASK_CLI_SERVER"] = "off"
+        task_cli.current_time = lambda: task_cli.format_timestamp(NOW)
+        task_cli.save_tasks(make_tasks(args.tasks), "compact")
+        store = task_cli.JsonStore()
+        # the first query builds tasks.json.columns, every later one just reads it
+        task_cli.load_columns(store)
+
+        load_rows = best(task_cli.load_tasks, 1)[0]
+        load_columns = best(lambda: task_cli.load_columns(store), args.runs)[0]
+        print(f"{args.tasks} tasks: load_tasks() {load_rows:.2f} s, columns {load_columns:.3f} s")
+        print(
+            f"{'question':<28} {'loop s':>8} "
+            + " ".join(f"{name + ' s':>9} {'x':>5}" for name in engines)
+        )
+
+        rows = task_cli.load_tasks()
+        columns = task_cli.load_columns(store)
+        for name, query, loop in QUESTIONS:
+            loop_time = best(lambda: loop(rows), args.runs)[0]
+            conditions = [
+                task_cli.parse_query_condition(arg, NOW)
+                for arg in query
+                if not arg.startswith("--") and arg not in task_cli.QUERY_GROUPS
+            ]
+            group = query[query.index("--group-by") + 1] if "--group-by" in query else None
+            times = []
+            for engine in engines:
+                evaluate = task_cli.query_engine(engine)
+                times.append(best(lambda: evaluate(columns, conditions, group), args.runs)[0])
+            print(
+                f"{name:<28} {loop_time:>8.3f} "
+                + " ".join(f"{t:>9.3f} {loop_time / t:>5.1f}" for t in times)
+            )
+
+        # the last question again, from the disk: the loop has to load the tasks first
+        total_loop = load_rows + loop_time
+        total_query = load_columns + times[-1]
+        print(
+            f"last question with loading: loop {total_loop:.2f} s, query {total_query:.3f} s "
+            f"({total_loop / total_query:.0f}x)"
+        )
+
+        # and right after a change, when the query first puts the changed task into the columns
+        writer = task_cli.JsonStore()
+        evaluate = task_cli.query_engine("array")
+        changed_times = []
+        for run in range(args.runs):
+            task = writer.get(1 + run)
+            task.status = (task.status + 1) % len(task_cli.STATUS_NAMES)
+            task.updated = NOW + run
+            writer.save(task)
+            start = time.perf_counter()
+            evaluate(task_cli.load_columns(task_cli.JsonStore()), conditions, group)
+            changed_times.append(time.perf_counter() - start)
+        changed_query = min(changed_times)
+        print(
+            f"after a change: loop {total_loop:.2f} s, query {changed_query:.3f} s "
+            f"({total_loop / changed_query:.0f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
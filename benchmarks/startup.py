@@ -0,0 +1,95 @@
+# How long does a command take from start to finish? This is what a shell prompt hook
+# that runs "stats" feels on every prompt.
+#
+#   python benchmarks/startup.py                       # help and stats, 1000 tasks
+#   python benchmarks/startup.py --tasks 100000 --runs 50
+#   python benchmarks/startup.py --compare ../old/task_cli.py
+#
+# --compare runs the same commands with the task_cli.py of another checkout (for example
+# "git worktree add ../old HEAD~1") so you can see the difference. Every command runs in the
+# temporary directory, so an old version that only reads ./tasks.json reads the test file too.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+TASK_CLI = os.path.join(ROOT, "task_cli.py")
+
+
+def make_tasks_file(path, count):
+    tasks = [
+        {
+            "id": i,
+            "description": f"Task number {i}",
+            "status": ("todo", "in-progress", "done")[i % 3],
+            "createdAt": "2024-05-01 12:00:00",
+            "updatedAt": "2024-05-01 12:00:00",
+        }
+        for i in range(1, count + 1)
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tasks, f, indent=4)
+
+
+def time_command(script, argv, env, runs, cwd=None):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable] + script + argv,
+            env=env,
+            cwd=cwd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure task_cli startup time")
+    parser.add_argument("--tasks", type=int, default=1000, help="tasks in the test file")
+    parser.add_argument("--runs", type=int, default=30, help="runs per command")
+    parser.add_argument("--compare", help="another task_cli.py to measure the same way")
+    args = parser.parse_args()
+
+    scripts = {"current": [TASK_CLI]}
+    if args.compare:
+        scripts["compare"] = [os.path.abspath(args.compare)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tasks_file = os.path.join(tmp, "tasks.json")
+        env = dict(os.environ, TASK_CLI_FILE=tasks_file, TASK_CLI_SERVER="off")
+        # measure what users get, with Python keeping the compiled bytecode around
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+        # python itself, everything above this is ours
+        baseline = statistics.median(time_command(["-c", "pass"], [], env, args.runs)) * 1000
+        print(f"python -c pass: {baseline:.1f} ms")
+        print(f"{'command':<10} {'script':<12} {'median ms':>10} {'min ms':>10}")
+
+        for command in (["help"], ["stats"]):
+            for name, script in scripts.items():
+                # a fresh file for every script, so they all start from the same state
+                make_tasks_file(tasks_file, args.tasks)
+                for leftover in os.listdir(tmp):
+                    if leftover != "tasks.json":
+                        os.remove(os.path.join(tmp, leftover))
+                # the first run may build the summary and index files, that's not startup
+                time_command(script, command, env, 1, tmp)
+                times = time_command(script, command, env, args.runs, tmp)
+                print(
+                    f"{command[0]:<10} {name:<12} "
+                    f"{statistics.median(times) * 1000:>10.1f} {min(times) * 1000:>10.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+# How do the hot paths scale? Generates task lists of different sizes and times every case
+# in-process (plus peak memory from tracemalloc) and as a real subprocess.
+#
+#   python benchmarks/suite.py                                   # 10 .. 100k tasks
+#   python benchmarks/suite.py --sizes 1000,1000000 --storage journal
+#   python benchmarks/suite.py --mix todo=0.2,in-progress=0.1,done=0.7 --description-length 120
+#   python benchmarks/suite.py --output base.json                # save the results
+#   python benchmarks/suite.py --baseline base.json              # exits with 1 on a regression
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from unittest.mock import patch
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+TASK_CLI = os.path.join(ROOT, "task_cli.py")
+
+sys.path.insert(0, ROOT)
+import task_cli  # noqa: E402
+
+# name -> command line, None for the cases that call a function instead of a command
+CASES = {
+    "load_tasks": None,
+    "save_tasks": None,
+    "list": ["list"],
+    "list recent": ["list", "recent"],
+    "list done page": ["list", "done", "--limit", "20"],
+    "stats": ["stats"],
+    "mark-done": ["mark-done", "MIDDLE"],
+    "update": ["update", "MIDDLE", "changed description"],
+    "add": ["add", "one more task"],
+    "clear-done": ["clear-done"],
+}
+
+WORDS = "buy call fix write read plan send book clean review check milk report code".split()
+
+
+def parse_mix(text):
+    # "todo=0.5,in-progress=0.2,done=0.3" -> ({"todo": 0.5, ...})
+    mix = {}
+    for part in text.split(","):
+        status, _, share = part.partition("=")
+        if status not in task_cli.STATUS_NAMES:
+            raise argparse.ArgumentTypeError(f"unknown status '{status}'")
+        mix[status] = float(share)
+    return mix
+
+
+def generate_tasks(count, mix, description_length, seed=1):
+    # the same arguments always give the same tasks, so runs can be compared
+    rng = random.Random(seed)
+    statuses = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    start = task_cli.parse_timestamp("2024-01-01 00:00:00")
+    tasks = []
+    for i in range(1, count + 1):
+        words = []
+        while sum(len(word) + 1 for word in words) < description_length:
+            words.append(rng.choice(WORDS))
+        created = start + i * 60
+        updated = created + rng.randrange(0, 90 * 86400)
+        tasks.append(
+            {
+                "id": i,
+                "description": " ".join(words)[:description_length],
+                "status": statuses[i - 1],
+                "createdAt": task_cli.format_timestamp(created),
+                "updatedAt": task_cli.format_timestamp(updated),
+            }
+        )
+    return tasks
+
+
+class Workspace:
+    # a directory with a prepared task list that is put back before every run
+
+    def __init__(self, tasks, storage):
+        self.dir = tempfile.mkdtemp(prefix="task-bench-")
+        self.pristine = tempfile.mkdtemp(prefix="task-bench-pristine-")
+        self.tasks_file = os.path.join(self.dir, "tasks.json")
+        self.storage = storage
+        self.middle = str(len(tasks) // 2 or 1)
+
+        with self.using():
+            task_cli.save_tasks(tasks)
+            # let the store build what it builds on first use (index, summary, database)
+            run_in_process(["stats"])
+        for name in os.listdir(self.dir):
+            shutil.copy2(os.path.join(self.dir, name), self.pristine)
+
+    def reset(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        for name in os.listdir(self.pristine):
+            shutil.copy2(os.path.join(self.pristine, name), self.dir)
+
+    @contextlib.contextmanager
+    def using(self):
+        saved_file = task_cli.TASKS_FILE
+        task_cli.TASKS_FILE = self.tasks_file
+        with patch.dict(os.environ, self.env()):
+            try:
+                yield
+            finally:
+                task_cli.TASKS_FILE = saved_file
+
+    def env(self):
+        return {
+            "TASK_CLI_FILE": self.tasks_file,
+            "TASK_CLI_STORAGE": self.storage,
+            "TASK_CLI_SERVER": "off",
+        }
+
+    def close(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        shutil.rmtree(self.pristine, ignore_errors=True)
+
+
+def run_in_process(argv):
+    with patch.object(sys, "argv", ["task_cli.py"] + argv), patch(
+        "builtins.input", return_value="y"
+    ), contextlib.redirect_stdout(io.StringIO()):
+        task_cli.main()
+
+
+def in_process_call(case, argv):
+    if case == "load_tasks":
+        return lambda: task_cli.load_tasks()
+    if case == "save_tasks":
+        tasks = task_cli.load_tasks()
+        return lambda: task_cli.save_tasks(tasks)
+    return lambda: run_in_process(argv)
+
+
+def time_in_process(workspace, case, argv, repeat):
+    times = []
+    with workspace.using():
+        for _ in range(repeat):
+            workspace.reset()
+            call = in_process_call(case, argv)
+            start = time.perf_counter()
+            call()
+            times.append(time.perf_counter() - start)
+
+        # a separate run for the memory, tracemalloc makes everything slower
+        workspace.reset()
+        call = in_process_call(case, argv)
+        tracemalloc.start()
+        try:
+            call()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return times, peak
+
+
+def time_subprocess(workspace, argv, repeat):
+    times = []
+    env = dict(os.environ, **workspace.env())
+    for _ in range(repeat):
+        workspace.reset()
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, TASK_CLI] + argv,
+            env=env,
+            input="y\n",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        )
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def summarize(times):
+    return {"best": min(times), "median": statistics.median(times)}
+
+
+def run_suite(args):
+    results = []
+    for size in args.sizes:
+        tasks = generate_tasks(size, args.mix, args.description_length)
+        workspace = Workspace(tasks, args.storage)
+        try:
+            for case, argv in CASES.items():
+                if args.cases and case not in args.cases:
+                    continue
+                if argv is not None:
+                    argv = [workspace.middle if arg == "MIDDLE" else arg for arg in argv]
+
+                times, peak = time_in_process(workspace, case, argv, args.repeat)
+                result = {
+                    "case": case,
+                    "size": size,
+                    "in_process": summarize(times),
+                    "peak_memory_bytes": peak,
+                    "subprocess": None,
+                }
+                if argv is not None and not args.no_subprocess:
+                    result["subprocess"] = summarize(time_subprocess(workspace, argv, args.repeat))
+                results.append(result)
+                print_result(result)
+        finally:
+            workspace.close()
+    return results
+
+
+def print_result(result):
+    sub = result["subprocess"]
+    print(
+        f"{result['case']:<16} {result['size']:>9} "
+        f"{result['in_process']['median'] * 1000:>11.2f} "
+        f"{'-' if sub is None else format(sub['median'] * 1000, '.2f'):>11} "
+        f"{result['peak_memory_bytes'] / 1e6:>9.2f}",
+        file=sys.stderr,
+    )
+
+
+def compare(results, baseline, threshold):
+    # a case is a regression when its median got slower than threshold x the baseline
+    old = {(r["case"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = old.get((result["case"], result["size"]))
+        if before is None:
+            continue
+        for kind in ("in_process", "subprocess"):
+            if result[kind] is None or before.get(kind) is None:
+                continue
+            ratio = result[kind]["median"] / max(before[kind]["median"], 1e-9)
+            result.setdefault("vs_baseline", {})[kind] = round(ratio, 3)
+            if ratio > threshold:
+                regressions.append(f"{result['case']} ({result['size']} tasks, {kind}): {ratio:.2f}x")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark task_cli's hot paths")
+    parser.add_argument(
+        "--sizes",
+        type=lambda text: [int(size) for size in text.split(",")],
+        default=[10, 1000, 10_000, 100_000],
+        help="task counts, like 10,1000,1000000",
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={"todo": 0.5, "in-progress": 0.2, "done": 0.3},
+        help="share of each status, like todo=0.5,in-progress=0.2,done=0.3",
+    )
+    parser.add_argument("--description-length", type=int, default=40)
+    parser.add_argument("--storage", default="json", choices=sorted(task_cli.STORES))
+    parser.add_argument("--cases", type=lambda text: text.split(","), help="only these cases")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-subprocess", action="store_true", help="only time in-process")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="slower than this x baseline is a regression"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'case':<16} {'tasks':>9} {'in-proc ms':>11} {'subproc ms':>11} {'peak MB':>9}",
+        file=sys.stderr,
+    )
+    results = run_suite(args)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "storage": args.storage,
+        "mix": args.mix,
+        "description_length": args.description_length,
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -319,3 +319,1937 @@ def test_main_update_invalid_id_type(monkeypatch, capsys):
     # 3. Assert: Capture the output to ensure the error message appears
     captured = capsys.readouterr()
     assert "Error: Task ID must be a number." in captured.out
+
+
+# ---------------------------
+# Test journal storage mode
+# ---------------------------
+def test_journal_mode_appends_instead_of_rewriting(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    task_cli.save_tasks(
+        [{"id": 1, "description": "A", "status": "todo", "createdAt": "x", "updatedAt": "x"}]
+    )
+    snapshot_before = temp_tasks_file.read_text(encoding="utf-8")
+
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "mark-done", "1"])
+    task_cli.main()
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "B"])
+    task_cli.main()
+
+    # tasks.json stays untouched, the changes only went to the journal
+    assert temp_tasks_file.read_text(encoding="utf-8") == snapshot_before
+    journal = temp_tasks_file.parent / "tasks.json.journal"
+    assert len(journal.read_text(encoding="utf-8").splitlines()) == 2
+
+    tasks = task_cli.load_tasks()
+    assert [task["status"] for task in tasks] == ["done", "todo"]
+    assert tasks[1]["id"] == 2
+
+
+def test_journal_mode_keeps_the_index_saved(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    task_cli.save_tasks([])
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["add", "C"])
+    index_file = temp_tasks_file.parent / "tasks.json.index"
+    lines = len(index_file.read_text().splitlines())
+
+    # no command builds the index again, and the journal isn't added to the index a second time
+    built = []
+    build = task_cli.TaskIndex.build
+    monkeypatch.setattr(task_cli.TaskIndex, "build", lambda tasks: built.append(1) or build(tasks))
+    run_cli(monkeypatch, ["mark-done", "1"], ["update", "3", "C2"], ["delete", "2"])
+    assert built == []
+    assert len(index_file.read_text().splitlines()) == lines + 3
+
+    capsys.readouterr()
+    run_cli(monkeypatch, ["list", "recent"])
+    out = capsys.readouterr().out
+    assert out.index("C2") < out.index(" A")
+    assert task_cli.load_collection().index.ids_by_status["done"] == {1}
+    assert built == []
+
+    # compaction folds the journal into tasks.json, the index stays the same
+    assert task_cli.compact_journal() is True
+    saved = task_cli.load_collection().index
+    assert list(saved.recent) == [1, 3]
+    assert built == []
+
+
+def test_journal_replay_handles_delete_and_torn_line(temp_tasks_file, monkeypatch):
+    task_cli.save_tasks([{"id": 1, "description": "A", "status": "todo"}])
+    journal = temp_tasks_file.parent / "tasks.json.journal"
+    journal.write_text(
+        json.dumps({"op": "put", "task": {"id": 2, "description": "B", "status": "todo"}})
+        + "\n"
+        + json.dumps({"op": "delete", "id": 1})
+        + "\n"
+        + '{"op": "put", "ta',
+        encoding="utf-8",
+    )
+
+    assert task_cli.load_tasks() == [{"id": 2, "description": "B", "status": "todo"}]
+
+
+def test_compact_journal_folds_changes_into_snapshot(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    task_cli.save_tasks([])
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "A"])
+    task_cli.main()
+
+    assert task_cli.compact_journal() is True
+
+    assert not (temp_tasks_file.parent / "tasks.json.journal").exists()
+    assert json.loads(temp_tasks_file.read_text(encoding="utf-8"))[0]["description"] == "A"
+    assert task_cli.compact_journal() is False
+
+
+def test_compact_journal_keeps_changes_after_a_crashed_compaction(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    task_cli.save_tasks([])
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"])
+    # a compaction that crashed right after moving the journal away
+    journal = temp_tasks_file.parent / "tasks.json.journal"
+    journal.rename(temp_tasks_file.parent / "tasks.json.journal.compacting")
+    run_cli(monkeypatch, ["add", "C"], ["mark-done", "1"])
+
+    assert task_cli.compact_journal() is True
+
+    assert not journal.exists()
+    assert not (temp_tasks_file.parent / "tasks.json.journal.compacting").exists()
+    tasks = task_cli.load_tasks()
+    assert [(task["description"], task["status"]) for task in tasks] == [
+        ("A", "done"),
+        ("B", "todo"),
+        ("C", "todo"),
+    ]
+
+
+def test_journal_compaction_starts_in_background(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    monkeypatch.setattr(task_cli, "JOURNAL_COMPACT_BYTES", 1)
+    task_cli.save_tasks([])
+
+    with patch("subprocess.Popen") as mock_popen:
+        monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "A"])
+        task_cli.main()
+
+    mock_popen.assert_called_once()
+    assert mock_popen.call_args.kwargs["env"]["TASK_CLI_FILE"] == str(temp_tasks_file)
+
+
+# ---------------------------
+# Test SQLite storage backend
+# ---------------------------
+@pytest.fixture
+def sqlite_store(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "sqlite")
+    return temp_tasks_file.parent / "tasks.db"
+
+
+def test_sqlite_backend_runs_commands(sqlite_store, monkeypatch, capsys):
+    for argv in (["add", "A"], ["add", "B"], ["mark-done", "2"], ["update", "1", "A2"]):
+        monkeypatch.setattr(sys, "argv", ["task_cli.py"] + argv)
+        task_cli.main()
+    assert sqlite_store.exists()
+
+    store = task_cli.SqliteStore(str(sqlite_store))
+    assert store.get(1)["description"] == "A2"
+    assert [task["id"] for task in store.iter_tasks(status="done")] == [2]
+    assert store.count_by_status() == {"todo": 1, "in-progress": 0, "done": 1}
+    assert store.delete(1) is True
+    assert store.delete(1) is False
+    store.close()
+
+
+def test_sqlite_backend_imports_existing_tasks_json(sqlite_store, monkeypatch, capsys):
+    task_cli.save_tasks(
+        [{"id": 7, "description": "Old", "status": "todo", "createdAt": "x", "updatedAt": "x"}]
+    )
+
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "list", "todo"])
+    task_cli.main()
+
+    assert "Old" in capsys.readouterr().out
+
+
+def test_sqlite_lookups_use_indexes(sqlite_store):
+    store = task_cli.SqliteStore(str(sqlite_store))
+    plans = {
+        "status": "SELECT id FROM tasks WHERE status = 'todo'",
+        "recent": "SELECT id FROM tasks ORDER BY updatedAt DESC",
+    }
+    for query in plans.values():
+        plan = " ".join(
+            row[-1] for row in store.conn.execute("EXPLAIN QUERY PLAN " + query)
+        )
+        assert "USING" in plan and "INDEX" in plan
+    store.close()
+
+
+# ---------------------------
+# Test crash safe and concurrent writes
+# ---------------------------
+def test_save_tasks_failure_keeps_old_file(temp_tasks_file):
+    task_cli.save_tasks([{"id": 1, "description": "Keep me", "status": "todo"}])
+
+    # simulate a crash in the middle of writing the new content
+    with patch("task_cli.write_indented_json", side_effect=Exception("disk full")):
+        task_cli.save_tasks([])
+
+    assert task_cli.load_tasks() == [{"id": 1, "description": "Keep me", "status": "todo"}]
+    assert [p.name for p in temp_tasks_file.parent.iterdir()] == ["tasks.json"]
+
+
+@pytest.mark.parametrize("storage", ["json", "journal"])
+def test_failed_save_records_nothing_else(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "Alpha"], ["search", "alpha"])
+    version = task_cli.load_version()
+    history = os.path.getsize(task_cli.history_path())
+
+    def open_but_the_journal(path, mode="r", *args, **kwargs):
+        if path == task_cli.journal_path() and mode == "ab":
+            raise PermissionError(path)
+        return open(path, mode, *args, **kwargs)
+
+    if storage == "json":
+        failing = patch.object(task_cli, "write_file_atomically", side_effect=PermissionError)
+    else:
+        failing = patch.object(task_cli, "open", open_but_the_journal, create=True)
+    with failing:
+        run_cli(monkeypatch, ["update", "1", "Beta"])
+    assert "Error: Could not write" in capsys.readouterr().out
+
+    # no history, no new version, and the search index still has the task as it is on the disk
+    assert task_cli.load_version() == version
+    assert os.path.getsize(task_cli.history_path()) == history
+    run_cli(monkeypatch, ["search", "beta"], ["search", "alpha"])
+    out = capsys.readouterr().out
+    assert "No tasks found" in out or "0 task(s) found." in out
+    assert "1 task(s) found." in out
+
+
+def test_save_tasks_writes_what_json_dump_writes(temp_tasks_file):
+    tasks = [
+        {"id": 1, "description": 'say "hi", {ok}\n', "status": "todo"},
+        {"id": 2, "description": "Persian: سلام", "status": "done", "note": "}, {"},
+    ]
+    task_cli.save_tasks(tasks, "json")
+    assert temp_tasks_file.read_text(encoding="utf-8") == json.dumps(tasks, indent=4, ensure_ascii=False)
+    task_cli.save_tasks([], "json")
+    assert temp_tasks_file.read_text(encoding="utf-8") == "[]"
+
+    # Task objects are written from a template, the odd ones by the encoder, in chunks
+    tasks = [
+        {
+            "id": 1,
+            "description": 'say "hi" \\ \t{ok}\u2028 سلام',
+            "status": "todo",
+            "createdAt": "2024-01-01 10:00:00",
+            "updatedAt": "2024-02-03 04:05:06",
+        },
+        {
+            "id": 2,
+            "description": "B",
+            "status": "done",
+            "createdAt": "2024-01-01 10:00:00",
+            "updatedAt": "yesterday",
+        },
+        {"id": 3, "description": "C", "status": "blocked"},
+        {
+            "id": 4,
+            "description": "D",
+            "status": "todo",
+            "createdAt": "2024-01-01 10:00:00",
+            "updatedAt": "2024-01-01 10:00:00",
+            "tags": ["x", {"y": [1, 2]}, []],
+        },
+    ] + [
+        {
+            "id": i,
+            "description": f"task {i}",
+            "status": "done" if i % 2 else "todo",
+            "createdAt": "2024-01-01 00:00:00",
+            "updatedAt": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d} {i % 24:02d}:{i % 60:02d}:{i % 59:02d}",
+        }
+        for i in range(5, 2501)
+    ]
+    collection = task_cli.TaskCollection(task_cli.Task.from_dict(task) for task in tasks)
+    task_cli.save_tasks(collection, "json")
+    assert temp_tasks_file.read_text(encoding="utf-8") == json.dumps(tasks, indent=4, ensure_ascii=False)
+    task_cli.save_tasks(collection, "compact")
+    assert temp_tasks_file.read_text(encoding="utf-8") == json.dumps(
+        tasks, separators=(",", ":"), ensure_ascii=False
+    )
+
+
+def test_load_tasks_keeps_copy_of_corrupted_file(temp_tasks_file, capsys):
+    temp_tasks_file.write_text('[{"id": 1, "descr')
+
+    assert task_cli.load_tasks() == []
+
+    backups = list(temp_tasks_file.parent.glob("tasks.json.corrupt-*"))
+    assert len(backups) == 1
+    assert backups[0].read_text() == '[{"id": 1, "descr'
+    assert "could not be read" in capsys.readouterr().out
+
+
+def test_command_gives_up_when_lock_is_held(temp_tasks_file, monkeypatch, capsys):
+    task_cli.save_tasks([])
+    monkeypatch.setattr(task_cli, "LOCK_TIMEOUT", 0.1)
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "A"])
+
+    # flock locks belong to the open file, so main() opening the lock file again has to wait
+    with task_cli.store_lock():
+        task_cli.main()
+
+    assert "Another task_cli command is still working" in capsys.readouterr().out
+    assert task_cli.load_tasks() == []
+
+
+@pytest.mark.parametrize("storage", ["json", "journal"])
+def test_concurrent_adds_do_not_lose_updates(tmp_path, storage):
+    import subprocess
+
+    script = os.path.join(os.path.dirname(__file__), "..", "task_cli.py")
+    env = dict(
+        os.environ, TASK_CLI_FILE=str(tmp_path / "tasks.json"), TASK_CLI_STORAGE=storage
+    )
+    subprocess.run([sys.executable, script, "help"], env=env, stdout=subprocess.DEVNULL)
+
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", ADD_MANY_SCRIPT, script, str(worker)],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        for worker in range(6)
+    ]
+    for worker in workers:
+        assert worker.wait() == 0
+
+    with patch.object(task_cli, "TASKS_FILE", str(tmp_path / "tasks.json")):
+        tasks = task_cli.load_tasks()
+
+    assert len(tasks) == 6 * 5
+    assert len({task["id"] for task in tasks}) == 6 * 5
+
+
+# each worker runs main() a few times in-process, so the test doesn't start dozens of interpreters
+ADD_MANY_SCRIPT = """
+import sys
+sys.path.insert(0, __import__("os").path.dirname(sys.argv[1]))
+import task_cli
+worker = sys.argv[2]
+for i in range(5):
+    sys.argv = ["task_cli.py", "add", f"worker {worker} task {i}"]
+    task_cli.main()
+"""
+
+
+# ---------------------------
+# Test batch command
+# ---------------------------
+def test_parse_id_list_accepts_ranges_and_lists():
+    assert task_cli.parse_id_list("3-5,9") == [3, 4, 5, 9]
+    with pytest.raises(ValueError):
+        task_cli.parse_id_list("5-3")
+
+
+def test_batch_applies_lines_and_saves_once(temp_tasks_file, monkeypatch, capsys):
+    task_cli.save_tasks([])
+    batch_file = temp_tasks_file.parent / "ops.txt"
+    batch_file.write_text(
+        'add "Buy milk"\n'
+        "add don't forget\n"
+        "add third\n"
+        "# a comment\n"
+        "mark-done 1-2,99\n"
+        "delete 3\n"
+        "mark-todo 42\n"
+        "update 1 Buy oat milk\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "batch", str(batch_file)])
+
+    with patch("task_cli.save_tasks", wraps=task_cli.save_tasks) as mock_save:
+        task_cli.main()
+    mock_save.assert_called_once()
+
+    out = capsys.readouterr().out
+    assert "line 5: ok - mark-done applied to 2 task(s), not found: 99" in out
+    assert "line 7: error - task 42 not found" in out
+    assert "Batch finished: 6 succeeded, 1 failed." in out
+
+    tasks = task_cli.load_tasks()
+    assert [(t["description"], t["status"]) for t in tasks] == [
+        ("Buy oat milk", "done"),
+        ("don't forget", "done"),
+    ]
+
+
+@pytest.mark.parametrize("storage", ["journal", "sqlite"])
+def test_batch_reads_stdin_with_other_backends(temp_tasks_file, monkeypatch, storage):
+    import io
+
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setattr(sys, "stdin", io.StringIO("add A\nadd B\nmark-in-progress 1,2\n"))
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "batch"])
+    task_cli.main()
+
+    store = task_cli.open_store()
+    assert store.count_by_status()["in-progress"] == 2
+    store.close()
+
+
+# ---------------------------
+# Test ID index and ID allocation
+# ---------------------------
+def test_task_collection_lookup_and_remove():
+    tasks = task_cli.TaskCollection([{"id": 5, "status": "todo"}, {"id": 2, "status": "done"}])
+
+    assert tasks.get(2)["status"] == "done"
+    assert tasks.next_id == 6
+    assert tasks.remove(5)["id"] == 5
+    assert tasks.remove(5) is None
+    assert tasks.allocate_id() == 6
+    assert [task["id"] for task in tasks] == [2]
+
+
+@pytest.mark.parametrize("storage", ["json", "journal"])
+def test_deleted_ids_are_not_reused(temp_tasks_file, monkeypatch, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    for argv in (["add", "A"], ["add", "B"], ["delete", "2"], ["add", "C"]):
+        monkeypatch.setattr(sys, "argv", ["task_cli.py"] + argv)
+        task_cli.main()
+
+    task_cli.compact_journal()
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "D"])
+    task_cli.main()
+
+    assert [task["id"] for task in task_cli.load_tasks()] == [1, 3, 4]
+
+
+def test_new_id_does_not_depend_on_task_order(temp_tasks_file, monkeypatch):
+    task_cli.save_tasks(
+        [
+            {"id": 9, "description": "A", "status": "todo"},
+            {"id": 3, "description": "B", "status": "todo"},
+        ]
+    )
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "C"])
+    task_cli.main()
+
+    assert task_cli.load_tasks()[-1]["id"] == 10
+
+
+# ---------------------------
+# Test compact Task records
+# ---------------------------
+def test_task_round_trips_tasks_json_schema():
+    data = {
+        "id": 3,
+        "description": "کارهای خانه",
+        "status": "in-progress",
+        "createdAt": "2024-03-10 02:30:00",
+        "updatedAt": "not a date",
+        "priority": "high",
+    }
+    task = task_cli.Task.from_dict(data)
+
+    assert task.status == task_cli.STATUS_CODES["in-progress"]
+    assert isinstance(task.created, int)
+    assert task["updatedAt"] == "not a date"
+    assert task.to_dict() == data
+    assert not hasattr(task, "__dict__")
+
+
+def test_task_item_access_converts_fields():
+    task = task_cli.Task.from_dict({"id": 1, "description": "A", "status": "todo"})
+    task["status"] = "done"
+    task["updatedAt"] = "2025-01-02 03:04:05"
+
+    assert task.status == task_cli.STATUS_CODES["done"]
+    assert task.updated == task_cli.parse_timestamp("2025-01-02 03:04:05")
+    assert task.to_dict() == {
+        "id": 1,
+        "description": "A",
+        "status": "done",
+        "updatedAt": "2025-01-02 03:04:05",
+    }
+    with pytest.raises(KeyError):
+        task["createdAt"]
+
+
+def test_collection_keeps_tasks_as_task_objects(temp_tasks_file):
+    task_cli.save_tasks(make_tasks(3))
+    task_cli.save_tasks(task_cli.load_collection())
+
+    # a plain dict per task would take about twice the memory
+    assert all(type(task) is task_cli.Task for task in task_cli.load_collection().to_list())
+
+
+def test_saved_file_keeps_the_same_schema(temp_tasks_file, monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "add", "A"])
+    task_cli.main()
+
+    saved = json.loads(temp_tasks_file.read_text(encoding="utf-8"))
+    assert list(saved[0]) == ["id", "description", "status", "createdAt", "updatedAt"]
+    datetime.strptime(saved[0]["createdAt"], "%Y-%m-%d %H:%M:%S")
+
+
+# ---------------------------
+# Test streaming list
+# ---------------------------
+def test_iter_snapshot_handles_tasks_split_across_chunks(temp_tasks_file):
+    data = [
+        {"id": i, "description": "تسک " * i, "status": "todo", "createdAt": "x", "updatedAt": "x"}
+        for i in range(1, 30)
+    ]
+    task_cli.save_tasks(data)
+
+    streamed = [task.to_dict() for task in task_cli.iter_snapshot(chunk_size=7)]
+    assert streamed == data
+
+
+def test_list_streams_without_loading_everything(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "journal")
+    task_cli.save_tasks(
+        [
+            {"id": 1, "description": "A", "status": "todo"},
+            {"id": 2, "description": "B", "status": "done"},
+        ]
+    )
+    for argv in (["mark-done", "1"], ["add", "C"], ["delete", "2"]):
+        monkeypatch.setattr(sys, "argv", ["task_cli.py"] + argv)
+        task_cli.main()
+    capsys.readouterr()
+
+    monkeypatch.setattr(sys, "argv", ["task_cli.py", "list", "done"])
+    with patch("task_cli.load_collection") as mock_load:
+        task_cli.main()
+    mock_load.assert_not_called()
+
+    out = capsys.readouterr().out
+    assert "1      done                 A" in out
+    assert " B" not in out and " C" not in out
+
+
+def test_list_into_closed_pipe_exits_cleanly(tmp_path):
+    import subprocess
+
+    task_cli_path = os.path.join(os.path.dirname(__file__), "..", "task_cli.py")
+    with patch.object(task_cli, "TASKS_FILE", str(tmp_path / "tasks.json")):
+        task_cli.save_tasks(
+            [{"id": i, "description": "x" * 100, "status": "todo"} for i in range(1, 5001)]
+        )
+
+    env = dict(os.environ, TASK_CLI_FILE=str(tmp_path / "tasks.json"))
+    lister = subprocess.Popen(
+        [sys.executable, task_cli_path, "list"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    lister.stdout.readline()
+    lister.stdout.close()
+
+    assert lister.wait(timeout=30) == 0
+    assert b"BrokenPipe" not in lister.stderr.read()
+
+
+# ---------------------------
+# Test persisted status and recency indexes
+# ---------------------------
+def run_cli(monkeypatch, *commands):
+    for argv in commands:
+        monkeypatch.setattr(sys, "argv", ["task_cli.py"] + list(argv))
+        task_cli.main()
+
+
+@pytest.mark.parametrize("storage", ["json", "journal"])
+def test_stats_reads_saved_counters(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    run_cli(
+        monkeypatch,
+        ["add", "A"],
+        ["add", "B"],
+        ["add", "C"],
+        ["mark-done", "2"],
+        ["delete", "3"],
+    )
+    capsys.readouterr()
+
+    with patch("task_cli.load_collection") as mock_load:
+        run_cli(monkeypatch, ["stats"])
+    mock_load.assert_not_called()
+
+    out = capsys.readouterr().out
+    assert "Todo:        1" in out
+    assert "Done:        1" in out
+    assert "Total Tasks: 2" in out
+
+
+def test_stats_ignores_counters_after_hand_edit(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"])
+    tasks = json.loads(temp_tasks_file.read_text(encoding="utf-8"))
+    tasks[0]["status"] = "done"
+    temp_tasks_file.write_text(json.dumps(tasks), encoding="utf-8")
+    capsys.readouterr()
+
+    run_cli(monkeypatch, ["stats"])
+
+    assert "Done:        1" in capsys.readouterr().out
+
+
+def test_stats_remembers_counts_of_a_hand_written_file(temp_tasks_file, monkeypatch, capsys):
+    temp_tasks_file.write_text(json.dumps(make_tasks(3)), encoding="utf-8")
+
+    # the first stats has to read the file, the next ones use the summary it left behind
+    run_cli(monkeypatch, ["stats"])
+    with patch("task_cli.load_collection") as mock_load:
+        run_cli(monkeypatch, ["stats"])
+    mock_load.assert_not_called()
+
+    assert capsys.readouterr().out.count("Total Tasks: 3") == 2
+
+
+def test_help_and_stats_start_without_json(temp_tasks_file, monkeypatch):
+    import subprocess
+
+    run_cli(monkeypatch, ["add", "A"])
+    env = dict(os.environ, TASK_CLI_FILE=str(temp_tasks_file), TASK_CLI_SERVER="off")
+    # runs the command in a fresh Python and reports whether json got imported along the way
+    code = (
+        "import sys, task_cli\n"
+        "sys.argv = ['task_cli.py', sys.argv[1]]\n"
+        "task_cli.main()\n"
+        "print('json' in sys.modules)\n"
+    )
+    for command in ("help", "stats"):
+        result = subprocess.run(
+            [sys.executable, "-c", code, command],
+            cwd=os.path.join(os.path.dirname(__file__), ".."),
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        assert result.stdout.splitlines()[-1] == "False"
+
+
+def test_entry_point_runs_the_cached_module(temp_tasks_file, monkeypatch):
+    import subprocess
+
+    # "import task_cli" is the real module, that is what every test here patches
+    assert task_cli.__name__ == "_task_cli"
+
+    root = os.path.join(os.path.dirname(__file__), "..")
+    env = dict(os.environ, TASK_CLI_FILE=str(temp_tasks_file), TASK_CLI_SERVER="off")
+    # task_cli.py is compiled on every start, so it has to stay small
+    with open(os.path.join(root, "task_cli.py"), encoding="utf-8") as f:
+        assert len(f.readlines()) < 20
+    result = subprocess.run(
+        [sys.executable, os.path.join(root, "task_cli.py"), "add", "A"],
+        cwd=str(temp_tasks_file.parent),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert "Task added successfuly (ID: 1)" in result.stdout
+    assert [task["description"] for task in task_cli.load_tasks()] == ["A"]
+
+
+def test_list_recent_follows_the_recency_index(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["add", "C"], ["mark-done", "1"])
+    capsys.readouterr()
+
+    # every change happens within the same second, only the index knows the real order
+    run_cli(monkeypatch, ["list", "recent"])
+    out = capsys.readouterr().out
+    assert out.index(" A") < out.index(" C") < out.index(" B")
+
+    # read back from the index file (changes == [] means it wasn't built again)
+    saved = task_cli.load_collection().index
+    assert saved.changes == []
+    assert list(saved.recent) == [2, 3, 1]
+    assert saved.ids_by_status["done"] == {1}
+
+
+def test_save_writes_meta_once_and_appends_to_the_index(temp_tasks_file, monkeypatch):
+    run_cli(monkeypatch, *[["add", f"Task {n}"] for n in range(1, 21)])
+    index_file = temp_tasks_file.parent / "tasks.json.index"
+    size = index_file.stat().st_size
+    lines = len(index_file.read_text().splitlines())
+
+    written = []
+    write = task_cli.write_file_atomically
+    monkeypatch.setattr(
+        task_cli,
+        "write_file_atomically",
+        lambda path, *args, **kwargs: written.append(os.path.basename(path)) or write(path, *args, **kwargs),
+    )
+    run_cli(monkeypatch, ["mark-done", "3"], ["update", "5", "Changed"], ["delete", "7"])
+
+    # per save: tasks.json, one meta write with next_id and the index stamp, the summary
+    assert written == ["tasks.json", "tasks.json.meta", "tasks.json.summary"] * 3
+    # the index got three short lines of changes, not three new copies
+    assert len(index_file.read_text().splitlines()) == lines + 3
+    assert size < index_file.stat().st_size < size + 100
+
+    saved = task_cli.load_collection()
+    assert saved.index.changes == []
+    assert list(saved.index.recent) == [n for n in range(1, 21) if n not in (3, 5, 7)] + [3, 5]
+    assert saved.index.ids_by_status == task_cli.TaskIndex.build(saved).ids_by_status
+    assert task_cli.load_meta()["next_id"] == 21
+
+    # once the changes are as big as the index itself, it is written again in one line
+    run_cli(monkeypatch, *[["update", "1", f"Again {n}"] for n in range(40)])
+    assert "tasks.json.index" in written
+    assert len(index_file.read_text().splitlines()) < 40
+    assert list(task_cli.load_collection().index.recent)[-1] == 1
+
+
+def test_task_index_updates_incrementally():
+    tasks = task_cli.TaskCollection(
+        [task_cli.Task(1, "A", 0, 10, 10), task_cli.Task(2, "B", 0, 5, 5)]
+    )
+    tasks.index = task_cli.TaskIndex.build(tasks)
+    assert list(tasks.index.newest_first()) == [1, 2]
+
+    task = tasks.get(2)
+    task["status"] = "done"
+    tasks.put(task)
+    tasks.remove(1)
+
+    assert list(tasks.index.newest_first()) == [2]
+    assert tasks.index.counts() == {"todo": 0, "in-progress": 0, "done": 1}
+
+
+# ---------------------------
+# Test list pages (--limit / --offset / --since)
+# ---------------------------
+def make_tasks(count):
+    return [
+        {
+            "id": i,
+            "description": f"task {i}",
+            "status": "done" if i % 2 else "todo",
+            "createdAt": "2024-01-01 00:00:00",
+            # task 1 is the most recently changed one
+            "updatedAt": f"2024-01-{32 - i:02d} 00:00:00",
+        }
+        for i in range(1, count + 1)
+    ]
+
+
+def test_list_limit_and_offset(temp_tasks_file, monkeypatch, capsys):
+    task_cli.save_tasks(make_tasks(10))
+    run_cli(monkeypatch, ["list", "done", "--limit", "2", "--offset", "1"])
+
+    out = capsys.readouterr().out
+    assert "task 3\n" in out and "task 5\n" in out
+    assert "task 1\n" not in out and "task 7\n" not in out
+    assert "use --offset 3" in out
+
+
+def test_list_recent_top_n_uses_a_heap_without_index(temp_tasks_file, monkeypatch, capsys):
+    task_cli.save_tasks(make_tasks(10))
+    run_cli(monkeypatch, ["list", "recent", "--limit", "3", "--since", "2024-01-20"])
+
+    out = capsys.readouterr().out
+    assert out.index("task 1\n") < out.index("task 2\n") < out.index("task 3\n")
+    assert "task 4\n" not in out
+
+
+def test_list_recent_pages_agree_when_tasks_share_a_second(temp_tasks_file, monkeypatch):
+    tasks = make_tasks(6)
+    for task in tasks:
+        task["updatedAt"] = "2024-01-20 10:00:00"
+    task_cli.save_tasks(tasks)
+
+    # the heap (no saved index) and the recency index put ties in the same order
+    pages = [
+        [task.id for task in task_cli.JsonStore().iter_tasks(recent=True, limit=2, offset=offset)]
+        for offset in (0, 2, 4)
+    ]
+    assert not task_cli.saved_index_is_current()
+    store = task_cli.JsonStore()
+    assert sum(pages, []) == [task.id for task in store.iter_tasks(recent=True)] == [6, 5, 4, 3, 2, 1]
+
+
+def test_list_since_walks_recency_index(temp_tasks_file, monkeypatch):
+    task_cli.save_tasks(make_tasks(10))
+    store = task_cli.JsonStore()
+    since = task_cli.parse_since("2024-01-28")
+
+    assert [task.id for task in store.iter_tasks(recent=True, since=since)] == [1, 2, 3, 4]
+    assert [task.id for task in store.iter_tasks(status="todo", since=since)] == [2, 4]
+
+
+def test_list_rejects_bad_options(temp_tasks_file, monkeypatch, capsys):
+    task_cli.save_tasks(make_tasks(1))
+    run_cli(monkeypatch, ["list", "--limit", "ten"])
+
+    assert "--limit needs a number" in capsys.readouterr().out
+
+
+def test_sqlite_list_pages(sqlite_store):
+    store = task_cli.SqliteStore(str(sqlite_store))
+    with patch.object(task_cli, "load_tasks", return_value=make_tasks(10)):
+        store.create()
+
+    page = store.iter_tasks(recent=True, limit=2, offset=1)
+    assert [task["id"] for task in page] == [2, 3]
+    since = task_cli.parse_since("2024-01-29")
+    assert [task["id"] for task in store.iter_tasks(since=since)] == [1, 2, 3]
+    store.close()
+
+
+# ---------------------------
+# Test search
+# ---------------------------
+def test_parse_search_query_groups_and_prefixes():
+    assert task_cli.parse_search_query(["Buy", "milk", "OR", "groc*"]) == [
+        [("buy", False), ("milk", False)],
+        [("groc", True)],
+    ]
+
+
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite"])
+def test_search_index_follows_changes(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    run_cli(
+        monkeypatch,
+        ["add", "Buy milk"],
+        ["add", "Buy groceries for dinner"],
+        ["add", "خرید نان"],
+        ["search", "buy"],
+    )
+    assert "2 task(s) found." in capsys.readouterr().out
+
+    # from now on the index is only updated, never rebuilt
+    run_cli(
+        monkeypatch,
+        ["update", "1", "Call mom"],
+        ["mark-done", "2"],
+        ["add", "Buy bread"],
+        ["delete", "3"],
+    )
+    capsys.readouterr()
+
+    store = task_cli.open_store()
+    with patch.object(task_cli.SearchIndex, "rebuild") as mock_rebuild:
+        found = lambda *words, status=None: [
+            task["id"] for task in store.search(task_cli.parse_search_query(words), status)
+        ]
+        assert found("buy") == [2, 4]
+        assert found("buy", "dinner") == [2]
+        assert found("mom", "OR", "bread") == [1, 4]
+        assert found("groc*") == [2]
+        assert found("buy", status="todo") == [4]
+        assert found("نان") == []
+    mock_rebuild.assert_not_called()
+    store.close()
+
+
+def test_search_rebuilds_after_hand_edit(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "Water plants"], ["search", "water"])
+    temp_tasks_file.write_text(
+        json.dumps([{"id": 1, "description": "Feed cat", "status": "todo"}]), encoding="utf-8"
+    )
+    capsys.readouterr()
+
+    run_cli(monkeypatch, ["search", "cat"])
+
+    out = capsys.readouterr().out
+    assert "Feed cat" in out and "1 task(s) found." in out
+
+
+# ---------------------------
+# Test serve (daemon mode)
+# ---------------------------
+@pytest.fixture
+def task_server(temp_tasks_file):
+    import subprocess
+    import time
+
+    script = os.path.join(os.path.dirname(__file__), "..", "task_cli.py")
+    env = dict(os.environ, TASK_CLI_FILE=str(temp_tasks_file))
+    server = subprocess.Popen(
+        [sys.executable, script, "serve"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    socket_file = temp_tasks_file.parent / "tasks.json.sock"
+    deadline = time.monotonic() + 10
+    while not socket_file.exists():
+        assert time.monotonic() < deadline, server.stdout.read()
+        time.sleep(0.02)
+
+    yield server
+
+    if server.poll() is None:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_commands_are_forwarded_to_the_server(task_server, temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["mark-done", "1"], ["list", "done"])
+
+    out = capsys.readouterr().out
+    assert "Task added successfuly (ID: 2)" in out
+    assert "1      done                 A" in out
+
+    # the server writes the changes behind, they reach tasks.json a moment later
+    task_server.terminate()
+    task_server.wait(timeout=10)
+    assert not (temp_tasks_file.parent / "tasks.json.sock").exists()
+    assert [task["status"] for task in task_cli.load_tasks()] == ["done", "todo"]
+
+
+def test_direct_commands_line_up_with_the_server(task_server, temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["mark-done", "1"])
+
+    # clear-done asks a question, so it runs here and waits for the server's write lock
+    with patch("builtins.input", return_value="y"):
+        run_cli(monkeypatch, ["clear-done"])
+    run_cli(monkeypatch, ["add", "B"], ["list"])
+
+    out = capsys.readouterr().out
+    assert "Successfully cleaned up 1 completed tasks." in out
+    assert "2      todo                 B" in out
+    assert " A\n" not in out.split("Successfully")[1]
+
+
+def test_no_server_falls_back_to_the_file(temp_tasks_file, monkeypatch):
+    (temp_tasks_file.parent / "tasks.json.sock").write_text("")
+
+    assert task_cli.forward_to_server(["stats"]) is None
+
+
+# ---------------------------
+# Test the HTTP API (serve --http)
+# ---------------------------
+@pytest.fixture
+def http_api(temp_tasks_file):
+    import subprocess
+    import time
+    import http.client
+
+    script = os.path.join(os.path.dirname(__file__), "..", "task_cli.py")
+    env = dict(os.environ, TASK_CLI_FILE=str(temp_tasks_file))
+    server = subprocess.Popen(
+        [sys.executable, script, "serve", "--http", "0"],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    # port 0 lets the system pick a free port, the server tells us which one
+    deadline = time.monotonic() + 10
+    line = ""
+    while "http://" not in line:
+        assert time.monotonic() < deadline and server.poll() is None
+        line = server.stdout.readline()
+    port = int(line.rsplit(":", 1)[1])
+
+    def request(method, path, body=None):
+        client = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        try:
+            client.request(method, path, body=None if body is None else json.dumps(body))
+            response = client.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            client.close()
+
+    request.port = port
+    yield request
+
+    if server.poll() is None:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def test_http_api_mirrors_the_commands(http_api):
+    assert http_api("POST", "/tasks", {"description": "Buy milk"})[0] == 201
+    status, task = http_api("POST", "/tasks", {"description": "Buy bread"})
+    assert (status, task["id"], task["status"]) == (201, 2, "todo")
+
+    assert http_api("POST", "/tasks/1/mark-done")[1]["status"] == "done"
+    status, task = http_api("PATCH", "/tasks/2", {"description": "Buy rye", "status": "in-progress"})
+    assert (task["description"], task["status"]) == ("Buy rye", "in-progress")
+
+    assert [t["id"] for t in http_api("GET", "/tasks?status=done")[1]] == [1]
+    assert [t["id"] for t in http_api("GET", "/tasks?limit=1&offset=1")[1]] == [2]
+    assert http_api("GET", "/stats")[1] == {"todo": 0, "in-progress": 1, "done": 1, "total": 2}
+
+    assert http_api("DELETE", "/tasks/1") == (200, {"id": 1, "deleted": True})
+    assert http_api("GET", "/tasks/1")[0] == 404
+    assert http_api("PATCH", "/tasks/2", {"status": "nope"})[0] == 400
+    assert http_api("POST", "/tasks", {"description": ""})[0] == 400
+    for blank in ("", "   "):
+        assert http_api("PATCH", "/tasks/2", {"description": blank}) == (
+            400,
+            {"error": "'description' must be a non-empty string"},
+        )
+    assert http_api("GET", "/tasks/2")[1]["description"] == "Buy rye"
+    assert http_api("GET", "/tasks?status=later")[0] == 400
+
+
+def test_http_list_streams_while_others_write(http_api, temp_tasks_file):
+    from concurrent.futures import ThreadPoolExecutor
+
+    for i in range(1, 601):
+        http_api("POST", "/tasks", {"description": f"task {i}"})
+
+    # many readers and writers at once: every list is one whole, valid JSON array
+    with ThreadPoolExecutor(8) as pool:
+        lists = [pool.submit(http_api, "GET", "/tasks") for _ in range(8)]
+        adds = [pool.submit(http_api, "POST", "/tasks", {"description": "more"}) for _ in range(20)]
+        for future in lists:
+            ids = [task["id"] for task in future.result()[1]]
+            assert ids == sorted(ids) and ids[:600] == list(range(1, 601))
+        assert sorted(future.result()[1]["id"] for future in adds) == list(range(601, 621))
+
+    assert http_api("GET", "/stats")[1]["total"] == 620
+
+
+# ---------------------------
+# Test tasks.json formats (migrate)
+# ---------------------------
+@pytest.mark.parametrize("fmt", ["json", "compact", "jsonl", "binary"])
+def test_migrate_keeps_every_task(temp_tasks_file, monkeypatch, capsys, fmt):
+    temp_tasks_file.write_text(json.dumps(make_tasks(5)), encoding="utf-8")
+    before = task_cli.load_tasks()
+
+    run_cli(monkeypatch, ["migrate", "--to", fmt])
+    assert f"Migrated 5 tasks from compact to {fmt}." in capsys.readouterr().out
+    assert task_cli.snapshot_format() == fmt
+    assert task_cli.load_tasks() == before
+    assert [task.to_dict() for task in task_cli.iter_snapshot()] == before
+
+    # later saves keep the format
+    run_cli(monkeypatch, ["mark-done", "2"], ["add", "New"], ["list", "done"])
+    assert task_cli.snapshot_format() == fmt
+    assert "2      done                 task 2" in capsys.readouterr().out
+    assert task_cli.load_tasks()[-1]["description"] == "New"
+
+
+def test_new_file_uses_the_configured_format(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_FORMAT", "binary")
+    run_cli(monkeypatch, ["add", "A"])
+
+    assert temp_tasks_file.read_bytes().startswith(task_cli.BINARY_MAGIC)
+    assert task_cli.load_tasks()[0]["description"] == "A"
+
+
+def test_jsonl_add_only_appends(temp_tasks_file, monkeypatch):
+    run_cli(monkeypatch, ["add", "A"], ["migrate", "--to", "jsonl"])
+    before = temp_tasks_file.read_text(encoding="utf-8")
+
+    with patch("task_cli.write_file_atomically") as mock_write:
+        run_cli(monkeypatch, ["add", "B"])
+    assert not any(call.args[0] == str(temp_tasks_file) for call in mock_write.call_args_list)
+
+    after = temp_tasks_file.read_text(encoding="utf-8")
+    assert after.startswith(before) and after.count("\n") == before.count("\n") + 1
+
+    # a change to a task that is already in the file rewrites it, no duplicate lines
+    run_cli(monkeypatch, ["mark-done", "2"])
+    assert [task["status"] for task in task_cli.load_tasks()] == ["todo", "done"]
+    assert temp_tasks_file.read_text(encoding="utf-8").count('"id": 2') == 1
+
+
+def test_jsonl_ignores_half_written_last_line(temp_tasks_file, monkeypatch):
+    run_cli(monkeypatch, ["add", "A"], ["migrate", "--to", "jsonl"])
+    with open(temp_tasks_file, "a", encoding="utf-8") as f:
+        f.write('{"id": 2, "descrip')
+
+    assert [task["description"] for task in task_cli.load_tasks()] == ["A"]
+    assert temp_tasks_file.exists()
+
+
+def test_jsonl_add_after_half_written_last_line(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["migrate", "--to", "jsonl"])
+    with open(temp_tasks_file, "a", encoding="utf-8") as f:
+        f.write('{"id": 2, "descrip')
+
+    # the new task must not be glued to the broken line
+    run_cli(monkeypatch, ["add", "B"], ["add", "C"])
+    assert [task["description"] for task in task_cli.load_tasks()] == ["A", "B", "C"]
+    assert task_cli.snapshot_format() == "jsonl"
+    assert not list(temp_tasks_file.parent.glob("tasks.json.corrupt-*"))
+    assert "could not be read" not in capsys.readouterr().out
+
+
+def test_jsonl_load_after_line_torn_inside_a_character(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["migrate", "--to", "jsonl"])
+    # the crash cut "é" (two bytes in UTF-8) in half
+    with open(temp_tasks_file, "ab") as f:
+        f.write('{"id": 3, "description": "café"}'.encode("utf-8")[:-3])
+
+    run_cli(monkeypatch, ["add", "C"])
+    assert [(task["id"], task["description"]) for task in task_cli.load_tasks()] == [
+        (1, "A"),
+        (2, "B"),
+        (3, "C"),
+    ]
+    assert not list(temp_tasks_file.parent.glob("tasks.json.corrupt-*"))
+    assert "could not be read" not in capsys.readouterr().out
+
+
+def test_migrate_needs_a_known_format(temp_tasks_file, monkeypatch, capsys):
+    run_cli(monkeypatch, ["add", "A"], ["migrate", "--to", "xml"])
+
+    assert "Usage: task-cli migrate --to [json|compact|jsonl|binary]" in capsys.readouterr().out
+    assert task_cli.snapshot_format() == "json"
+
+
+# ---------------------------
+# Test mmap record storage
+# ---------------------------
+@pytest.fixture
+def record_store(temp_tasks_file, monkeypatch):
+    monkeypatch.setenv("TASK_CLI_STORAGE", "mmap")
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    return temp_tasks_file.parent / "tasks.records"
+
+
+def test_record_store_runs_commands(record_store, monkeypatch, capsys):
+    run_cli(
+        monkeypatch,
+        ["add", "A"],
+        ["add", "B"],
+        ["add", "C"],
+        ["mark-done", "2"],
+        ["update", "1", "A2"],
+        ["delete", "3"],
+        ["list"],
+        ["stats"],
+    )
+    out = capsys.readouterr().out
+    assert "1      todo                 A2" in out
+    assert "2      done                 B" in out
+    assert " C\n" not in out.split("ID     Status")[-1]
+    assert "Total Tasks: 2" in out
+
+    # IDs are never reused, the header remembers the next one
+    run_cli(monkeypatch, ["add", "D"], ["list", "recent", "--limit", "1"])
+    assert "4      todo                 D" in capsys.readouterr().out
+
+
+def test_record_store_marks_in_place(record_store, temp_tasks_file, monkeypatch):
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["add", "C"])
+    heap = temp_tasks_file.parent / "tasks.heap"
+    records_before, heap_before = record_store.read_bytes(), heap.read_bytes()
+
+    run_cli(monkeypatch, ["mark-done", "2"])
+
+    # only the header and the 32 bytes of task 2 changed, the descriptions were not touched
+    records_after = record_store.read_bytes()
+    size = task_cli.RECORD_SIZE
+    changed = {
+        i // size for i in range(len(records_after)) if records_before[i] != records_after[i]
+    }
+    assert changed == {0, 2}
+    assert heap.read_bytes() == heap_before
+
+
+def test_record_store_brings_tasks_json_along(record_store, temp_tasks_file, monkeypatch, capsys):
+    temp_tasks_file.write_text(json.dumps(make_tasks(4)), encoding="utf-8")
+
+    with patch("builtins.input", return_value="y"):
+        run_cli(monkeypatch, ["list", "done"], ["clear-done"])
+    out = capsys.readouterr().out
+    assert "1      done                 task 1" in out
+    assert "3      done                 task 3" in out
+
+    store = task_cli.RecordStore()
+    assert [task.to_dict() for task in store.iter_tasks()] == make_tasks(4)[1::2]
+    assert store.count_by_status() == {"todo": 2, "in-progress": 0, "done": 0}
+    store.close()
+
+
+# ---------------------------
+# Test history and list --as-of
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_history_and_list_as_of(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"])
+    clock["now"] = "2024-05-02 10:00:00"
+    run_cli(monkeypatch, ["mark-done", "1"], ["update", "2", "B2"])
+    clock["now"] = "2024-05-03 10:00:00"
+    run_cli(monkeypatch, ["delete", "2"])
+    capsys.readouterr()
+
+    run_cli(monkeypatch, ["list", "--as-of", "2024-05-01 12:00:00"])
+    out = capsys.readouterr().out
+    assert "1      todo                 A" in out and "2      todo                 B" in out
+
+    run_cli(monkeypatch, ["list", "done", "--as-of", "2024-05-02 12:00:00"])
+    out = capsys.readouterr().out
+    assert "1      done                 A" in out and "B2" not in out
+
+    run_cli(monkeypatch, ["list", "--as-of", "2024-05-03"], ["list", "--as-of", "2024-04-30"])
+    out = capsys.readouterr().out
+    assert "2      todo                 B2" in out
+    assert "Error: The task history doesn't go back to 2024-04-30 00:00:00." in out
+
+    run_cli(monkeypatch, ["history", "2"])
+    assert capsys.readouterr().out.splitlines()[-3:] == [
+        "  2024-05-01 10:00:00  todo         B",
+        "  2024-05-02 10:00:00  todo         B2",
+        "  2024-05-03 10:00:00  deleted",
+    ]
+
+
+def test_as_of_starts_from_the_nearest_checkpoint(temp_tasks_file, monkeypatch):
+    monkeypatch.setattr(task_cli, "HISTORY_CHECKPOINT_BYTES", 200)
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+
+    for day in range(1, 10):
+        clock["now"] = f"2024-05-0{day} 10:00:00"
+        run_cli(monkeypatch, ["add", f"day {day}"])
+
+    # a checkpoint every few changes, not after every single one
+    assert 2 < len(task_cli.load_checkpoints()) < 9
+
+    for day in range(1, 10):
+        past = task_cli.tasks_as_of(task_cli.parse_since(f"2024-05-0{day} 12:00:00"))
+        assert [task.description for task in past] == [f"day {i}" for i in range(1, day + 1)]
+
+
+# ---------------------------
+# Test --profile and TASK_CLI_TRACE
+# ---------------------------
+def test_profile_reports_phases_to_stderr(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"])
+    capsys.readouterr()
+
+    run_cli(monkeypatch, ["mark-done", "--profile", "2"])
+    out, err = capsys.readouterr()
+
+    # the flag is not an argument of the command
+    assert "Task 2 is now done" in out
+    assert err.startswith("profile: mark-done (json)")
+    for phase in task_cli.PROFILE_PHASES:
+        assert f"  {phase} " in err
+    read, written = [int(word) for word in err.split() if word.isdigit()][-2:]
+    assert read > 0 and written > 0
+    assert task_cli.TRACE is None
+
+
+def test_trace_env_appends_metrics_and_profile_dump(temp_tasks_file, monkeypatch, capsys, tmp_path):
+    import pstats
+
+    metrics = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    monkeypatch.setenv("TASK_CLI_TRACE", str(metrics))
+    run_cli(monkeypatch, ["add", "A"], ["list"])
+
+    reports = [json.loads(line) for line in metrics.read_text().splitlines()]
+    assert [report["command"] for report in reports] == ["add", "list"]
+    assert set(reports[0]["phases_ms"]) == set(task_cli.PROFILE_PHASES)
+    assert reports[0]["bytes_written"] > 0 and reports[1]["bytes_read"] > 0
+    # only the file gets the metrics, stderr stays quiet
+    assert "profile:" not in capsys.readouterr().err
+
+    dump = tmp_path / "out.prof"
+    run_cli(monkeypatch, ["stats", f"--profile={dump}"])
+    assert "profile: stats" in capsys.readouterr().err
+    assert pstats.Stats(str(dump)).total_calls > 0
+
+
+# ---------------------------
+# Test archive and clear-done without a question
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_archive_moves_old_done_tasks(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["add", "C"], ["mark-done", "1"])
+    clock["now"] = "2024-05-20 10:00:00"
+    run_cli(monkeypatch, ["mark-done", "2"])
+    capsys.readouterr()
+
+    # only task 1 has been done for more than 10 days
+    run_cli(monkeypatch, ["archive", "--older-than", "10"])
+    assert "Archived 1 done tasks" in capsys.readouterr().out
+    run_cli(monkeypatch, ["archive"])
+    assert "Archived 1 done tasks" in capsys.readouterr().out
+    run_cli(monkeypatch, ["archive"])
+    assert "No done tasks to archive." in capsys.readouterr().out
+
+    assert task_cli.archived_count() == 2
+    assert [task.id for task in task_cli.iter_archive()] == [1, 2]
+
+    run_cli(monkeypatch, ["stats"])
+    out = capsys.readouterr().out
+    assert "Done:        0" in out and "Archived:    2" in out
+
+    run_cli(monkeypatch, ["list"])
+    assert "A" not in capsys.readouterr().out.split()
+    run_cli(monkeypatch, ["list", "--include-archived"])
+    rows = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert [row[0] for row in rows if row[1:2] in (["todo"], ["done"])] == ["3", "1", "2"]
+    run_cli(monkeypatch, ["list", "done", "--include-archived", "--limit", "1", "--offset", "1"])
+    out = capsys.readouterr().out
+    assert "B" in out.split() and "A" not in out.split()
+
+
+def test_archive_ignores_a_block_the_header_does_not_count(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "A"], ["mark-done", "1"], ["archive", "--compress", "lzma"])
+    header = task_cli.load_archive_header()
+    assert header[:2] == ("lzma", 1)
+
+    # a crash after writing a block but before the header was updated
+    with open(task_cli.archive_path(), "ab") as f:
+        f.write(b"half a block")
+    assert [task.description for task in task_cli.iter_archive()] == ["A"]
+
+    # the next run writes over it
+    run_cli(monkeypatch, ["add", "B"], ["mark-done", "2"], ["archive"])
+    assert [task.description for task in task_cli.iter_archive()] == ["A", "B"]
+    assert task_cli.load_archive_header()[1] == 2
+
+
+def test_automatic_archive_runs_once_a_day(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    monkeypatch.setenv("TASK_CLI_ARCHIVE_AFTER", "30")
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+    run_cli(monkeypatch, ["add", "A"], ["mark-done", "1"])
+
+    clock["now"] = "2024-06-15 10:00:00"
+    run_cli(monkeypatch, ["add", "B"])
+    assert task_cli.archived_count() == 1
+    assert task_cli.load_meta()["archive_checked"] == "2024-06-15"
+
+    # checked today already, so a newly old task waits for tomorrow
+    with patch.object(task_cli, "archive_tasks") as archive:
+        run_cli(monkeypatch, ["add", "C"])
+    archive.assert_not_called()
+
+
+def test_clear_done_without_a_question(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "A"], ["mark-done", "1"])
+
+    # nobody to answer: nothing is deleted and nothing crashes
+    with patch("builtins.input", side_effect=EOFError):
+        run_cli(monkeypatch, ["clear-done"])
+    assert "use 'clear-done --yes'" in capsys.readouterr().out
+    assert len(task_cli.load_tasks()) == 1
+
+    with patch("builtins.input") as ask:
+        run_cli(monkeypatch, ["clear-done", "--yes"])
+    ask.assert_not_called()
+    assert task_cli.load_tasks() == []
+
+
+# ---------------------------
+# Test projects
+# ---------------------------
+def test_project_writes_only_its_own_shard(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "root task"])
+    root_mtime = os.path.getmtime(temp_tasks_file)
+
+    run_cli(monkeypatch, ["add", "--project", "foo", "foo task"], ["mark-done", "1", "--project", "foo"])
+    shard = temp_tasks_file.parent / "projects" / "foo" / "tasks.json"
+    assert [task["status"] for task in json.loads(shard.read_text())] == ["done"]
+    assert (temp_tasks_file.parent / "projects" / "foo" / "tasks.json.lock").exists()
+    assert os.path.getmtime(temp_tasks_file) == root_mtime
+    # the project is only for that one command
+    assert task_cli.TASKS_FILE == str(temp_tasks_file)
+    assert [task["description"] for task in task_cli.load_tasks()] == ["root task"]
+
+    capsys.readouterr()
+    run_cli(monkeypatch, ["list", "--project", "../elsewhere"])
+    assert "can't be a project name" in capsys.readouterr().out
+
+
+def test_all_projects_list_and_stats(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+    run_cli(monkeypatch, ["add", "root old"])
+    for day, project in ((2, "foo"), (3, "bar"), (4, "foo")):
+        clock["now"] = f"2024-05-0{day} 10:00:00"
+        run_cli(monkeypatch, ["add", "--project", project, f"{project} day {day}"])
+    run_cli(monkeypatch, ["mark-done", "1", "--project", "bar"])
+    capsys.readouterr()
+
+    # one process per shard, the real pool even with one CPU
+    with patch("os.cpu_count", return_value=4):
+        run_cli(monkeypatch, ["list", "recent", "--all-projects", "--limit", "3"])
+    rows = [line.split()[0] for line in capsys.readouterr().out.splitlines() if ":" in line[:20]]
+    assert rows == ["bar:1", "foo:2", "foo:1"]
+
+    run_cli(monkeypatch, ["list", "done", "--all-projects"])
+    rows = [line.split()[0] for line in capsys.readouterr().out.splitlines() if ":" in line[:20]]
+    assert rows == ["bar:1"]
+
+    run_cli(monkeypatch, ["stats", "--all-projects"])
+    out = capsys.readouterr().out
+    assert "Todo:        3" in out and "Done:        1" in out and "Total Tasks: 4" in out
+    assert out.index("default") < out.index("bar") < out.index("foo")
+
+
+# ---------------------------
+# Test report
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_report_counters_follow_every_change(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"], ["add", "C"])
+    # the first report builds the counters from the tasks
+    run_cli(monkeypatch, ["report"])
+    assert os.path.exists(task_cli.rollups_path())
+
+    clock["now"] = "2024-05-03 10:00:00"
+    run_cli(monkeypatch, ["mark-done", "1"], ["mark-in-progress", "2"], ["delete", "3"])
+    # changing a done task again is not finishing it again
+    run_cli(monkeypatch, ["update", "1", "A2"], ["mark-done", "1"])
+    clock["now"] = "2024-05-05 12:00:00"
+    capsys.readouterr()
+
+    with patch.object(task_cli, "build_rollups") as build:
+        run_cli(monkeypatch, ["report", "--days", "7"])
+    build.assert_not_called()
+    out = capsys.readouterr().out
+    assert "Created: 3   Done: 1" in out
+    assert "average 2.0 days over 1 tasks" in out
+    assert "Age of the 1 open tasks:" in out
+    assert "2024-W18   done     1   created     3" in out
+
+    # counting everything again gives the same numbers (task 3 is gone, so it isn't created anymore)
+    run_cli(monkeypatch, ["report", "--days", "7", "--rebuild"])
+    rebuilt = capsys.readouterr().out
+    assert rebuilt.replace("Created: 2", "Created: 3").replace("created     2", "created     3") == out
+
+
+# ---------------------------
+# Test import and export
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_export_then_import_round_trip(temp_tasks_file, monkeypatch, capsys, tmp_path, storage):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    monkeypatch.setattr(task_cli, "current_time", lambda: "2024-05-01 10:00:00")
+    run_cli(monkeypatch, ["add", 'Say "hi", then leave'], ["add", "B"], ["mark-done", "2"])
+    for fmt in ("csv", "jsonl"):
+        run_cli(monkeypatch, ["export", str(tmp_path / f"out.{fmt}")])
+    assert "Exported 2 task(s)" in capsys.readouterr().out
+
+    run_cli(monkeypatch, ["import", str(tmp_path / "out.csv")], ["import", str(tmp_path / "out.jsonl")])
+    assert capsys.readouterr().out.count("Imported 2 task(s).") == 2
+
+    # imported tasks get new IDs after the existing ones and keep everything else
+    run_cli(monkeypatch, ["export", "--format", "jsonl"])
+    tasks = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [task["id"] for task in tasks] == [1, 2, 3, 4, 5, 6]
+    assert [task["description"] for task in tasks[2:]] == ['Say "hi", then leave', "B"] * 2
+    assert [task["status"] for task in tasks[2:]] == ["todo", "done"] * 2
+    assert all(task["createdAt"] == "2024-05-01 10:00:00" for task in tasks)
+
+    run_cli(monkeypatch, ["export", "done", "--format", "csv"])
+    assert capsys.readouterr().out.splitlines() == [
+        "id,description,status,createdAt,updatedAt",
+        "2,B,done,2024-05-01 10:00:00,2024-05-01 10:00:00",
+        "4,B,done,2024-05-01 10:00:00,2024-05-01 10:00:00",
+        "6,B,done,2024-05-01 10:00:00,2024-05-01 10:00:00",
+    ]
+
+
+def test_import_in_blocks_across_processes(temp_tasks_file, monkeypatch, capsys, tmp_path):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    # tiny blocks, so rows (and a quoted field with a newline in it) end up cut between blocks
+    monkeypatch.setattr(task_cli, "IMPORT_BLOCK_BYTES", 64)
+    rows = ["description,status,createdAt"]
+    for i in range(1, 41):
+        rows.append(f"task {i},in-progress,2024-05-01 10:00:00")
+    rows[10] = '"two\nlines, ""quoted""",done,'
+    rows += [",todo,", "x,blocked,", "y,todo,yesterday", "too,many,columns,here"]
+    source = tmp_path / "in.csv"
+    source.write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+    run_cli(monkeypatch, ["import", str(source), "--jobs", "2"])
+    out = capsys.readouterr().out
+    assert "Imported 40 task(s)." in out
+    assert "Skipped 4 row(s):" in out
+    assert "  line 43: missing description" in out
+    assert "  line 44: unknown status 'blocked'" in out
+    assert "  line 45: 'yesterday' is not a time like 2024-05-01 13:45:00" in out
+    assert "  line 46: 4 columns instead of 3" in out
+
+    tasks = task_cli.load_tasks()
+    assert [task["id"] for task in tasks] == list(range(1, 41))
+    assert tasks[9]["description"] == 'two\nlines, "quoted"'
+    assert tasks[9]["status"] == "done"
+    assert tasks[39]["description"] == "task 40"
+
+    broken = tmp_path / "broken.jsonl"
+    broken.write_text('{"description": "ok"}\n{oops\n[1]\n', encoding="utf-8")
+    run_cli(monkeypatch, ["import", str(broken)])
+    out = capsys.readouterr().out
+    assert "Imported 1 task(s)." in out
+    assert "line 2: not valid JSON" in out and "line 3: not a JSON object" in out
+
+
+@pytest.mark.parametrize("storage", ["json", "sqlite", "mmap"])
+def test_big_import_is_one_history_line_and_a_checkpoint(
+    temp_tasks_file, monkeypatch, capsys, tmp_path, storage
+):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    monkeypatch.setattr(task_cli, "HISTORY_IMPORT_ROWS", 3)
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+    run_cli(monkeypatch, ["add", "before"])
+
+    source = tmp_path / "in.jsonl"
+    source.write_text("".join(json.dumps({"description": f"imported {i}"}) + "\n" for i in range(5)))
+    clock["now"] = "2024-05-02 10:00:00"
+    run_cli(monkeypatch, ["import", str(source)])
+    clock["now"] = "2024-05-03 10:00:00"
+    run_cli(monkeypatch, ["mark-done", "4"])
+
+    with open(task_cli.history_path(), encoding="utf-8") as f:
+        ops = [json.loads(line)["op"] for line in f]
+    assert ops == ["put", "import", "put"]
+
+    capsys.readouterr()
+    run_cli(monkeypatch, ["history", "4"])
+    assert capsys.readouterr().out.splitlines()[-2:] == [
+        "  2024-05-02 10:00:00  todo         imported 2",
+        "  2024-05-03 10:00:00  done         imported 2",
+    ]
+    run_cli(monkeypatch, ["list", "--as-of", "2024-05-01 12:00:00"], ["list", "--as-of", "2024-05-02 12:00:00"])
+    before, after = capsys.readouterr().out.split("before", 2)[1:]
+    assert "imported" not in before and after.count("imported") == 5
+
+
+# ---------------------------
+# Test store version and watch
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_version_goes_up_once_per_written_change(temp_tasks_file, monkeypatch, capsys, storage):
+    import io
+
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+
+    def version():
+        run_cli(monkeypatch, ["version"])
+        return int(capsys.readouterr().out.split()[-1])
+
+    assert version() == 0
+    run_cli(monkeypatch, ["add", "A"], ["list"], ["stats"])
+    assert version() == 1
+    # a batch is written once, so it is one version
+    monkeypatch.setattr(sys, "stdin", io.StringIO("add B\nadd C\nmark-done 1\n"))
+    run_cli(monkeypatch, ["batch"])
+    assert version() == 2
+    run_cli(monkeypatch, ["mark-done", "9"])
+    assert version() == 2
+
+
+def test_watch_prints_only_the_changed_tasks(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    monkeypatch.setattr(task_cli, "current_time", lambda: "2024-05-01 10:00:00")
+    run_cli(monkeypatch, ["add", "A"], ["add", "B"])
+    capsys.readouterr()
+
+    # the change happens while watch is waiting for one
+    def wait(self, timeout=None):
+        run_cli(monkeypatch, ["mark-done", "1"], ["delete", "2"])
+        capsys.readouterr()
+
+    monkeypatch.setattr(task_cli.VersionWatcher, "wait", wait)
+    task_cli.command_watch(None, ["--once"])
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {
+            "version": 4,
+            "at": "2024-05-01 10:00:00",
+            "op": "put",
+            "task": {
+                "id": 1,
+                "description": "A",
+                "status": "done",
+                "createdAt": "2024-05-01 10:00:00",
+                "updatedAt": "2024-05-01 10:00:00",
+            },
+        },
+        {"version": 4, "at": "2024-05-01 10:00:00", "op": "delete", "id": 2},
+    ]
+
+
+@pytest.mark.parametrize("mode", ["inotify", "poll"])
+def test_version_watcher_wakes_up_on_a_change(temp_tasks_file, monkeypatch, mode):
+    import threading
+    import time
+
+    monkeypatch.setenv("TASK_CLI_WATCH", mode)
+    watcher = task_cli.VersionWatcher()
+    if mode == "inotify" and watcher.fd is None:
+        pytest.skip("no inotify here")
+    try:
+        threading.Timer(0.2, task_cli.bump_version).start()
+        start = time.monotonic()
+        while task_cli.load_version()[0] == 0:
+            watcher.wait(5)
+            assert time.monotonic() - start < 3
+    finally:
+        watcher.close()
+
+
+def test_http_etag_answers_not_modified(http_api):
+    import http.client
+
+    def get(path, etag=None):
+        client = http.client.HTTPConnection("127.0.0.1", http_api.port, timeout=10)
+        try:
+            client.request("GET", path, headers={"If-None-Match": etag} if etag else {})
+            response = client.getresponse()
+            response.read()
+            return response.status, response.getheader("ETag")
+        finally:
+            client.close()
+
+    http_api("POST", "/tasks", {"description": "Buy milk"})
+    status, etag = get("/stats")
+    assert status == 200 and etag
+    assert get("/stats", etag) == (304, etag)
+    assert get("/tasks", etag) == (304, etag)
+
+    # a change that is not written yet already gets a new ETag
+    http_api("POST", "/tasks", {"description": "Buy bread"})
+    status, new_etag = get("/tasks", etag)
+    assert status == 200 and new_etag != etag
+
+
+# ---------------------------
+# Test the TaskStore library API
+# ---------------------------
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite", "mmap"])
+def test_task_store_works_without_printing(temp_tasks_file, monkeypatch, capsys, storage):
+    monkeypatch.setattr(task_cli, "current_time", lambda: "2024-05-01 10:00:00")
+    tasks = task_cli.TaskStore(storage=storage)
+
+    assert tasks.add("Buy milk")["id"] == 1
+    assert tasks.add("Call mom")["id"] == 2
+    assert tasks.update(1, "Buy oat milk")["description"] == "Buy oat milk"
+    assert tasks.mark(2, "done")["status"] == "done"
+    assert tasks.get(2) == {
+        "id": 2,
+        "description": "Call mom",
+        "status": "done",
+        "createdAt": "2024-05-01 10:00:00",
+        "updatedAt": "2024-05-01 10:00:00",
+    }
+    assert [task["id"] for task in tasks.list("todo")] == [1]
+    assert tasks.stats() == {"todo": 1, "in-progress": 0, "done": 1, "total": 2, "archived": 0}
+    assert tasks.query("status=done") == 1
+    assert tasks.query(group_by="status") == {"todo": 1, "in-progress": 0, "done": 1}
+
+    tasks.delete(2)
+    with pytest.raises(task_cli.TaskNotFound):
+        tasks.get(2)
+    with pytest.raises(task_cli.TaskNotFound):
+        tasks.mark(2, "todo")
+    with pytest.raises(ValueError):
+        tasks.mark(1, "finished")
+    with pytest.raises(ValueError):
+        tasks.add("  ")
+    tasks.close()
+    assert capsys.readouterr().out == ""
+
+
+def test_task_store_transaction_is_one_save(temp_tasks_file, monkeypatch):
+    tasks = task_cli.TaskStore(storage="json")
+    tasks.add("first")
+    version = tasks.version()
+
+    saves = []
+    save_tasks = task_cli.save_tasks
+    monkeypatch.setattr(task_cli, "save_tasks", lambda *args: saves.append(1) or save_tasks(*args))
+    with tasks.transaction():
+        for number in range(50):
+            tasks.add(f"task {number}")
+        tasks.mark(1, "done")
+        # nested ones join the outer transaction
+        with tasks.transaction():
+            tasks.delete(2)
+        # nobody else gets in while it runs
+        with pytest.raises(task_cli.LockTimeout), task_cli.using_tasks_file(tasks.path):
+            with task_cli.store_lock(timeout=0):
+                pass
+
+    assert len(saves) == 1
+    assert tasks.version() == version + 1
+    assert task_cli.TaskStore(storage="json").stats()["total"] == 50
+
+
+@pytest.mark.parametrize("storage", ["json", "journal", "sqlite"])
+def test_task_store_transaction_throws_changes_away_on_error(temp_tasks_file, storage):
+    tasks = task_cli.TaskStore(storage=storage)
+    tasks.add("keep me")
+
+    with pytest.raises(RuntimeError):
+        with tasks.transaction():
+            tasks.add("not me")
+            tasks.mark(1, "done")
+            raise RuntimeError("changed my mind")
+
+    assert tasks.list() == task_cli.TaskStore(storage=storage).list()
+    assert [(task["description"], task["status"]) for task in tasks.list()] == [("keep me", "todo")]
+
+
+def test_task_store_sees_what_other_commands_saved(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    tasks = task_cli.TaskStore(storage="json")
+    tasks.add("from python")
+
+    run_cli(monkeypatch, ["add", "from the command line"], ["mark-done", "1"])
+    assert [task["status"] for task in tasks.list()] == ["done", "todo"]
+    assert tasks.add("one more")["id"] == 3
+
+
+@pytest.mark.parametrize("storage", ["json", "sqlite"])
+def test_task_stores_in_two_threads(tmp_path, capsys, storage):
+    import threading
+
+    stores = [task_cli.TaskStore(str(tmp_path / f"{name}.json"), storage) for name in "ab"]
+    shared = task_cli.TaskStore(str(tmp_path / "shared.json"), storage)
+
+    def work(tasks, name):
+        for number in range(100):
+            tasks.add(f"{name} {number}")
+            shared.add(f"{name} {number}")
+
+    threads = [threading.Thread(target=work, args=(tasks, name)) for tasks, name in zip(stores, "ab")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for tasks, name in zip(stores, "ab"):
+        assert [task["description"] for task in tasks.list()] == [f"{name} {n}" for n in range(100)]
+        tasks.close()
+    assert shared.stats()["total"] == 200
+    assert len({task["id"] for task in shared.list()}) == 200
+    shared.close()
+    assert capsys.readouterr().out == ""
+
+
+def test_task_store_project(temp_tasks_file):
+    tasks = task_cli.TaskStore(project="work")
+    tasks.add("in a project")
+    assert tasks.path == task_cli.project_file("work", str(temp_tasks_file))
+    assert task_cli.TaskStore().list() == []
+    with pytest.raises(ValueError):
+        task_cli.TaskStore(project="../elsewhere")
+
+
+# ---------------------------
+# Test query
+# ---------------------------
+@pytest.mark.parametrize("engine", ["array", "numpy"])
+def test_query_counts_and_groups(temp_tasks_file, monkeypatch, capsys, engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    clock = {"now": "2024-05-01 10:00:00"}
+    monkeypatch.setattr(task_cli, "current_time", lambda: clock["now"])
+    run_cli(monkeypatch, ["add", "buy milk"], ["add", "x" * 210], ["mark-in-progress", "2"])
+    clock["now"] = "2024-06-01 10:00:00"
+    run_cli(monkeypatch, ["add", "milk again"], ["mark-done", "3"])
+    clock["now"] = "2024-06-20 10:00:00"
+    capsys.readouterr()
+
+    def query(*args):
+        run_cli(monkeypatch, ["query", "--engine", engine, *args])
+        return capsys.readouterr().out
+
+    assert query() == "3 task(s) match.\n"
+    assert query("status=in-progress", "idle>7") == "1 task(s) match.\n"
+    assert query("idle<=30") == "1 task(s) match.\n"
+    assert query("description~milk", "status!=done") == "1 task(s) match.\n"
+    assert query("length>200", "id>=2", "updated<2024-06-01") == "1 task(s) match.\n"
+
+    out = query("--group-by", "status")
+    assert [line.split() for line in out.splitlines()[3:6]] == [["todo", "1"], ["in-progress", "1"], ["done", "1"]]
+    out = query("--group-by", "created-month")
+    assert "2024-05                2" in out and "2024-06                1" in out
+
+    assert "unknown field 'colour'" in query("colour=red")
+
+
+def test_query_array_engine_matches_a_loop():
+    import random
+
+    rng = random.Random(3)
+    start = task_cli.parse_timestamp("2024-01-01 00:00:00")
+    tasks = []
+    for task_id in range(1, 501):
+        created = start + rng.randrange(90 * 86400)
+        updated = created + rng.randrange(30 * 86400)
+        tasks.append(
+            task_cli.Task(
+                task_id,
+                "x" * rng.choice((0, 10, 254, 255, 300)),
+                rng.randrange(3),
+                # a few tasks without a time we could read
+                rng.choice((created, created, created, "long ago")),
+                rng.choice((updated, updated, updated, "someday")),
+            )
+        )
+    columns = task_cli.TaskColumns.build(tasks)
+    now = start + 120 * 86400
+    engines = [task_cli.query_array]
+    try:
+        import numpy  # noqa: F401
+
+        engines.append(task_cli.query_numpy)
+    except ImportError:
+        pass
+
+    def loop(condition, group):
+        name, op, value = task_cli.parse_query_condition(condition, now)
+        compare = task_cli.QUERY_OPERATORS[op]
+        rows = []
+        for task in tasks:
+            updated = task.updated if isinstance(task.updated, int) else task_cli.NO_TIME
+            fields = {
+                "created": task.created,
+                "updated": task.updated,
+                "lengths": len(task.description),
+                "ids": task.id,
+            }
+            # a task without a time never matches a condition on it
+            if isinstance(fields[name], int) and compare(fields[name], value):
+                rows.append((task, updated))
+        if group == "status":
+            return {code: sum(task.status == code for task, _ in rows) for code in range(3)}
+        counts = {}
+        for task, updated in rows:
+            if updated != task_cli.NO_TIME:
+                counts[updated // 86400] = counts.get(updated // 86400, 0) + 1
+        return counts
+
+    for op in ("<", "<=", ">", ">=", "=", "!="):
+        for condition in (
+            f"length{op}255",
+            f"length{op}254",
+            f"length{op}300",
+            f"idle{op}40",
+            f"age{op}60",
+            f"updated{op}2024-03-01",
+            f"created{op}2024-02-01",
+            f"id{op}250",
+        ):
+            for group in ("status", "updated-day"):
+                parsed = [task_cli.parse_query_condition(condition, now)]
+                for engine in engines:
+                    assert engine(columns, parsed, group) == loop(condition, group), (
+                        engine,
+                        condition,
+                        group,
+                    )
+
+
+def test_query_columns_are_kept_until_the_tasks_change(temp_tasks_file, monkeypatch, capsys):
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, ["add", "A"], ["query"])
+    assert os.path.exists(task_cli.columns_path())
+
+    with patch.object(task_cli.TaskColumns, "build") as build:
+        run_cli(monkeypatch, ["query", "description~A"])
+    build.assert_not_called()
+
+    run_cli(monkeypatch, ["add", "B"])
+    capsys.readouterr()
+    run_cli(monkeypatch, ["query"])
+    assert capsys.readouterr().out == "2 task(s) match.\n"
+
+
+@pytest.mark.parametrize("storage", ["json", "journal"])
+def test_query_columns_take_changes_without_building_again(
+    temp_tasks_file, monkeypatch, capsys, storage
+):
+    monkeypatch.setenv("TASK_CLI_STORAGE", storage)
+    monkeypatch.setenv("TASK_CLI_SERVER", "off")
+    run_cli(monkeypatch, *[["add", f"Task {i}"] for i in range(6)], ["query"])
+
+    def columns_as_built():
+        built = task_cli.TaskColumns.build(task_cli.load_tasks())
+        return [list(getattr(built, name)) for name, _ in task_cli.TaskColumns.FIELDS]
+
+    # added, changed (and so moved to the end), deleted and compacted in between
+    times = iter(f"2099-05-{day} 10:00:00" for day in range(10, 29))
+    monkeypatch.setattr(task_cli, "current_time", lambda: next(times))
+    run_cli(monkeypatch, ["add", "Late"], ["mark-done", "2"], ["update", "4", "Four"], ["delete", "5"])
+    if storage == "journal":
+        assert task_cli.compact_journal() is True
+    expected = columns_as_built()
+
+    with patch.object(task_cli.TaskColumns, "build") as build:
+        columns = task_cli.load_columns(task_cli.JsonStore())
+    build.assert_not_called()
+    assert [list(getattr(columns, name)) for name, _ in task_cli.TaskColumns.FIELDS] == expected
+    assert columns.descriptions[-2:] == ["Task 1", "Four"]
+    assert not os.path.exists(task_cli.column_changes_path())
+    assert task_cli.TaskColumns.load(task_cli.columns_path(), task_cli.summary_stamp()) is not None
+
+    # a change the log never saw: the columns are built again
+    run_cli(monkeypatch, ["add", "Next"])
+    tasks = json.loads(temp_tasks_file.read_text())
+    tasks[0]["status"] = "done"
+    temp_tasks_file.write_text(json.dumps(tasks))
+    capsys.readouterr()
+    run_cli(monkeypatch, ["query", "status=done"])
+    assert capsys.readouterr().out == "2 task(s) match.\n"
+
+
+# ---------------------------
+# Test the benchmark suite
+# ---------------------------
+def test_benchmark_suite_results_and_baseline(tmp_path):
+    import subprocess
+
+    suite = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "suite.py")
+    command = [sys.executable, suite, "--sizes", "10", "--repeat", "1", "--no-subprocess"]
+    baseline = tmp_path / "baseline.json"
+
+    subprocess.run(command + ["--output", str(baseline)], check=True, capture_output=True)
+    results = json.loads(baseline.read_text())["results"]
+    assert {result["case"] for result in results} >= {"load_tasks", "list", "stats", "clear-done"}
+    assert all(result["peak_memory_bytes"] > 0 for result in results)
+
+    # nothing can be 1000 times faster than before, so every case is a regression
+    done = subprocess.run(
+        command + ["--baseline", str(baseline), "--threshold", "0.001"], capture_output=True, text=True
+    )
+    assert done.returncode == 1
+    assert "REGRESSION: list (10 tasks, in_process)" in done.stderr